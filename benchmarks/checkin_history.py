@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Benchmark the local part of a check-in against a growing job history.
+
+Creates job histories of increasing size in a temporary directory and times
+the job bookkeeping a check-in does (finding pending, running and unsent jobs,
+sending results and archiving), with the network calls stubbed out. With
+archiving the time per check-in should stay flat as the history grows.
+
+Usage: python3 benchmarks/checkin_history.py [<history size> ...]
+"""
+
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from unittest import mock
+
+from os2borgerpc.client import jobmanager
+
+CHECKINS = 5
+
+
+def make_history(jobs_dir, size):
+    """Create size finished and sent jobs, spread over the last year."""
+    now = datetime.now()
+    for job_id in range(1, size + 1):
+        job_dir = os.path.join(jobs_dir, str(job_id))
+        os.makedirs(job_dir)
+        timestamp = str(now - timedelta(minutes=(size - job_id) * 60))
+        for name, value in [
+            ("status", "DONE"),
+            ("started", timestamp),
+            ("finished", timestamp),
+            ("sent", timestamp),
+            ("output.log", ">>> Succeeded at %s\n" % timestamp),
+        ]:
+            with open(os.path.join(job_dir, name), "w") as fh:
+                fh.write(value)
+
+
+def checkin():
+    """Run the job bookkeeping of a check-in."""
+    jobmanager.run_pending_jobs()
+    jobmanager.fail_unfinished_jobs()
+    jobmanager.send_unsent_jobs()
+    jobmanager.archive_old_jobs()
+
+
+def bench(size):
+    """Return the average check-in time in ms for a history of size jobs."""
+    with tempfile.TemporaryDirectory() as jobs_dir, mock.patch.object(
+        jobmanager, "JOBS_DIR", jobs_dir
+    ), mock.patch.object(jobmanager, "report_job_results", return_value=0):
+        make_history(jobs_dir, size)
+        # The first check-in migrates and archives the history
+        start = time.perf_counter()
+        checkin()
+        first = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(CHECKINS):
+            checkin()
+        steady = (time.perf_counter() - start) / CHECKINS
+        remaining = len([f for f in os.listdir(jobs_dir) if f.isdigit()])
+        return first * 1000, steady * 1000, remaining
+
+
+def main(sizes):
+    """Print the timings for each history size."""
+    print("%8s %14s %14s %10s" % ("history", "first (ms)", "steady (ms)", "on disk"))
+    for size in sizes:
+        first, steady, remaining = bench(size)
+        print("%8d %14.1f %14.2f %10d" % (size, first, steady, remaining))
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [100, 1000, 5000])
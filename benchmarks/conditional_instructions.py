@@ -0,0 +1,127 @@
+"""
+Benchmark conditional get_instructions against full instructions.
+
+Runs check-ins against a local stand-in XML-RPC server whose configuration
+and security scripts don't change, with and without support for instruction
+digests, and prints the bytes received per check-in and how many times the
+configuration file was written. Before conditional instructions the client
+wrote the configuration file at every check-in.
+
+Usage: python3 benchmarks/conditional_instructions.py [<config keys> ...]
+"""
+
+import os
+import socketserver
+import sys
+import tempfile
+import threading
+from unittest import mock
+from xmlrpc.server import SimpleXMLRPCRequestHandler
+from xmlrpc.server import SimpleXMLRPCServer
+
+from os2borgerpc.client import jobmanager
+from os2borgerpc.client.admin_client import OS2borgerPCAdmin
+from os2borgerpc.client.config import OS2borgerPCConfig
+from os2borgerpc.client.utils import json_digest
+
+SCRIPT = """#!/usr/bin/env bash
+EVENT_FILE=/etc/os2borgerpc/security/securityevent.csv
+journalctl --since "5 minutes ago" --grep "sudo" --output short-iso |
+    while read -r line; do
+        echo "$(date +%Y%m%d%H%M%S),$line" >> "$EVENT_FILE"
+    done
+"""
+CHECKINS = 10
+
+
+class ThreadingXMLRPCServer(socketserver.ThreadingMixIn, SimpleXMLRPCServer):
+    """Stand-in for the admin site."""
+
+    daemon_threads = True
+    block_on_close = False
+
+
+class Handler(SimpleXMLRPCRequestHandler):
+    """Keep connections alive, like the admin site."""
+
+    protocol_version = "HTTP/1.1"
+
+
+def make_server(keys, conditional):
+    """Return a server with keys config keys, supporting digests or not."""
+    instructions = {
+        "capabilities": (
+            [jobmanager.CONDITIONAL_INSTRUCTIONS_CAPABILITY] if conditional else []
+        ),
+        "jobs": [],
+        "configuration": {"key_%d" % i: "value %d" % i for i in range(keys)},
+        "security_scripts": [
+            {"name": "script %d" % i, "executable_code": SCRIPT} for i in range(5)
+        ],
+    }
+
+    def get_instructions(uid, digests=None):
+        if not conditional and digests is not None:
+            raise TypeError("get_instructions takes 1 argument")
+        return {
+            name: value
+            for name, value in instructions.items()
+            if not digests or digests.get(name) != json_digest(value)
+        }
+
+    server = ThreadingXMLRPCServer(
+        ("127.0.0.1", 0), requestHandler=Handler, allow_none=True, logRequests=False
+    )
+    server.register_function(get_instructions, "get_instructions")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def checkin(admin):
+    """Fetch and apply the instructions of a check-in."""
+    digests = jobmanager.get_instruction_digests()
+    instructions = jobmanager.fetch_instructions(admin, "uid", digests)
+    if "configuration" in instructions:
+        jobmanager.update_configuration_from_server(instructions["configuration"])
+    jobmanager.save_instruction_digests(instructions, digests)
+
+
+def bench(keys, conditional):
+    """Return the bytes received per check-in and the config file writes."""
+    server = make_server(keys, conditional)
+    admin = OS2borgerPCAdmin("http://127.0.0.1:%d/RPC2" % server.server_address[1])
+    with tempfile.TemporaryDirectory() as tmp, mock.patch.object(
+        jobmanager,
+        "OS2borgerPCConfig",
+        lambda: OS2borgerPCConfig([os.path.join(tmp, "os2borgerpc.conf")]),
+    ), mock.patch.object(
+        jobmanager, "OUTBOX_FILE", os.path.join(tmp, "outbox.jsonl")
+    ), mock.patch.object(
+        jobmanager, "INSTRUCTION_DIGESTS_FILE", os.path.join(tmp, "digests.json")
+    ), mock.patch.object(
+        OS2borgerPCConfig, "save", autospec=True, side_effect=OS2borgerPCConfig.save
+    ) as save_mock:
+        try:
+            for _ in range(CHECKINS):
+                checkin(admin)
+        finally:
+            server.shutdown()
+            server.server_close()
+    received = admin.transport.stats["received_bytes"] / CHECKINS
+    return received, save_mock.call_count
+
+
+def main(key_counts):
+    """Print the bytes and config writes for each number of config keys."""
+    print("%6s %12s %12s %14s" % ("keys", "digests", "recv (kB)", "config writes"))
+    for keys in key_counts:
+        for conditional in (False, True):
+            received, writes = bench(keys, conditional)
+            print(
+                "%6d %12s %12.1f %11d/%d"
+                % (keys, conditional, received / 1024, writes, CHECKINS)
+            )
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10, 50, 200])
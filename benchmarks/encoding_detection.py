@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Benchmark reading job logs with encoding detection.
+
+Compares running chardet on the full content of a log, as the jobmanager
+used to, with get_file_encoding, which only runs chardet on a sample of logs
+that aren't valid utf-8 and caches the result. Each size is tested with a
+utf-8 log and a log with a single latin-1 character near the end.
+
+Usage: python3 benchmarks/encoding_detection.py [<size in MB> ...]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import chardet
+
+from os2borgerpc.client import jobmanager
+
+LINE = "Get:1 http://archive.ubuntu.com/ubuntu focal/main amd64 libfoo1 [52,3 kB]\n"
+
+
+def make_log(path, size, tail):
+    """Write a log of about size bytes ending in tail."""
+    line = LINE.encode("utf-8")
+    with open(path, "wb") as fh:
+        fh.write(line * (size // len(line)))
+        fh.write(tail)
+
+
+def full_detection(path):
+    """Read a file the old way, detecting the encoding of all of it."""
+    with open(path, "rb") as fh:
+        chardet.detect(fh.read())
+
+
+def sampled_detection(path):
+    """Read a file with get_file_encoding."""
+    with open(path, "rb") as fh:
+        st = os.fstat(fh.fileno())
+        content = fh.read()
+    encoding = jobmanager.get_file_encoding(path, st, content)
+    if encoding:
+        content.decode(encoding)
+
+
+def timed(function, *args):
+    """Return the time in seconds for one call of function."""
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def main(sizes):
+    """Print the timings for each log size."""
+    print(
+        "%6s %8s %12s %12s %12s"
+        % ("MB", "log", "full (s)", "sampled (s)", "cached (s)")
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            for kind, tail in [
+                ("utf-8", "Færdig\n".encode("utf-8")),
+                ("latin-1", "Færdig\n".encode("latin-1")),
+            ]:
+                path = os.path.join(tmp, "%d-%s.log" % (size, kind))
+                make_log(path, size * 1024 * 1024, tail)
+                jobmanager._encoding_cache.clear()
+                full = timed(full_detection, path)
+                sampled = timed(sampled_detection, path)
+                cached = timed(sampled_detection, path)
+                print(
+                    "%6d %8s %12.3f %12.3f %12.3f" % (size, kind, full, sampled, cached)
+                )
+                os.remove(path)
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [1, 10, 100])
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Benchmark removing control characters from job logs.
+
+Compares the per character unicodedata.category generator the jobmanager
+used to run on every report with sanitize_log, for an ASCII log with
+terminal escapes and a log with non-ASCII text. Logs are now sanitized when
+jobs finish, so the last column is the check of a sanitized log on report.
+
+Usage: python3 benchmarks/log_sanitizing.py [<size in MB> ...]
+"""
+
+import sys
+import time
+import unicodedata
+
+from os2borgerpc.client.joblog import sanitize_log
+
+LINES = {
+    "ascii": "\x1b[32mGet:1\x1b[0m http://archive.ubuntu.com/ubuntu focal/main\r\n",
+    "unicode": "Hentet:1 http://archive.ubuntu.com/ubuntu focal/main [52,3 kB] æøå\n",
+}
+
+
+def generator_sanitize(text):
+    """Sanitize text the old way, one unicodedata lookup per character."""
+    return "".join(
+        ch
+        for ch in text
+        if unicodedata.category(ch)[0] != "C" or ch == "\n" or ch == "\t"
+    )
+
+
+def timed(function, *args):
+    """Return the result and time in seconds for one call of function."""
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main(sizes):
+    """Print the timings for each log size."""
+    print(
+        "%6s %8s %14s %14s %8s %12s"
+        % ("MB", "log", "generator (s)", "sanitize (s)", "x", "report (s)")
+    )
+    for size in sizes:
+        for kind, line in LINES.items():
+            text = line * (size * 1024 * 1024 // len(line))
+            old, old_time = timed(generator_sanitize, text)
+            new, new_time = timed(sanitize_log, text)
+            assert old == new
+            _, report_time = timed(sanitize_log, new)
+            print(
+                "%6d %8s %14.3f %14.4f %8.0f %12.4f"
+                % (size, kind, old_time, new_time, old_time / new_time, report_time)
+            )
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [1, 10])
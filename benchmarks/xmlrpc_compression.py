@@ -0,0 +1,128 @@
+"""
+Benchmark gzip compression of the XML-RPC traffic with the admin site.
+
+Runs a check-in's get_instructions and send_status_info calls against a
+local stand-in XML-RPC server, with and without compression, and prints
+the bytes on the wire and the time spent. The instructions hold jobs with
+scripts like those on the admin site, the status info holds apt logs.
+
+Usage: python3 benchmarks/xmlrpc_compression.py [<jobs per call> ...]
+"""
+
+import socketserver
+import sys
+import threading
+import time
+from xmlrpc.server import SimpleXMLRPCRequestHandler
+from xmlrpc.server import SimpleXMLRPCServer
+
+from os2borgerpc.client import admin_client
+from os2borgerpc.client.admin_client import OS2borgerPCAdmin
+
+SCRIPT = """#!/usr/bin/env bash
+set -ex
+export DEBIAN_FRONTEND=noninteractive
+apt-get update --assume-yes
+apt-get install --assume-yes --no-install-recommends "$1"
+if [ "$2" = "True" ]; then
+    gsettings set org.gnome.desktop.screensaver lock-enabled false
+fi
+"""
+LOG_LINE = "Get:%d http://archive.ubuntu.com/ubuntu focal-updates/main amd64 [52 kB]\n"
+CHECKINS = 5
+
+
+class ThreadingXMLRPCServer(socketserver.ThreadingMixIn, SimpleXMLRPCServer):
+    """Stand-in for the admin site."""
+
+    daemon_threads = True
+    block_on_close = False
+
+
+class Handler(SimpleXMLRPCRequestHandler):
+    """Keep connections alive, like the admin site."""
+
+    protocol_version = "HTTP/1.1"
+
+
+def make_server(jobs):
+    """Return a server answering get_instructions with jobs jobs."""
+    instructions = {
+        "jobs": [
+            {
+                "id": i,
+                "status": "SUBMITTED",
+                "executable_code": SCRIPT + "# job %d\n" % i,
+                "parameters": [{"type": "STRING", "value": "firefox"}],
+            }
+            for i in range(jobs)
+        ],
+        "configuration": {"key_%d" % i: "value %d" % i for i in range(50)},
+    }
+    server = ThreadingXMLRPCServer(
+        ("127.0.0.1", 0), requestHandler=Handler, allow_none=True, logRequests=False
+    )
+    server.register_function(lambda uid: instructions, "get_instructions")
+    server.register_function(
+        lambda uid, package_data, job_data, update_required: 0, "send_status_info"
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def checkin(admin, job_data):
+    """Make the calls of a check-in."""
+    admin.get_instructions("uid")
+    admin.send_status_info("uid", None, job_data, None)
+
+
+def bench(jobs, compress):
+    """Return the transport stats and time per check-in in ms."""
+    server = make_server(jobs)
+    admin = OS2borgerPCAdmin("http://127.0.0.1:%d/RPC2" % server.server_address[1])
+    admin.transport.accept_gzip_encoding = compress
+    if compress:
+        admin.transport.encode_threshold = admin_client.DEFAULT_GZIP_MIN_SIZE
+    job_data = [
+        {
+            "id": i,
+            "status": "DONE",
+            "log_output": "".join(LOG_LINE % n for n in range(200)),
+        }
+        for i in range(jobs)
+    ]
+    try:
+        start = time.perf_counter()
+        for _ in range(CHECKINS):
+            checkin(admin, job_data)
+        elapsed = (time.perf_counter() - start) / CHECKINS
+    finally:
+        server.shutdown()
+        server.server_close()
+    return admin.transport.stats, elapsed * 1000
+
+
+def main(job_counts):
+    """Print the bytes and times per check-in for each number of jobs."""
+    print(
+        "%6s %6s %12s %12s %14s %10s"
+        % ("jobs", "gzip", "sent (kB)", "recv (kB)", "compress (ms)", "total (ms)")
+    )
+    for jobs in job_counts:
+        for compress in (False, True):
+            stats, elapsed = bench(jobs, compress)
+            print(
+                "%6d %6s %12.1f %12.1f %14.2f %10.2f"
+                % (
+                    jobs,
+                    compress,
+                    stats["sent_bytes"] / 1024 / CHECKINS,
+                    stats["received_bytes"] / 1024 / CHECKINS,
+                    stats["compress_time"] * 1000 / CHECKINS,
+                    elapsed,
+                )
+            )
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [1, 10, 50])
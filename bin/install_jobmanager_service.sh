@@ -0,0 +1,64 @@
+#!/usr/bin/env bash
+#================================================================
+# HEADER
+#================================================================
+#% SYNOPSIS
+#+    install_jobmanager_service args $(interval in minutes)
+#%
+#% DESCRIPTION
+#%    This script runs jobmanager as a long-running systemd service,
+#%    jobmanager --daemon, checking in with the given interval, instead
+#%    of starting it from cron.d/os2borgerpc-jobmanager. The service
+#%    randomizes the check-in times itself.
+#%    Run randomize_jobmanager.sh to go back to cron.
+#%
+#================================================================
+# END_OF_HEADER
+#================================================================
+
+INTERVAL=$1
+
+SERVICE_NAME="os2borgerpc-jobmanager.service"
+SERVICE_PATH="/etc/systemd/system/$SERVICE_NAME"
+CRON_PATH="/etc/cron.d/os2borgerpc-jobmanager"
+
+if [ $# -ne 1 ]; then
+    echo "This job takes exactly one parameter."
+    exit 1
+fi
+
+# The same bounds as randomize_jobmanager.sh
+if [ "$INTERVAL" -gt 59 ] || [ "$INTERVAL" -lt 3 ]; then
+    echo "Interval must be between 3 and 59 inclusive."
+    exit 1
+fi
+
+set_os2borgerpc_config checkin_interval $((INTERVAL*60))
+# The admin site removes config keys it doesn't know at the next check-in
+os2borgerpc_push_config_keys checkin_interval
+
+# Note: The PATH below is inherited by the scripts jobmanager runs. Fx. they can't find scripts in /usr/local/bin without it
+# KillMode=process leaves anything the jobs started in the background running when the service restarts, like with cron
+cat <<EOF > "$SERVICE_PATH"
+[Unit]
+Description=OS2borgerPC jobmanager
+Wants=network-online.target
+After=network-online.target
+
+[Service]
+Environment=PATH=/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin
+ExecStart=/usr/local/bin/jobmanager --daemon
+ExecReload=/bin/kill -USR1 \$MAINPID
+KillMode=process
+TimeoutStopSec=15min
+Restart=always
+RestartSec=60
+
+[Install]
+WantedBy=multi-user.target
+EOF
+
+rm --force "$CRON_PATH"
+
+systemctl daemon-reload
+systemctl enable --now "$SERVICE_NAME"
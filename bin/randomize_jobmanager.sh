@@ -31,6 +31,8 @@ INTERVAL=$1
 
 CHECKIN_SCRIPT="/usr/share/os2borgerpc/bin/check-in.sh"
 CRON_PATH="/etc/cron.d/os2borgerpc-jobmanager"
+SERVICE_NAME="os2borgerpc-jobmanager.service"
+SERVICE_PATH="/etc/systemd/system/$SERVICE_NAME"
 
 if [ $# -ne 1 ]; then
     echo "This job takes exactly one parameter."
@@ -42,6 +44,13 @@ if [ "$INTERVAL" -gt 59 ] || [ "$INTERVAL" -lt 3 ]; then
     exit 1
 fi
 
+# Stop the jobmanager service, if install_jobmanager_service.sh has installed it
+if [ -f "$SERVICE_PATH" ]; then
+    systemctl disable --now "$SERVICE_NAME"
+    rm "$SERVICE_PATH"
+    systemctl daemon-reload
+fi
+
 RANDOM_NUMBER=$((RANDOM%INTERVAL+0))
 CRON_COMMAND="$RANDOM_NUMBER,"
 
@@ -1,7 +1,22 @@
 """Module for the admin client."""
 
+import contextlib
+import threading
+import time
 import xmlrpc.client
 
+# Socket timeout in seconds for each call to the admin site
+DEFAULT_CALL_TIMEOUT = 60
+# Requests at least this many bytes long are gzip compressed, once the
+# admin site has said it accepts compressed requests
+DEFAULT_GZIP_MIN_SIZE = 1024
+# HTTP statuses meaning the server didn't accept a compressed request
+GZIP_REJECTED_STATUSES = (400, 411, 415, 501)
+
+# Shared admin clients, by URL
+_admins = {}
+_admins_lock = threading.Lock()
+
 
 def get_default_admin(verbose=False):
     """Return the default OS2borgerPCAdmin object."""
@@ -13,13 +28,213 @@ def get_default_admin(verbose=False):
     return OS2borgerPCAdmin("".join([admin_url, xml_rpc_url]), verbose=verbose)
 
 
+def get_admin(url):
+    """
+    Return the process-wide OS2borgerPCAdmin for url.
+
+    All calls made through it share one keep-alive connection.
+    """
+    with _admins_lock:
+        if url not in _admins:
+            _admins[url] = OS2borgerPCAdmin(url)
+        return _admins[url]
+
+
+class DeadlineExceeded(TimeoutError):
+    """The deadline for calls to the admin site has passed."""
+
+
+class KeepAliveTransport(xmlrpc.client.SafeTransport):
+    """
+    XML-RPC transport reusing one HTTP(S) connection for all calls.
+
+    The connection is kept open between calls for as long as the server
+    allows, and reopened when it has been closed. New connections are
+    opened eagerly so the time spent on the TCP and TLS handshakes can be
+    recorded, see stats.
+
+    Every call times out if the server doesn't answer within timeout
+    seconds, and no call may run past deadline, a time.monotonic() value.
+
+    Responses are always accepted gzip compressed. Requests of at least
+    encode_threshold bytes are sent gzip compressed, if it is set. Should
+    the server reject a compressed request, the request is sent again
+    uncompressed and compression is turned off. The bytes sent and received
+    and the time spent compressing are recorded too.
+    """
+
+    def __init__(self, use_https=True, timeout=DEFAULT_CALL_TIMEOUT, **kwargs):
+        """Use https or plain http for the connection."""
+        super().__init__(**kwargs)
+        self.use_https = use_https
+        self.timeout = timeout
+        self.deadline = None
+        self._call_timeout = timeout
+        self.connections = 0
+        self.reused = 0
+        self.handshake_time = 0.0
+        self.request_bytes = 0
+        self.sent_bytes = 0
+        self.received_bytes = 0
+        self.compress_time = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self):
+        """Return the connection and transfer counts, and times in seconds."""
+        return {
+            "connections": self.connections,
+            "reused": self.reused,
+            "handshake_time": self.handshake_time,
+            "request_bytes": self.request_bytes,
+            "sent_bytes": self.sent_bytes,
+            "received_bytes": self.received_bytes,
+            "compress_time": self.compress_time,
+        }
+
+    def request(self, host, handler, request_body, verbose=False):
+        """Make a request, one at a time over the shared connection."""
+        with self._lock:
+            self._call_timeout = self.timeout
+            if self.deadline is not None:
+                remaining = self.deadline - time.monotonic()
+                if remaining <= 0:
+                    raise DeadlineExceeded("Deadline for the admin site passed")
+                if self._call_timeout is None or remaining < self._call_timeout:
+                    self._call_timeout = remaining
+            try:
+                return super().request(host, handler, request_body, verbose)
+            except xmlrpc.client.ProtocolError as e:
+                if (
+                    e.errcode not in GZIP_REJECTED_STATUSES
+                    or self.encode_threshold is None
+                    or len(request_body) < self.encode_threshold
+                ):
+                    raise
+            # The server doesn't take compressed requests after all
+            self.encode_threshold = None
+            return super().request(host, handler, request_body, verbose)
+
+    def send_content(self, connection, request_body):
+        """Send the request body, compressed if it is long enough."""
+        self.request_bytes += len(request_body)
+        if (
+            self.encode_threshold is not None
+            and len(request_body) >= self.encode_threshold
+        ):
+            start = time.monotonic()
+            request_body = xmlrpc.client.gzip_encode(request_body)
+            self.compress_time += time.monotonic() - start
+            connection.putheader("Content-Encoding", "gzip")
+        self.sent_bytes += len(request_body)
+        connection.putheader("Content-Length", str(len(request_body)))
+        connection.endheaders(request_body)
+
+    def parse_response(self, response):
+        """Parse a response, counting the bytes received."""
+        self.received_bytes += int(response.getheader("Content-Length") or 0)
+        return super().parse_response(response)
+
+    def make_connection(self, host):
+        """Return the open connection to host, or open a new one."""
+        if self._connection and host == self._connection[0]:
+            conn = self._connection[1]
+            if conn.sock is not None:
+                self.reused += 1
+                conn.timeout = self._call_timeout
+                conn.sock.settimeout(self._call_timeout)
+                return conn
+            self.close()
+        if self.use_https:
+            conn = super().make_connection(host)
+        else:
+            conn = xmlrpc.client.Transport.make_connection(self, host)
+        conn.timeout = self._call_timeout
+        start = time.monotonic()
+        conn.connect()
+        self.handshake_time += time.monotonic() - start
+        self.connections += 1
+        return conn
+
+
+def _multicall_result(results, index):
+    """Return a result of a multicall, or the Fault of a failed call."""
+    try:
+        return results[index]
+    except xmlrpc.client.Fault as e:
+        return e
+
+
 class OS2borgerPCAdmin(object):
     """XML-RPC client class for communicating with admin system."""
 
     def __init__(self, url, verbose=False):
         """According to D107 docstrings are required."""
-        rpc_args = {"verbose": verbose, "allow_none": True}
+        self.transport = KeepAliveTransport(use_https=url.startswith("https:"))
+        rpc_args = {
+            "verbose": verbose,
+            "allow_none": True,
+            "transport": self.transport,
+        }
         self._rpc_srv = xmlrpc.client.ServerProxy(url, **rpc_args)
+        # Whether the server supports system.multicall, None until known,
+        # see supports_multicall
+        self.multicall_supported = None
+
+    @contextlib.contextmanager
+    def deadline(self, seconds):
+        """Context manager limiting the calls made within it to seconds."""
+        previous = self.transport.deadline
+        self.transport.deadline = time.monotonic() + seconds
+        try:
+            yield
+        finally:
+            self.transport.deadline = previous
+
+    def supports_multicall(self):
+        """
+        Return whether the server offers system.multicall.
+
+        Unless already known, the server is asked with system.listMethods.
+        Servers which don't support introspection are taken not to offer it.
+        """
+        if self.multicall_supported is None:
+            try:
+                methods = self._rpc_srv.system.listMethods()
+            except xmlrpc.client.Fault:
+                methods = []
+            self.multicall_supported = "system.multicall" in methods
+        return self.multicall_supported
+
+    def multicall(self, calls):
+        """
+        Make several calls, in a single round trip if the server supports it.
+
+        calls is a list of (method name, arguments) pairs. Returns the list
+        of results, in which a call that failed has the xmlrpc.client.Fault
+        it raised. The calls are only batched in a system.multicall if the
+        server is known to offer it, see supports_multicall, otherwise they
+        are made one by one.
+        """
+        if len(calls) > 1 and self.multicall_supported:
+            multicall = xmlrpc.client.MultiCall(self._rpc_srv)
+            for name, args in calls:
+                getattr(multicall, name)(*args)
+            try:
+                results = multicall()
+            except xmlrpc.client.Fault:
+                # No longer offered
+                self.multicall_supported = False
+            else:
+                return [_multicall_result(results, i) for i in range(len(calls))]
+
+        results = []
+        for name, args in calls:
+            try:
+                results.append(getattr(self._rpc_srv, name)(*args))
+            except xmlrpc.client.Fault as e:
+                results.append(e)
+        return results
 
     def register_new_computer(self, mac, name, distribution, site, configuration):
         """register_new_computer from the admin site rpc module."""
@@ -37,6 +252,10 @@ class OS2borgerPCAdmin(object):
         """get_instructions from the admin site rpc module."""
         return self._rpc_srv.get_instructions(pc_uid)
 
+    def wait_for_instructions(self, pc_uid, token, timeout):
+        """wait_for_instructions from the admin site rpc module."""
+        return self._rpc_srv.wait_for_instructions(pc_uid, token, timeout)
+
     def push_config_keys(self, pc_uid, config_dict):
         """push_config_keys from the admin site rpc module."""
         return self._rpc_srv.push_config_keys(pc_uid, config_dict)
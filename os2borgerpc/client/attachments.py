@@ -0,0 +1,299 @@
+"""Module for downloading job attachments."""
+
+import concurrent.futures
+import fcntl
+import hashlib
+import json
+import os
+import os.path
+import shutil
+import tempfile
+import threading
+import time
+
+DEFAULT_WORKERS = 4
+# Maximum time in seconds for downloading a single attachment
+DEFAULT_TIMEOUT = 600
+CHUNK_SIZE = 64 * 1024
+# ioctl cloning a file by sharing its data blocks, on file systems which
+# support it, e.g. btrfs and XFS. Only in the fcntl module from Python 3.12.
+FICLONE = getattr(fcntl, "FICLONE", 0x40049409)
+
+DEFAULT_CACHE_DIR = "/var/lib/os2borgerpc/attachment_cache"
+# Maximum size of the attachment cache in MB
+DEFAULT_CACHE_SIZE = 1024
+# Attachments cached less than this many seconds ago are used without asking
+# the server whether they have changed
+DEFAULT_CACHE_MAX_AGE = 3600
+
+
+class AttachmentDownload:
+    """An attachment to download for a parameter of a job."""
+
+    def __init__(self, url, path, index, sha256=None):
+        """
+        Download url to path for the parameter with the given index.
+
+        sha256 is the digest of the content, if the server provided it.
+        """
+        self.url = url
+        self.path = path
+        self.index = index
+        self.sha256 = sha256
+        self.error = None
+
+    def __repr__(self):
+        """Return a readable representation, for logs."""
+        return "AttachmentDownload(%r, %r, %r)" % (self.url, self.path, self.index)
+
+
+class AttachmentCache:
+    """
+    Content-addressed cache of downloaded attachments.
+
+    Attachments are stored once under objects/<sha256> and copied into the
+    attachment directories of the jobs using them, so a job changing its
+    copy doesn't change the cached object. index.json maps each
+    URL to the digest of its content along with the ETag and Last-Modified
+    headers it was served with, so changes can be detected with a
+    conditional request. The least recently used objects are evicted when
+    the cache grows beyond max_size bytes.
+    """
+
+    def __init__(
+        self,
+        path=DEFAULT_CACHE_DIR,
+        max_size=DEFAULT_CACHE_SIZE * 1024 * 1024,
+        max_age=DEFAULT_CACHE_MAX_AGE,
+    ):
+        """Use the cache in the directory path."""
+        self.path = path
+        self.objects_path = os.path.join(path, "objects")
+        self.index_path = os.path.join(path, "index.json")
+        self.max_size = max_size
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        os.makedirs(self.objects_path, mode=0o700, exist_ok=True)
+        try:
+            with open(self.index_path, "rt") as fh:
+                self.index = json.load(fh)
+        except (OSError, ValueError):
+            self.index = {}
+
+    def object_path(self, digest):
+        """Return the path of the cached object with the given digest."""
+        return os.path.join(self.objects_path, digest)
+
+    def _has_object(self, digest):
+        return os.path.isfile(self.object_path(digest))
+
+    def lookup(self, attachment):
+        """
+        Return (digest, entry) for an attachment.
+
+        digest is set if the cached object can be used without contacting the
+        server, entry is the index entry for the URL, if any.
+        """
+        with self._lock:
+            entry = self.index.get(attachment.url)
+        if attachment.sha256 and self._has_object(attachment.sha256):
+            return attachment.sha256, entry
+        if entry and self._has_object(entry["sha256"]):
+            if time.time() - entry["checked"] < self.max_age:
+                return entry["sha256"], entry
+            return None, entry
+        return None, None
+
+    def revalidated(self, url):
+        """Record that the cached object for url was found to be unchanged."""
+        with self._lock:
+            self.index[url]["checked"] = time.time()
+            return self.index[url]["sha256"]
+
+    def store(self, url, tmp_path, digest, headers):
+        """Move a downloaded file into the cache and record it for url."""
+        os.replace(tmp_path, self.object_path(digest))
+        with self._lock:
+            self.index[url] = {
+                "sha256": digest,
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified"),
+                "checked": time.time(),
+            }
+
+    def copy(self, digest, path):
+        """
+        Place a private copy of the object with the given digest at path.
+
+        Where the file system supports it the copy is a reflink, sharing the
+        data blocks of the object until either is changed.
+        """
+        obj = self.object_path(digest)
+        # Mark the object as recently used
+        os.utime(obj)
+        if os.path.exists(path):
+            os.remove(path)
+        try:
+            with open(obj, "rb") as src, open(path, "wb") as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            # Different file systems or no reflink support
+            shutil.copyfile(obj, path)
+        shutil.copymode(obj, path)
+
+    def evict(self):
+        """Remove the least recently used objects beyond max_size."""
+        objects = []
+        for entry in os.scandir(self.objects_path):
+            if entry.is_file():
+                st = entry.stat()
+                objects.append((st.st_mtime, st.st_size, entry.name))
+        total = sum(size for _, size, _ in objects)
+        evicted = set()
+        for _, size, name in sorted(objects):
+            if total <= self.max_size:
+                break
+            os.remove(self.object_path(name))
+            evicted.add(name)
+            total -= size
+        with self._lock:
+            self.index = {
+                url: entry
+                for url, entry in self.index.items()
+                if entry["sha256"] not in evicted
+            }
+
+    def save(self):
+        """Write the index to disk."""
+        with self._lock:
+            data = json.dumps(self.index)
+        with open(self.index_path + ".new", "wt") as fh:
+            fh.write(data)
+        os.replace(self.index_path + ".new", self.index_path)
+
+
+def create_session(pool_size):
+    """Return a requests session keeping up to pool_size connections alive."""
+    # requests is slow to import and only needed for jobs with attachments
+    import requests
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def download(session, attachment, timeout=DEFAULT_TIMEOUT, cache=None):
+    """
+    Download a single attachment using session.
+
+    The attachment is written to a temporary file which is only moved into
+    place once the download is complete. Raises TimeoutError if the download
+    takes longer than timeout seconds in total, and ValueError if the content
+    doesn't match the sha256 digest provided by the server.
+
+    With a cache, cached attachments are used when they are known to be
+    current, and a changed attachment is only downloaded if a conditional
+    request shows it has changed.
+    """
+    headers = {}
+    if cache is not None:
+        digest, entry = cache.lookup(attachment)
+        if digest:
+            cache.copy(digest, attachment.path)
+            return
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        tmp_dir = cache.objects_path
+    else:
+        tmp_dir = os.path.dirname(attachment.path)
+
+    deadline = time.monotonic() + timeout
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as fh, session.get(
+            attachment.url, headers=headers, stream=True, timeout=timeout
+        ) as response:
+            if response.status_code == 304 and headers:
+                cache.copy(cache.revalidated(attachment.url), attachment.path)
+                os.remove(tmp_path)
+                return
+            response.raise_for_status()
+            sha256 = hashlib.sha256()
+            # Job scripts often copy attachments into place, so give them the
+            # usual permissions rather than those of a temporary file
+            os.fchmod(fh.fileno(), 0o644)
+            for chunk in response.iter_content(CHUNK_SIZE):
+                if time.monotonic() > deadline:
+                    raise TimeoutError("Download took more than %s seconds" % timeout)
+                fh.write(chunk)
+                sha256.update(chunk)
+        if attachment.sha256 and sha256.hexdigest() != attachment.sha256:
+            raise ValueError(
+                "Content of %s doesn't match its sha256 digest" % attachment.url
+            )
+        if cache is not None:
+            cache.store(attachment.url, tmp_path, sha256.hexdigest(), response.headers)
+            cache.copy(sha256.hexdigest(), attachment.path)
+        else:
+            os.replace(tmp_path, attachment.path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _download_group(session, group, timeout, cache):
+    """Download the first attachment of a group with the same URL, copy the rest."""
+    first = group[0]
+    try:
+        download(session, first, timeout, cache)
+    except Exception as e:
+        for attachment in group:
+            attachment.error = e
+        return
+    for attachment in group[1:]:
+        try:
+            if cache is not None:
+                download(session, attachment, timeout, cache)
+            else:
+                shutil.copyfile(first.path, attachment.path)
+        except Exception as e:
+            attachment.error = e
+
+
+def download_attachments(
+    attachments, workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT, cache=None
+):
+    """
+    Download attachments concurrently, over a shared connection pool.
+
+    Attachments with the same URL are only downloaded once. Failures don't
+    stop the other downloads, instead the error of each failed attachment is
+    stored in its error attribute. Returns the list of failed attachments.
+    """
+    attachments = list(attachments)
+    groups = {}
+    for attachment in attachments:
+        groups.setdefault(attachment.url, []).append(attachment)
+
+    if groups:
+        workers = max(1, min(workers, len(groups)))
+        with create_session(workers) as session:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                for future in [
+                    executor.submit(_download_group, session, group, timeout, cache)
+                    for group in groups.values()
+                ]:
+                    future.result()
+
+    if cache is not None:
+        cache.evict()
+        cache.save()
+    return [attachment for attachment in attachments if attachment.error]
@@ -0,0 +1,74 @@
+"""Module for the circuit breaker guarding the calls to the admin site."""
+
+import json
+import os
+import os.path
+import random
+import time
+
+# Consecutive failures before the breaker opens
+DEFAULT_THRESHOLD = 3
+# Time in seconds the breaker stays open after the first failures, doubled for
+# every further failure up to the maximum
+DEFAULT_BASE_DELAY = 60
+DEFAULT_MAX_DELAY = 3600
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker stored in a file, so it holds across jobmanager runs.
+
+    After threshold consecutive failures the breaker opens, and allow returns
+    False until a delay has passed. Then a single attempt is allowed, and if
+    it fails too the delay is doubled, up to max_delay. The delays are
+    jittered, so PCs which lost the admin site at the same time don't all
+    come back at the same time.
+    """
+
+    def __init__(
+        self,
+        path,
+        threshold=DEFAULT_THRESHOLD,
+        base_delay=DEFAULT_BASE_DELAY,
+        max_delay=DEFAULT_MAX_DELAY,
+    ):
+        """Read the state of the breaker from path, if it exists."""
+        self.path = path
+        self.threshold = threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failures = 0
+        self.open_until = 0.0
+        try:
+            with open(path, "rt") as fh:
+                state = json.load(fh)
+            self.failures = int(state["failures"])
+            self.open_until = float(state["open_until"])
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def allow(self):
+        """Return True if the admin site should be contacted."""
+        return time.time() >= self.open_until
+
+    def record_success(self):
+        """Close the breaker."""
+        if self.failures or self.open_until:
+            self.failures = 0
+            self.open_until = 0.0
+            self._save()
+
+    def record_failure(self):
+        """Count a failure, opening the breaker once there are enough."""
+        self.failures += 1
+        if self.failures >= self.threshold:
+            exponent = min(self.failures - self.threshold, 32)
+            delay = min(self.max_delay, self.base_delay * 2**exponent)
+            self.open_until = time.time() + random.uniform(delay / 2, delay)
+        self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".new", "wt") as fh:
+            json.dump({"failures": self.failures, "open_until": self.open_until}, fh)
+        os.replace(self.path + ".new", self.path)
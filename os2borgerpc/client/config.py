@@ -1,29 +1,113 @@
 """Module for the OS2borgerPCConfig."""
 
+import copy
+import json
 import os
 import os.path
-import yaml
+import threading
 import stat
 
 DEFAULT_CONFIG_FILES = ["/etc/os2borgerpc/os2borgerpc.conf", "/etc/bibos/bibos.conf"]
 
 DEBUG = True  # TODO: Get from settings file.
 
+# The parsed config files, by file name, with the inode, size and mtime of
+# the file when it was parsed. Shared by all OS2borgerPCConfig objects.
+_cache = {}
+_cache_lock = threading.Lock()
+# How many times a config file has been parsed
+parse_count = 0
+
+# save() also writes the config as a flat JSON object keyed by the dotted
+# names of get_data(), to this file next to the config file. It records the
+# inode, size and mtime of the config file, so readers can tell whether it
+# is fresh and look up keys without parsing YAML.
+SNAPSHOT_SUFFIX = ".json"
+
+
+def _yaml():
+    """Return the yaml module and its fastest safe loader and dumper."""
+    # yaml is imported here, as readers using the snapshot don't need it
+    import yaml
+
+    return (
+        yaml,
+        getattr(yaml, "CSafeLoader", yaml.SafeLoader),
+        getattr(yaml, "CSafeDumper", yaml.SafeDumper),
+    )
+
+
+def find_config_file(filenames):
+    """
+    Return the config file to use of filenames.
+
+    That's the first of them that exists, or else the first, to be created.
+    """
+    for f in filenames:
+        if os.path.isfile(f):
+            return f
+    return filenames[0]
+
+
+def file_stamp(path):
+    """
+    Return (inode, size, mtime) of a file, or None if it doesn't exist.
+
+    The stamp changes whenever the file is written or replaced.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def _cache_data(filename, stamp, data):
+    with _cache_lock:
+        _cache[filename] = (stamp, copy.deepcopy(data))
+
+
+def read_snapshot(filename):
+    """Return the config data in the snapshot of filename, or None if stale."""
+    stamp = file_stamp(filename)
+    if stamp is None:
+        return None
+    try:
+        with open(filename + SNAPSHOT_SUFFIX, "r") as fh:
+            snapshot = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    if snapshot.get("source") != list(stamp):
+        return None
+    return snapshot["data"]
+
 
 def get_config(key, filenames=DEFAULT_CONFIG_FILES):
-    """Get value of a known config key."""
+    """
+    Get value of a known config key.
+
+    The value is read from the snapshot of the config file if it is fresh.
+    Keys of nested configuration, which aren't in the snapshot, are read
+    from the config file itself.
+    """
+    data = read_snapshot(find_config_file(filenames))
+    if data is not None:
+        if key in data:
+            return data[key]
+        prefix = key + "."
+        if not any(name.startswith(prefix) for name in data):
+            raise KeyError(key)
     conf = OS2borgerPCConfig(filenames)
     return conf.get_value(key)
 
 
 def has_config(key, filenames=DEFAULT_CONFIG_FILES):
     """Return True if config key exists, False otherwise."""
-    conf = OS2borgerPCConfig(filenames)
     exists = False
     try:
         # TODO: It would be more elegant to determine this without computing
         # the value.
-        val = conf.get_value(key)  # noqa
+        val = get_config(key, filenames)  # noqa
         exists = True
     except KeyError:
         pass
@@ -49,12 +133,7 @@ class OS2borgerPCConfig:
         """
         # Check if one of the candidate filenames exists. If one does, then
         # use it; otherwise, use (and thus create) the first one
-        for f in filenames:
-            if os.path.isfile(f):
-                self.filename = f
-                break
-        else:
-            self.filename = filenames[0]
+        self.filename = find_config_file(filenames)
 
         self.yamldata = {}
         # Do not catch exceptions here, let them pass from load function
@@ -64,14 +143,30 @@ class OS2borgerPCConfig:
         """
         Load a configuration.
 
-        initialize to empty configuration if file does not exist.
+        initialize to empty configuration if file does not exist. The file
+        is only parsed again if its inode, size or mtime has changed since
+        it was last parsed by any OS2borgerPCConfig in this process.
         """
+        global parse_count
+
+        stamp = file_stamp(self.filename)
+        with _cache_lock:
+            cached = _cache.get(self.filename)
+        if stamp is not None and cached and cached[0] == stamp:
+            self.yamldata = copy.deepcopy(cached[1])
+            return
+
         try:
-            stream = open(self.filename, "r")
-            self.yamldata = yaml.safe_load(stream)
+            with open(self.filename, "r") as stream:
+                with _cache_lock:
+                    parse_count += 1
+                yaml, loader, _ = _yaml()
+                self.yamldata = yaml.load(stream, Loader=loader)
             # safe_load returns None when the file is empty, but we need a dict
             if self.yamldata is None:
                 self.yamldata = {}
+            if stamp is not None:
+                _cache_data(self.filename, stamp, self.yamldata)
         except IOError as e:
             if e.errno == 2:
                 # File does not exist -> empty YAML dictionary.
@@ -106,13 +201,33 @@ class OS2borgerPCConfig:
 
             # Make sure we overwrite the settings file atomically -- a failed
             # write operation here would essentially unregister this client
+            yaml, _, dumper = _yaml()
             with open(self.filename + ".new", "w") as stream:
-                yaml.dump(self.yamldata, stream, default_flow_style=False)
+                yaml.dump(
+                    self.yamldata, stream, Dumper=dumper, default_flow_style=False
+                )
             os.rename(self.filename + ".new", self.filename)
+            stamp = file_stamp(self.filename)
+            _cache_data(self.filename, stamp, self.yamldata)
+            self._save_snapshot(stamp)
         except IOError as e:
             print("Error opening OS2borgerPCConfig file for writing: ", str(e))
             raise
 
+    def _save_snapshot(self, stamp):
+        """Write the snapshot of the config file, saved with stamp."""
+        snapshot_file = self.filename + SNAPSHOT_SUFFIX
+        try:
+            snapshot = json.dumps({"source": list(stamp), "data": self.get_data()})
+        except TypeError:
+            # Values JSON can't represent, readers will parse the config file
+            if os.path.exists(snapshot_file):
+                os.remove(snapshot_file)
+            return
+        with open(snapshot_file + ".new", "w") as fh:
+            fh.write(snapshot)
+        os.rename(snapshot_file + ".new", snapshot_file)
+
     def set_value(self, key, value):
         """Set a value in the configuration."""
         current = self.yamldata
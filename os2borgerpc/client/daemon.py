@@ -0,0 +1,97 @@
+"""Module for running the jobmanager as a long-running daemon."""
+
+import random
+import signal
+import threading
+import time
+import traceback
+
+from os2borgerpc.client.config import DEFAULT_CONFIG_FILES
+from os2borgerpc.client.config import file_stamp
+from os2borgerpc.client.config import find_config_file
+from os2borgerpc.client.config import OS2borgerPCConfig
+
+# Seconds between the starts of two check-ins
+DEFAULT_INTERVAL = 5 * 60
+# Up to this many seconds are added to each interval at random, so the PCs
+# don't all check in at the same time
+DEFAULT_JITTER = 60
+
+
+class Daemon:
+    """
+    Run check-ins at intervals, in one long-running process.
+
+    Connections to the admin site and the caches of the jobmanager are kept
+    between check-ins. The interval and jitter are read from the
+    checkin_interval and checkin_jitter config keys, which are only read
+    again when the config file changes. The first check-in starts after a
+    random delay of up to the jitter.
+
+    wake() starts the next check-in right away, stop() ends the daemon once
+    the current check-in is done. An exception from a check-in is printed
+    and the daemon goes on, except SystemExit, which ends it.
+    """
+
+    def __init__(self, checkin, config_files=DEFAULT_CONFIG_FILES):
+        """Call checkin for each check-in."""
+        self.checkin = checkin
+        self.config_files = config_files
+        self.interval = DEFAULT_INTERVAL
+        self.jitter = DEFAULT_JITTER
+        self.checkins = 0
+        self._config_stamp = False
+        self._wakeup = threading.Event()
+        self._stopped = False
+
+    def reload_settings(self):
+        """Read the interval and jitter again, if the config file has changed."""
+        filename = find_config_file(self.config_files)
+        stamp = file_stamp(filename)
+        if stamp == self._config_stamp:
+            return
+        self._config_stamp = stamp
+        data = OS2borgerPCConfig([filename]).get_data()
+        for attr, key, default in [
+            ("interval", "checkin_interval", DEFAULT_INTERVAL),
+            ("jitter", "checkin_jitter", DEFAULT_JITTER),
+        ]:
+            try:
+                setattr(self, attr, max(int(data.get(key, default)), 0))
+            except ValueError:
+                setattr(self, attr, default)
+
+    def wake(self):
+        """Start the next check-in now."""
+        self._wakeup.set()
+
+    def stop(self):
+        """Stop after the current check-in."""
+        self._stopped = True
+        self._wakeup.set()
+
+    def install_signal_handlers(self):
+        """Stop on SIGTERM and SIGINT, and check in at once on SIGUSR1."""
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+        signal.signal(signal.SIGINT, lambda signum, frame: self.stop())
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self.wake())
+
+    def _wait(self, seconds):
+        if seconds > 0 and not self._stopped:
+            self._wakeup.wait(seconds)
+        self._wakeup.clear()
+
+    def run(self):
+        """Check in at intervals until stopped."""
+        self.reload_settings()
+        self._wait(random.uniform(0, self.jitter))
+        while not self._stopped:
+            started = time.monotonic()
+            try:
+                self.checkin()
+            except Exception:
+                traceback.print_exc()
+            self.checkins += 1
+            self.reload_settings()
+            delay = self.interval + random.uniform(0, self.jitter)
+            self._wait(started + delay - time.monotonic())
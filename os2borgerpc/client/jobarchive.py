@@ -0,0 +1,99 @@
+"""Module for the monthly archives of old jobs."""
+
+import gzip
+import os
+import os.path
+import tarfile
+
+ARCHIVE_DIRNAME = "archive"
+ARCHIVE_SUFFIX = ".tar.gz"
+# Files from a job directory that are kept in the archive. Attachments can be
+# big and are of no use once the job has run, so they are left out.
+ARCHIVED_FILES = (
+    "executable",
+    "status",
+    "started",
+    "finished",
+    "sent",
+    "output.log",
+    "output.log.gz",
+)
+
+
+def get_archive_dir(jobs_dir):
+    """Return the directory holding the archives for jobs_dir."""
+    return os.path.join(str(jobs_dir), ARCHIVE_DIRNAME)
+
+
+def get_archive_name(timestamp):
+    """Return the name of the monthly archive for a "%Y-%m-%d ..." timestamp."""
+    return timestamp[:7]
+
+
+def get_archive_path(jobs_dir, name):
+    """Return the path of the archive with the given name."""
+    return os.path.join(get_archive_dir(jobs_dir), name + ARCHIVE_SUFFIX)
+
+
+def list_archives(jobs_dir):
+    """Return the names of all archives in jobs_dir, oldest first."""
+    archive_dir = get_archive_dir(jobs_dir)
+    if not os.path.isdir(archive_dir):
+        return []
+    return sorted(
+        f[: -len(ARCHIVE_SUFFIX)]
+        for f in os.listdir(archive_dir)
+        if f.endswith(ARCHIVE_SUFFIX)
+    )
+
+
+def append_jobs(archive_path, job_dirs):
+    """
+    Append job directories to an archive.
+
+    Every call appends a separate gzip member holding a complete tar stream,
+    so existing archives never need to be rewritten. Readers open the
+    archives with ignore_zeros to step over the intermediate end markers.
+    """
+    os.makedirs(os.path.dirname(archive_path), mode=0o700, exist_ok=True)
+    with open(archive_path, "ab") as raw:
+        start = raw.tell()
+        try:
+            with gzip.GzipFile(fileobj=raw, mode="wb") as gz:
+                with tarfile.open(fileobj=gz, mode="w") as tar:
+                    for job_dir in job_dirs:
+                        job_id = os.path.basename(job_dir.rstrip("/"))
+                        for name in ARCHIVED_FILES:
+                            path = os.path.join(job_dir, name)
+                            if os.path.isfile(path):
+                                tar.add(path, arcname=job_id + "/" + name)
+            raw.flush()
+            os.fsync(raw.fileno())
+        except BaseException:
+            # Don't leave a half written member behind, it would make the
+            # rest of the archive unreadable
+            raw.truncate(start)
+            raise
+
+
+def _open(archive_path):
+    return tarfile.open(archive_path, "r:gz", ignore_zeros=True)
+
+
+def list_jobs(archive_path):
+    """Return the ids of the jobs stored in an archive."""
+    with _open(archive_path) as tar:
+        return sorted({int(m.name.split("/")[0]) for m in tar.getmembers()})
+
+
+def read_job_file(archive_path, job_id, name):
+    """Return the contents of a file of an archived job, or None."""
+    member_name = "%s/%s" % (job_id, name)
+    content = None
+    with _open(archive_path) as tar:
+        # A job may have been archived twice if a run was interrupted, the
+        # last copy wins
+        for member in tar:
+            if member.name == member_name:
+                content = tar.extractfile(member).read()
+    return content
@@ -0,0 +1,210 @@
+"""Module for the job index."""
+
+import os
+import os.path
+import sqlite3
+import threading
+
+from os2borgerpc.client import jobarchive
+
+INDEX_FILENAME = "jobs.sqlite"
+# Job properties mirrored in the index. The files in the job directories remain
+# the canonical record, the index only exists to make queries cheap.
+INDEXED_FIELDS = ("status", "started", "finished", "sent")
+# Bump when the schema changes, older indexes are then rebuilt from the
+# job directories.
+SCHEMA_VERSION = 2
+
+
+class JobIndex:
+    """
+    SQLite backed index of the jobs stored in a jobs directory.
+
+    Keeps id -> status/started/finished/sent for every job so status queries
+    only touch the matching rows instead of opening every job directory.
+    An index missing from an existing jobs directory is built by scanning
+    the directory layout once.
+
+    Jobs moved into the monthly archives are tracked as id -> archive name.
+    """
+
+    def __init__(self, jobs_dir):
+        """Open (and if needed create or migrate) the index in jobs_dir."""
+        self.jobs_dir = str(jobs_dir)
+        self.path = os.path.join(self.jobs_dir, INDEX_FILENAME)
+        # The connection is shared between threads, so serialize access
+        self._lock = threading.RLock()
+        os.makedirs(self.jobs_dir, mode=0o700, exist_ok=True)
+        try:
+            self._open()
+        except sqlite3.DatabaseError:
+            # A corrupt index holds nothing that can't be recovered from the
+            # job directories, so start over
+            self.close()
+            os.remove(self.path)
+            self._open()
+
+    def _open(self):
+        self._conn = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None
+        )
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self.rebuild()
+
+    def close(self):
+        """Close the underlying database connection."""
+        conn = getattr(self, "_conn", None)
+        if conn is not None:
+            conn.close()
+            self._conn = None
+
+    def rebuild(self):
+        """(Re)create the index from the job directories and archives on disk."""
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DROP TABLE IF EXISTS jobs")
+                conn.execute(
+                    "CREATE TABLE jobs (id INTEGER PRIMARY KEY, status TEXT,"
+                    " started TEXT, finished TEXT, sent TEXT)"
+                )
+                conn.execute("CREATE INDEX jobs_status ON jobs (status, id)")
+                conn.executemany(
+                    "INSERT INTO jobs (id, status, started, finished, sent)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    self._scan_job_dirs(),
+                )
+                conn.execute("DROP TABLE IF EXISTS archived")
+                conn.execute(
+                    "CREATE TABLE archived (id INTEGER PRIMARY KEY, archive TEXT)"
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO archived (id, archive) VALUES (?, ?)",
+                    self._scan_archives(),
+                )
+                conn.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _scan_job_dirs(self):
+        for entry in os.scandir(self.jobs_dir):
+            if not entry.name.isdigit() or not entry.is_dir():
+                continue
+            row = [int(entry.name)]
+            for field in INDEXED_FIELDS:
+                try:
+                    with open(os.path.join(entry.path, field), "rb") as fh:
+                        row.append(fh.read().decode("utf-8", "replace"))
+                except OSError:
+                    row.append(None)
+            yield row
+
+    def _scan_archives(self):
+        for name in jobarchive.list_archives(self.jobs_dir):
+            path = jobarchive.get_archive_path(self.jobs_dir, name)
+            for job_id in jobarchive.list_jobs(path):
+                yield (job_id, name)
+
+    def update(self, job_id, **fields):
+        """Record new values for some of the indexed fields of a job."""
+        unknown = set(fields) - set(INDEXED_FIELDS)
+        if unknown:
+            raise ValueError("Not indexed: %s" % ", ".join(sorted(unknown)))
+        assignments = ", ".join("%s = ?" % k for k in fields)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO jobs (id) VALUES (?)", (int(job_id),)
+            )
+            if fields:
+                self._conn.execute(
+                    "UPDATE jobs SET %s WHERE id = ?" % assignments,
+                    list(fields.values()) + [int(job_id)],
+                )
+
+    def remove(self, job_id):
+        """Remove a job from the index."""
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (int(job_id),))
+
+    def get(self, job_id):
+        """Return the indexed fields of a job as a dict, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, started, finished, sent FROM jobs WHERE id = ?",
+                (int(job_id),),
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(INDEXED_FIELDS, row))
+
+    def ids_with_status(self, status_list, unsent_only=False):
+        """
+        Return the ids of jobs with a status in status_list, sorted by id.
+
+        If unsent_only is True, only jobs which haven't been sent are included.
+        """
+        status_list = list(status_list)
+        if not status_list:
+            return []
+        placeholders = ", ".join("?" for _ in status_list)
+        unsent = " AND (sent IS NULL OR sent = '')" if unsent_only else ""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM jobs WHERE status IN (%s)%s ORDER BY id"
+                % (placeholders, unsent),
+                status_list,
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def ids_to_archive(self, sent_before, keep):
+        """
+        Return the ids of sent, finished jobs due for archiving.
+
+        Those are jobs sent before the timestamp sent_before, and all but the
+        newest keep sent jobs.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM jobs WHERE status IN ('DONE', 'FAILED')"
+                " AND sent IS NOT NULL AND sent != ''"
+                " AND (sent < ? OR id NOT IN ("
+                "  SELECT id FROM jobs WHERE status IN ('DONE', 'FAILED')"
+                "  AND sent IS NOT NULL AND sent != '' ORDER BY id DESC LIMIT ?"
+                ")) ORDER BY id",
+                (sent_before, keep),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def mark_archived(self, job_ids, archive):
+        """Move jobs from the live index to the given archive."""
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for job_id in job_ids:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO archived (id, archive) VALUES (?, ?)",
+                        (int(job_id), archive),
+                    )
+                    conn.execute("DELETE FROM jobs WHERE id = ?", (int(job_id),))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def get_archive(self, job_id):
+        """Return the name of the archive holding a job, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT archive FROM archived WHERE id = ?", (int(job_id),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def remove_archive(self, archive):
+        """Forget all jobs stored in the given archive."""
+        with self._lock:
+            self._conn.execute("DELETE FROM archived WHERE archive = ?", (archive,))
@@ -0,0 +1,316 @@
+"""Module for capturing the output of jobs."""
+
+import os
+import re
+import selectors
+import subprocess
+import time
+import unicodedata
+
+# How much output to read from a job in one go
+CHUNK_SIZE = 64 * 1024
+# How long to keep reading output after the job itself has exited. Anything
+# the job left running in the background may keep the pipe open forever, so
+# stop once the pipe is idle for DRAIN_TIMEOUT or after MAX_DRAIN_TIME and
+# leave the rest of the output to a background process discarding it.
+DRAIN_TIMEOUT = 0.1
+MAX_DRAIN_TIME = 5
+
+TRUNCATION_MARKER = "\n>>> [... %d bytes of output omitted ...]\n"
+REDACTED = b"*****"
+
+# Control characters (Unicode category C) other than newline and tab aren't
+# valid in XML, so they are removed from logs
+ASCII_CONTROL_RE = re.compile("[\x00-\x08\x0b-\x1f\x7f]")
+
+
+def _is_continuation_byte(byte):
+    return 0x80 <= byte <= 0xBF
+
+
+class BoundedLog:
+    """
+    Log sink keeping only the head and tail of what is written to it.
+
+    The first head_size bytes go straight to the log file, the last tail_size
+    bytes are held in memory and written after a truncation marker when the
+    log is finished. The log file never grows beyond head_size + tail_size
+    plus the marker, however much is written.
+    """
+
+    def __init__(self, fh, head_size, tail_size):
+        """Write to the binary file object fh."""
+        self.fh = fh
+        self.head_left = head_size
+        self.tail_size = tail_size
+        self.tail = bytearray()
+        self.omitted = 0
+
+    def write(self, data):
+        """Write bytes to the log."""
+        if self.head_left > 0:
+            cut = min(self.head_left, len(data))
+            if cut < len(data):
+                # Don't split UTF-8 encoded characters between head and tail
+                while cut > 0 and _is_continuation_byte(data[cut]):
+                    cut -= 1
+                self.head_left = 0
+            else:
+                self.head_left -= cut
+            self.fh.write(data[:cut])
+            data = data[cut:]
+        if data:
+            self.tail += data
+            excess = len(self.tail) - self.tail_size
+            if excess > 0:
+                while excess < len(self.tail) and _is_continuation_byte(
+                    self.tail[excess]
+                ):
+                    excess += 1
+                del self.tail[:excess]
+                self.omitted += excess
+
+    def finish(self):
+        """Write the held back tail of the log, with a truncation marker."""
+        if self.omitted:
+            self.fh.write((TRUNCATION_MARKER % self.omitted).encode("utf-8"))
+        self.fh.write(bytes(self.tail))
+        self.tail = bytearray()
+        self.omitted = 0
+        self.fh.flush()
+
+
+class Redactor:
+    """
+    Log filter replacing secrets before they reach the log.
+
+    All secrets are matched in a single pass with an Aho-Corasick automaton,
+    so the cost is linear in the size of the output whatever the number of
+    secrets. Bytes which may be the start of a secret continued in the next
+    chunk are held back until the match is decided.
+    """
+
+    def __init__(self, sink, secrets, replacement=REDACTED):
+        """Write to sink, which must have write(bytes) and finish() methods."""
+        self.sink = sink
+        self.replacement = replacement
+        self.state = 0
+        self.pending = bytearray()
+        self._build([s for s in secrets if s])
+
+    def _build(self, secrets):
+        # State 0 is the root, goto holds the trie edges, fail the failure
+        # links, depth the length of the prefix matched in each state and
+        # match the length of the longest secret ending in each state
+        goto = [{}]
+        depth = [0]
+        match = [0]
+        for secret in secrets:
+            state = 0
+            for byte in secret:
+                if byte not in goto[state]:
+                    goto.append({})
+                    depth.append(depth[state] + 1)
+                    match.append(0)
+                    goto[state][byte] = len(goto) - 1
+                state = goto[state][byte]
+            match[state] = len(secret)
+
+        fail = [0] * len(goto)
+        queue = list(goto[0].values())
+        for state in queue:
+            for byte, target in goto[state].items():
+                queue.append(target)
+                f = fail[state]
+                while f and byte not in goto[f]:
+                    f = fail[f]
+                fail[target] = goto[f].get(byte, 0)
+                match[target] = max(match[target], match[fail[target]])
+
+        self.goto, self.fail, self.depth, self.match = goto, fail, depth, match
+        # Outside a partial match, skip ahead to the next byte that can start
+        # a secret at C speed
+        first_bytes = b"".join(re.escape(bytes([b])) for b in goto[0])
+        self.start_re = re.compile(b"[" + first_bytes + b"]") if secrets else None
+
+    def write(self, data):
+        """Redact and write bytes to the sink."""
+        if self.start_re is None:
+            self.sink.write(data)
+            return
+        goto, fail, depth, match = self.goto, self.fail, self.depth, self.match
+        pending = self.pending
+        state = self.state
+        out = bytearray()
+        i = 0
+        n = len(data)
+        while i < n:
+            if state == 0:
+                m = self.start_re.search(data, i)
+                if m is None:
+                    out += data[i:]
+                    break
+                out += data[i : m.start()]
+                i = m.start()
+            byte = data[i]
+            i += 1
+            while state and byte not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(byte, 0)
+            pending.append(byte)
+            if match[state]:
+                out += pending[: len(pending) - match[state]]
+                out += self.replacement
+                pending.clear()
+                state = 0
+            elif len(pending) > depth[state]:
+                emit = len(pending) - depth[state]
+                out += pending[:emit]
+                del pending[:emit]
+        self.state = state
+        if out:
+            self.sink.write(bytes(out))
+
+    def finish(self):
+        """Write any held back bytes and finish the sink."""
+        if self.pending:
+            self.sink.write(bytes(self.pending))
+            self.pending = bytearray()
+        self.state = 0
+        self.sink.finish()
+
+
+# Whether characters are control characters, by character
+_is_control = {}
+
+
+def _control_character_re(text):
+    """Return a regular expression matching the control characters in text."""
+    controls = []
+    for char in set(text):
+        if char not in _is_control:
+            _is_control[char] = (
+                unicodedata.category(char)[0] == "C" and char not in "\n\t"
+            )
+        if _is_control[char]:
+            controls.append(re.escape(char))
+    return re.compile("[" + "".join(sorted(controls)) + "]") if controls else None
+
+
+def sanitize_log(text):
+    """
+    Return text without control characters other than newline and tab.
+
+    ASCII text is handled by a single regular expression. For other text the
+    category of each distinct character is looked up once, and the control
+    characters found removed with a regular expression.
+    """
+    if text.isascii():
+        return ASCII_CONTROL_RE.sub("", text)
+    control_re = _control_character_re(text)
+    return text if control_re is None else control_re.sub("", text)
+
+
+def _exit_code(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def _reap(proc, options=0):
+    """Wait for proc like Popen.wait, but return its resource usage."""
+    pid, status, rusage = os.wait4(proc.pid, options)
+    if pid == 0:
+        return None
+    proc.returncode = _exit_code(status)
+    return rusage
+
+
+def _kill(proc):
+    proc.kill()
+    if proc.returncode is None:
+        _reap(proc)
+
+
+def _discard_output(fd):
+    """
+    Hand the read end fd of a pipe to a background process discarding it.
+
+    The process reads until every writer has closed the pipe, so anything a
+    job left running in the background never gets SIGPIPE or EPIPE. It runs
+    in a session of its own and is reparented to init, so it outlives the
+    jobmanager.
+    """
+    try:
+        # The shell gives asynchronous commands /dev/null as stdin, so
+        # the pipe is passed on as fd 3
+        subprocess.run(
+            ["sh", "-c", "exec 3<&0; cat <&3 >/dev/null 2>&1 &"],
+            stdin=fd,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+    except OSError:
+        pass
+
+
+def run_with_log(cmd, log, timeout=None):
+    """
+    Run cmd, streaming its stdout and stderr to log.
+
+    log can be any object with a write(bytes) method. Returns the exit code
+    and the struct_rusage of the process. Like subprocess.call, the process
+    is killed and subprocess.TimeoutExpired raised if it doesn't finish
+    within timeout seconds. Output written after the job has exited, by
+    anything it left running in the background, is discarded.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    fd = proc.stdout.fileno()
+    rusage = None
+    eof = False
+    try:
+        with selectors.DefaultSelector() as selector:
+            selector.register(fd, selectors.EVENT_READ)
+            exited_at = None
+            while True:
+                now = time.monotonic()
+                if deadline is not None and now >= deadline:
+                    raise subprocess.TimeoutExpired(cmd, timeout)
+                if exited_at is None:
+                    rusage = _reap(proc, os.WNOHANG)
+                    if rusage is not None:
+                        exited_at = now
+                if exited_at is not None:
+                    if now - exited_at > MAX_DRAIN_TIME:
+                        break
+                    wait = DRAIN_TIMEOUT
+                else:
+                    wait = 0.5 if deadline is None else min(deadline - now, 0.5)
+                if not selector.select(wait):
+                    if exited_at is not None:
+                        break
+                    continue
+                data = os.read(fd, CHUNK_SIZE)
+                if not data:
+                    eof = True
+                    break
+                log.write(data)
+
+            # The job closed its output, but may still be running
+            while rusage is None:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise subprocess.TimeoutExpired(cmd, timeout)
+                rusage = _reap(proc, os.WNOHANG)
+                if rusage is None:
+                    time.sleep(0.05)
+    except BaseException:
+        _kill(proc)
+        raise
+    finally:
+        if not eof:
+            _discard_output(fd)
+        proc.stdout.close()
+
+    return proc.returncode, rusage
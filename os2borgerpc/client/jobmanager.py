@@ -1,42 +1,212 @@
 """Module for jobmanager."""
 
+import collections
+import concurrent.futures
+import gzip
 import json
 import os.path
 import re
-import socket
+import shutil
 import stat
 import subprocess
 import sys
+import threading
+import time
 import traceback
-import unicodedata
 import urllib.parse
-import urllib.request
+import xmlrpc.client
 from datetime import datetime
+from datetime import timedelta
+from importlib import metadata
 from os import stat as os_stat
 
-import chardet
-import distro
-import pkg_resources
-
-from os2borgerpc.client.admin_client import OS2borgerPCAdmin
+from os2borgerpc.client import attachments
+from os2borgerpc.client import jobarchive
+from os2borgerpc.client import longpoll
+from os2borgerpc.client import outbox
+from os2borgerpc.client import admin_client
+from os2borgerpc.client.admin_client import get_admin
+from os2borgerpc.client.attachments import AttachmentCache
+from os2borgerpc.client.attachments import AttachmentDownload
+from os2borgerpc.client.attachments import download_attachments
+from os2borgerpc.client.circuitbreaker import CircuitBreaker
+from os2borgerpc.client.config import file_stamp
 from os2borgerpc.client.config import has_config
 from os2borgerpc.client.config import OS2borgerPCConfig
-from os2borgerpc.client.security.security import check_security_events
+from os2borgerpc.client.config import read_snapshot
+from os2borgerpc.client.jobindex import INDEXED_FIELDS
+from os2borgerpc.client.jobindex import JobIndex
+from os2borgerpc.client.joblog import BoundedLog
+from os2borgerpc.client.joblog import Redactor
+from os2borgerpc.client.joblog import run_with_log
+from os2borgerpc.client.joblog import sanitize_log
+from os2borgerpc.client.jobresources import get_usage
+from os2borgerpc.client.jobresources import limit_command
+from os2borgerpc.client.jobresources import LIMIT_SETTINGS
+from os2borgerpc.client.longpoll import InstructionWatcher
+from os2borgerpc.client.outbox import Outbox
+from os2borgerpc.client.security.security import finish_security_events
+from os2borgerpc.client.security.security import prepare_security_events
 from os2borgerpc.client.utils import filelock
 from os2borgerpc.client.utils import get_url_and_uid
-
+from os2borgerpc.client.utils import json_digest
 
 # Keep this in sync with package name in setup.py
-OS2BORGERPC_CLIENT_VERSION = pkg_resources.get_distribution(
-    "os2borgerpc_client"
-).version
+OS2BORGERPC_CLIENT_VERSION = metadata.version("os2borgerpc_client")
 DEFAULT_JOB_TIMEOUT = 900
+# How many jobs with different ordering keys may run at the same time
+DEFAULT_JOB_WORKERS = 1
+DEFAULT_ORDERING_KEY = ""
+# The first and last part of a job's output kept in its log
+DEFAULT_JOB_LOG_HEAD_SIZE = 256 * 1024
+DEFAULT_JOB_LOG_TAIL_SIZE = 256 * 1024
+# Logs of finished jobs at least this many bytes long are stored compressed
+DEFAULT_JOB_LOG_COMPRESS_THRESHOLD = 4096
+# Sent jobs are moved to the archives once they are older than this many days,
+# or once there are more than this many newer sent jobs
+DEFAULT_JOB_RETENTION_DAYS = 30
+DEFAULT_JOB_RETENTION_COUNT = 100
+# Monthly archives older than this many months are deleted
+DEFAULT_JOB_ARCHIVE_MONTHS = 12
+# Unsent job results are sent to the admin site in pages of at most this many
+# jobs and (roughly) bytes, so a large backlog never makes for one huge request
+DEFAULT_REPORT_PAGE_SIZE = 20
+DEFAULT_REPORT_PAGE_BYTES = 4 * 1024 * 1024
+
+# Maximum time in seconds for the calls of each network phase of a check-in
+DEFAULT_CHECKIN_TIMEOUT = 300
+# Seconds between asking the admin site whether it supports system.multicall
+MULTICALL_CHECK_INTERVAL = 24 * 60 * 60
 
 JOBS_DIR = "/var/lib/os2borgerpc/jobs"
+CIRCUIT_BREAKER_FILE = "/var/lib/os2borgerpc/admin_circuit_breaker.json"
+OUTBOX_FILE = outbox.DEFAULT_OUTBOX_PATH
+INSTRUCTION_DIGESTS_FILE = "/var/lib/os2borgerpc/instruction_digests.json"
+MULTICALL_SUPPORT_FILE = "/var/lib/os2borgerpc/admin_multicall.json"
+ATTACHMENT_CACHE_DIR = attachments.DEFAULT_CACHE_DIR
 LOCK_FILE = os.path.join(JOBS_DIR, "running")
 
+# Errors meaning the admin site couldn't be reached, including timeouts
+NETWORK_ERRORS = (OSError, xmlrpc.client.ProtocolError)
+# Capabilities the admin site has advertised in its instructions
+server_capabilities = set()
+# The admin site accepts gzip compressed logs, as log_output_gzip
+COMPRESSED_LOG_CAPABILITY = "gzip_log_output"
+# Logs shorter than this are always sent as plain text
+COMPRESSED_LOG_MIN_SIZE = 1024
+# The admin site accepts gzip compressed XML-RPC requests
+COMPRESSED_REQUESTS_CAPABILITY = "gzip_requests"
+# The admin site leaves the parts of the instructions in DIGESTED_INSTRUCTIONS
+# out if they match the digests sent with get_instructions
+CONDITIONAL_INSTRUCTIONS_CAPABILITY = "instruction_digests"
+DIGESTED_INSTRUCTIONS = ("configuration", "security_scripts")
+
+# Bytes of a file fed to chardet, if the file isn't valid utf-8
+ENCODING_SAMPLE_SIZE = 64 * 1024
+# Detected file encodings, by (path, size, mtime)
+ENCODING_CACHE_SIZE = 1024
+_encoding_cache = {}
+
+# Counts of job files read, by file name. Lets tests check that e.g. status
+# checks don't read logs.
+file_reads = collections.Counter()
+# Marks values assigned to a JobFileProperty but not yet saved
+_UNSAVED = object()
+# Keys of the job data from the admin site stored by LocalJob
+JOB_DATA_FIELDS = (
+    "status",
+    "started",
+    "finished",
+    "sent",
+    "executable_code",
+    "parameters",
+    "local_parameters",
+    "ordering_key",
+    "resource_limits",
+)
+
+# Open job indexes, by jobs directory
+_job_indexes = {}
+
+
+def get_job_index():
+    """Return the index of the jobs in JOBS_DIR, opening it on first use."""
+    jobs_dir = str(JOBS_DIR)
+    if jobs_dir not in _job_indexes:
+        _job_indexes[jobs_dir] = JobIndex(jobs_dir)
+    return _job_indexes[jobs_dir]
+
+
+class JobFileProperty:
+    """
+    Job property stored in a file in the job directory.
+
+    The file is only read when the property is accessed, and the value is
+    memoized until the file's mtime, size or inode changes. Assigned values
+    are kept in memory until they are saved with LocalJob.save_property.
+    """
 
-class LocalJob(dict):
+    def __init__(self, filename, loads=None, dumps=None, default=None):
+        """Store the property in filename, optionally (de)serialized."""
+        self.filename = filename
+        self.loads = loads
+        self.dumps = dumps
+        self.default = default
+
+    def __set_name__(self, owner, name):
+        """Store the memoized value in the slot named after the property."""
+        self.name = name
+        self.slot = "_" + name
+
+    def __get__(self, job, owner=None):
+        """Return the value, reading the file if it has changed."""
+        if job is None:
+            return self
+        memo = getattr(job, self.slot, None)
+        if memo is not None and memo[0] is _UNSAVED:
+            return memo[1]
+        path = self.path(job)
+        stamp = file_stamp(path)
+        if memo is None or memo[0] != stamp:
+            value = None if stamp is None else job.read_file(path)
+            if value is not None and self.loads is not None:
+                value = self.loads(value)
+            memo = (stamp, value)
+            setattr(job, self.slot, memo)
+        return self.default if memo[1] is None else memo[1]
+
+    def path(self, job):
+        """Return the path of the file in the job directory."""
+        return os.path.join(job.path, self.filename)
+
+    def __set__(self, job, value):
+        """Assign a value, to be written by save."""
+        setattr(job, self.slot, (_UNSAVED, value))
+
+    def save(self, job):
+        """Write an assigned value to the file. Return True if anything changed."""
+        memo = getattr(job, self.slot, None)
+        if memo is None or memo[0] is not _UNSAVED or memo[1] is None:
+            return False
+        path = self.path(job)
+        with open(path, "wt") as fh:
+            fh.write(memo[1] if self.dumps is None else self.dumps(memo[1]))
+        setattr(job, self.slot, (file_stamp(path), memo[1]))
+        return True
+
+
+class JobLogProperty(JobFileProperty):
+    """The log of a job, read from output.log or its compressed copy."""
+
+    def path(self, job):
+        """Return the path of the compressed log if there is one."""
+        compressed_path = os.path.join(job.path, self.filename + ".gz")
+        if os.path.exists(compressed_path):
+            return compressed_path
+        return os.path.join(job.path, self.filename)
+
+
+class LocalJob:
     """
     Job Model representing a job received from the server.
 
@@ -50,16 +220,62 @@ class LocalJob(dict):
     /var/lib/os2borgerpc/jobs/<id>/finished - created when job is finished/failed
     /var/lib/os2borgerpc/jobs/<id>/sent - created when job is sent back to server
     /var/lib/os2borgerpc/jobs/<id>/output.log - Logfile with output from the job
+    /var/lib/os2borgerpc/jobs/<id>/output.log.gz - output.log, compressed when
+        the job has finished
+    /var/lib/os2borgerpc/jobs/<id>/output.log.sanitized - created when the log
+        has been sanitized, when the job has finished
+    /var/lib/os2borgerpc/jobs/<id>/ordering_key - jobs sharing it run in id order
+    /var/lib/os2borgerpc/jobs/<id>/resource_limits.json - nice level, rlimits etc.
+    /var/lib/os2borgerpc/jobs/<id>/resource_usage.json - peak RSS and CPU time
+    /var/lib/os2borgerpc/jobs/jobs.sqlite - index of status/started/finished/sent
+    /var/lib/os2borgerpc/jobs/archive/<yyyy-mm>.tar.gz - old jobs, by month
 
     Job statuses:
     SUBMITTED: Job has not been run yet
     RUNNING: Job execution was just started
     FAILED: Job ran, exiting with a nonzero status code (failure)
     DONE: Job ran, exiting with status code zero (success)
+
+    The properties stored in the job directory are loaded lazily, see
+    JobFileProperty. Properties which are unset are None.
     """
 
+    __slots__ = (
+        "id",
+        "parameters",
+        "_status",
+        "_started",
+        "_finished",
+        "_sent",
+        "_log_output",
+        "_executable_code",
+        "_local_parameters",
+        "_ordering_key",
+        "_resource_limits",
+        "_resource_usage",
+    )
+
+    status = JobFileProperty("status")
+    started = JobFileProperty("started")
+    finished = JobFileProperty("finished")
+    sent = JobFileProperty("sent")
+    log_output = JobLogProperty("output.log")
+    executable_code = JobFileProperty("executable")
+    local_parameters = JobFileProperty(
+        "parameters.json", loads=json.loads, dumps=json.dumps, default=[]
+    )
+    ordering_key = JobFileProperty("ordering_key", dumps=str)
+    resource_limits = JobFileProperty(
+        "resource_limits.json", loads=json.loads, dumps=json.dumps
+    )
+    resource_usage = JobFileProperty(
+        "resource_usage.json", loads=json.loads, dumps=json.dumps
+    )
+
     def __init__(self, id=None, path=None, data=None):
         """Primarily populates instance with data."""
+        self.parameters = None
+
         if id is None and data is not None and "id" in data:
             id = data["id"]
             del data["id"]
@@ -133,134 +349,161 @@ class LocalJob(dict):
         """Return the output log path."""
         return os.path.join(self.path, "output.log")
 
+    @property
+    def compressed_log_path(self):
+        """Return the compressed output log path."""
+        return self.log_path + ".gz"
+
+    @property
+    def sanitized_log_path(self):
+        """Return the path of the file marking the log as sanitized."""
+        return self.log_path + ".sanitized"
+
     @property
     def report_data(self):
         """Return the report data for the admin site."""
-        self.load_from_path()
-        result = {"id": self.id}
-        for k in ["status", "started", "finished", "log_output"]:
-            result[k] = self[k]
+        result = {
+            "id": self.id,
+            "status": self.status,
+            "started": self.started,
+            "finished": self.finished,
+            "log_output": self.log_output,
+        }
+        # Logs are sanitized when jobs finish, but those of jobs finished by
+        # older clients or appended to since may not be valid XML
+        if not os.path.exists(self.sanitized_log_path):
+            result["log_output"] = sanitize_log(result["log_output"])
+        if self.resource_usage is not None:
+            result["resource_usage"] = self.resource_usage
         return result
 
+    def get_resource_limits(self):
+        """
+        Return the resource limits of the job.
+
+        Limits set for the job by the admin site override the job_<setting>
+        keys in the configuration, see jobresources.LIMIT_SETTINGS.
+        """
+        config_data = OS2borgerPCConfig().get_data()
+        limits = {
+            setting: config_data["job_" + setting]
+            for setting in LIMIT_SETTINGS
+            if "job_" + setting in config_data
+        }
+        limits.update(self.resource_limits or {})
+        return limits
+
     def set_status(self, value):
         """Set job status."""
-        self["status"] = value
-        self.save_property_to_file("status", self.status_path)
+        self.status = value
+        self.save_property("status")
 
     def mark_started(self):
         """Set started time."""
-        self["started"] = str(datetime.now())
-        self.save_property_to_file("started", self.started_path)
+        self.started = str(datetime.now())
+        self.save_property("started")
 
     def mark_finished(self):
         """Set finished time."""
-        self["finished"] = str(datetime.now())
-        self.save_property_to_file("finished", self.finished_path)
+        self.finished = str(datetime.now())
+        self.save_property("finished")
 
     def mark_sent(self):
         """Set sent time."""
-        self["sent"] = str(datetime.now())
-        self.save_property_to_file("sent", self.sent_path)
-
-    def load_local_parameters(self):
-        """Load local job parameters."""
-        self.read_property_from_file("json_params", self.parameters_path)
-        if "json_params" in self:
-            self["local_parameters"] = json.loads(self["json_params"])
-            del self["json_params"]
-        else:
-            self["local_parameters"] = []
+        self.sent = str(datetime.now())
+        self.save_property("sent")
 
-    def load_from_path(self, full_info=False):
-        """Load properties from a path."""
-        if not os.path.isdir(self.path):
-            raise ValueError("%s is not a directory" % self.path)
-
-        self.read_property_from_file("status", self.status_path)
-        self.read_property_from_file("started", self.started_path)
-        self.read_property_from_file("finished", self.finished_path)
-        self.read_property_from_file("log_output", self.log_path)
-        self.read_property_from_file("sent", self.sent_path)
-
-        if full_info is not False:
-            self.read_property_from_file("executable_code", self.executable_path)
-            self.load_local_parameters()
-
-    def handle_unsupported_file_encoding(self, prop, file_path):
-        """Error handling in case a file has an unsupported file encoding."""
-        if file_path == self.log_path:  # If the current property is a log file
-            self[prop] = (
+    def read_file(self, file_path):
+        """Return the text of a file in the job directory, or None."""
+        try:
+            with open(file_path, "rb") as fh:
+                st = os.fstat(fh.fileno())
+                content = fh.read()
+            if file_path.endswith(".gz"):
+                content = gzip.decompress(content)
+        except (OSError, EOFError):
+            return None
+        file_reads[os.path.basename(file_path)] += 1
+
+        encoding = get_file_encoding(file_path, st, content)
+        if encoding is not None:
+            return content.decode(encoding)
+        # If the current property is a log file
+        if file_path in (self.log_path, self.compressed_log_path):
+            return (
                 "The log had an unsupported file encoding (neither utf-8 nor latin-1)"
             )
-        else:
-            self[prop] = ""
-
-    def read_property_from_file(self, prop, file_path):
-        """Read property from file."""
-        try:
-            with open(file_path, "rb") as file_detect:
-                text_detect = file_detect.read()
-                file_detect = chardet.detect(text_detect)
-
-            if (
-                file_detect["encoding"] == "windows-1252"
-                or file_detect["encoding"] == "ISO-8859-1"
-            ):
-                try:
-                    with open(file_path, "rt", encoding="latin-1") as fh:
-                        self[prop] = fh.read()
-                except Exception:
-                    self.handle_unsupported_file_encoding(prop, file_path)
-            else:  # Assuming utf-8
-                try:
-                    with open(file_path, "rt") as fh:
-                        self[prop] = fh.read()
-                except UnicodeDecodeError:
-                    self.handle_unsupported_file_encoding(prop, file_path)
-
-        except OSError:
-            pass
-
-    def save_property_to_file(self, prop, file_path):
-        """Save property to file."""
-        if prop in self:
-            with open(file_path, "wt") as fh:
-                fh.write(self[prop])
+        return ""
+
+    def save_property(self, prop):
+        """
+        Save an assigned property to its file.
+
+        Indexed properties are updated in the index after the file is
+        written. If the process dies in between, the index is out of date
+        until the job is read, see repair_index.
+        """
+        if getattr(type(self), prop).save(self) and prop in INDEXED_FIELDS:
+            get_job_index().update(self.id, **{prop: getattr(self, prop)})
+
+    def repair_index(self, indexed_status):
+        """
+        Update the index if the status file doesn't say indexed_status.
+
+        Returns True if the index was out of date.
+        """
+        if self.status == indexed_status:
+            return False
+        get_job_index().update(self.id, status=self.status)
+        return True
 
     def populate(self, data):
         """Populate instance with data."""
-        for k in data.keys():
-            self[k] = data[k]
-
-    def save(self):
-        """Save the instance."""
-        self.save_property_to_file("executable_code", self.executable_path)
-        self.save_property_to_file("status", self.status_path)
-        self.save_property_to_file("started", self.started_path)
-        self.save_property_to_file("finished", self.finished_path)
-        self.save_property_to_file("sent", self.sent_path)
+        for k, v in data.items():
+            if k in JOB_DATA_FIELDS:
+                setattr(self, k, v)
+
+    def save(self, downloads=None):
+        """
+        Save the instance.
+
+        If a downloads list is given, attachments are not downloaded but added
+        to it, see translate_parameters.
+        """
+        self.save_property("executable_code")
+        self.save_property("status")
+        self.save_property("started")
+        self.save_property("finished")
+        self.save_property("sent")
+        self.save_property("ordering_key")
+        self.save_property("resource_limits")
 
         # Make sure executable is executable
         if os.path.exists(self.executable_path):
             os.chmod(self.executable_path, stat.S_IRWXU)
 
-        self.translate_parameters()
-        if "local_parameters" in self:
-            with open(self.parameters_path, "wt") as param_fh:
-                param_fh.write(json.dumps(self["local_parameters"]))
+        self.translate_parameters(downloads)
+        self.save_property("local_parameters")
 
-    def translate_parameters(self):
-        """Translate job parameters from an url to a file or string value."""
-        if "parameters" not in self:
+    def translate_parameters(self, downloads=None):
+        """
+        Translate job parameters from an url to a file or string value.
+
+        FILE parameters are downloaded to the attachments directory. If a
+        downloads list is given, the attachments are added to it for the
+        caller to download instead.
+        """
+        if self.parameters is None:
             return
 
         config = OS2borgerPCConfig()
         admin_url = config.get_value("admin_url")
 
         local_params = []
-        self["local_parameters"] = local_params
-        params = self["parameters"]
-        del self["parameters"]
+        pending = []
+        self.local_parameters = local_params
+        params = self.parameters
+        self.parameters = None
         for index, param in enumerate(params):
             if param["type"] == "FILE" and param["value"]:
                 # Make sure we have the directory
@@ -277,17 +520,71 @@ class LocalJob(dict):
                 # urljoin does the right thing for both relative and absolute
                 # values of, er, value
                 full_url = urllib.parse.urljoin(admin_url, value)
-                remote_file = urllib.request.urlopen(full_url)
-                with open(local_filename, "wb") as attachment_fh:
-                    attachment_fh.write(remote_file.read())
+                pending.append(
+                    AttachmentDownload(
+                        full_url, local_filename, index, sha256=param.get("sha256")
+                    )
+                )
                 local_params.append({"type": param["type"], "value": local_filename})
             else:
                 local_params.append(param)
 
+        if downloads is not None:
+            downloads.extend(pending)
+        else:
+            failed = download_attachments(pending, **get_download_settings())
+            if failed:
+                raise failed[0].error
+
     def log(self, message):
         """Write message to log file."""
-        with open(self.log_path, "at") as fh:
-            fh.write(message)
+        if os.path.exists(self.sanitized_log_path):
+            os.remove(self.sanitized_log_path)
+        if os.path.exists(self.compressed_log_path):
+            # Appending adds a gzip member, which is read as a continuation
+            with gzip.open(self.compressed_log_path, "at") as fh:
+                fh.write(message)
+        else:
+            with open(self.log_path, "at") as fh:
+                fh.write(message)
+
+    def finish_log(self):
+        """
+        Sanitize the log of a finished job and compress it if it is long.
+
+        Control characters are removed once, here, and the log is stored as
+        utf-8 and marked as sanitized, so reports don't sanitize it again.
+        Logs of at least job_log_compress_threshold bytes are stored
+        compressed, a threshold of 0 disables compression.
+        """
+        path = LocalJob.log_output.path(self)
+        try:
+            with open(path, "rb") as fh:
+                st = os.fstat(fh.fileno())
+                content = fh.read()
+            if path.endswith(".gz"):
+                content = gzip.decompress(content)
+        except (OSError, EOFError):
+            return
+        file_reads[os.path.basename(path)] += 1
+        encoding = get_file_encoding(path, st, content) or "utf-8"
+        data = sanitize_log(content.decode(encoding, "replace")).encode("utf-8")
+
+        threshold = get_int_config(
+            "job_log_compress_threshold", DEFAULT_JOB_LOG_COMPRESS_THRESHOLD
+        )
+        if threshold > 0 and len(data) >= threshold:
+            new_path, old_path = self.compressed_log_path, self.log_path
+            open_new = gzip.open
+        else:
+            new_path, old_path = self.log_path, self.compressed_log_path
+            open_new = open
+        with open_new(new_path + ".new", "wb") as fh:
+            fh.write(data)
+        os.replace(new_path + ".new", new_path)
+        if os.path.exists(old_path):
+            os.remove(old_path)
+        open(self.sanitized_log_path, "w").close()
 
     def logline(self, message):
         """Write a single line to log file."""
@@ -295,80 +592,121 @@ class LocalJob(dict):
 
     def run(self):
         """Run the job."""
-        self.read_property_from_file("status", self.status_path)
-        if self["status"] != "SUBMITTED":
+        # The index said SUBMITTED
+        self.repair_index("SUBMITTED")
+        if self.status != "SUBMITTED":
             sys.stderr.write(
-                "Job %s: Will only run jobs with status %s\n"
-                % (self.id, self["status"])
+                "Job %s: Will only run jobs with status %s\n" % (self.id, self.status)
             )
             return
-        log = open(self.log_path, "w+")
-        self.load_local_parameters()
         self.set_status("RUNNING")
         cmd = [self.executable_path]
         log_params = []
 
-        for param in self["local_parameters"]:
+        for param in self.local_parameters:
             cmd.append(param["value"])
             log_params.append(param["value"])
 
+        # Hide password parameters everywhere in the log, as it is written
+        passwords = [
+            param["value"].encode("utf-8")
+            for param in self.local_parameters
+            if param["type"] == "PASSWORD" and len(param["value"]) > 1
+        ]
+        head_size = get_int_config("job_log_head_size", DEFAULT_JOB_LOG_HEAD_SIZE)
+        tail_size = get_int_config("job_log_tail_size", DEFAULT_JOB_LOG_TAIL_SIZE)
         self.mark_started()
-        log.write(
-            ">>> Starting process '%s' with arguments [%s] at %s\n"
-            % (
-                self.executable_path,
-                ", ".join(log_params),
-                self["started"],
-            )
-        )
-        log.flush()
-        ret_val = subprocess.call(
-            cmd, stdout=log, stderr=log, timeout=get_job_timeout()
-        )
-        self.mark_finished()
-        log.flush()
-        if ret_val == 0:
-            self.set_status("DONE")
-            log.write(">>> Succeeded at %s\n" % self["finished"])
-        else:
-            self.set_status("FAILED")
+        with open(self.log_path, "wb") as log_fh:
+            log = Redactor(BoundedLog(log_fh, head_size, tail_size), passwords)
             log.write(
-                ">>> Failed with exit status %s at %s\n" % (ret_val, self["finished"])
+                (
+                    ">>> Starting process '%s' with arguments [%s] at %s\n"
+                    % (
+                        self.executable_path,
+                        ", ".join(log_params),
+                        self.started,
+                    )
+                ).encode("utf-8")
             )
+            try:
+                ret_val, rusage = run_with_log(
+                    limit_command(cmd, self.get_resource_limits()),
+                    log,
+                    timeout=get_job_timeout(),
+                )
+            finally:
+                log.finish()
+            self.resource_usage = get_usage(rusage)
+            self.save_property("resource_usage")
+            self.mark_finished()
+            if ret_val == 0:
+                self.set_status("DONE")
+                footer = ">>> Succeeded at %s\n" % self.finished
+            else:
+                self.set_status("FAILED")
+                footer = ">>> Failed with exit status %s at %s\n" % (
+                    ret_val,
+                    self.finished,
+                )
+            log_fh.write(footer.encode("utf-8"))
+        self.finish_log()
         os.remove(self.parameters_path)
 
-        log.seek(0)
-        log_content = log.read()
 
-        for param in self["local_parameters"]:
-            if param["type"] == "PASSWORD" and len(param["value"]) > 1:
-                log_content = log_content.replace(param["value"], "*****")
+def get_file_encoding(file_path, st, content):
+    """
+    Return the encoding of a file's content, or None if it is unsupported.
+
+    Supported encodings are utf-8 and latin-1. Only content which isn't
+    valid utf-8 is run through chardet, and then only a sample around the
+    first invalid byte. Results are cached by path, size and mtime.
+    """
+    key = (file_path, st.st_size, st.st_mtime_ns)
+    if key in _encoding_cache:
+        return _encoding_cache[key]
+
+    try:
+        content.decode("utf-8")
+        encoding = "utf-8"
+    except UnicodeDecodeError as e:
+        # chardet is slow to import and seldom needed, so import it here
+        import chardet
+
+        half = ENCODING_SAMPLE_SIZE // 2
+        sample = content[max(e.start - half, 0) : e.start + half]
+        detected = chardet.detect(sample)["encoding"] or ""
+        if detected.lower() in ("windows-1252", "iso-8859-1"):
+            encoding = "latin-1"
+        else:
+            encoding = None
 
-        log.seek(0)
-        log.write(log_content)
-        log.truncate()
-        log.close()
+    if len(_encoding_cache) >= ENCODING_CACHE_SIZE:
+        _encoding_cache.clear()
+    _encoding_cache[key] = encoding
+    return encoding
 
 
-def get_job_timeout():
-    """Return the set job timeout, may be the default."""
+def get_int_config(key, default):
+    """Return the integer value of a config key, or default if unset or invalid."""
     config = OS2borgerPCConfig()
 
-    if has_config("job_timeout"):
+    if has_config(key):
         try:
-            job_timeout = int(config.get_value("job_timeout"))
+            return int(config.get_value(key))
         except ValueError:
-            job_timeout = DEFAULT_JOB_TIMEOUT
-    else:
-        job_timeout = DEFAULT_JOB_TIMEOUT
+            pass
+    return default
+
 
-    return job_timeout
+def get_job_timeout():
+    """Return the set job timeout, may be the default."""
+    return get_int_config("job_timeout", DEFAULT_JOB_TIMEOUT)
 
 
 def get_instructions():
     """Get instructions from the admin site server."""
-    (remote_url, uid) = get_url_and_uid()
-    remote = OS2borgerPCAdmin(remote_url)
+    remote_url, uid = get_url_and_uid()
+    remote = get_admin(remote_url)
 
     try:
         instructions = remote.get_instructions(uid)
@@ -381,22 +719,86 @@ def get_instructions():
     return instructions
 
 
+def get_download_settings():
+    """Return the attachment download settings as keyword arguments."""
+    cache_size = get_int_config("attachment_cache_size", attachments.DEFAULT_CACHE_SIZE)
+    if cache_size > 0:
+        cache = AttachmentCache(
+            ATTACHMENT_CACHE_DIR,
+            max_size=cache_size * 1024 * 1024,
+            max_age=get_int_config(
+                "attachment_cache_max_age", attachments.DEFAULT_CACHE_MAX_AGE
+            ),
+        )
+    else:
+        cache = None
+    return {
+        "workers": get_int_config(
+            "attachment_download_workers", attachments.DEFAULT_WORKERS
+        ),
+        "timeout": get_int_config(
+            "attachment_download_timeout", attachments.DEFAULT_TIMEOUT
+        ),
+        "cache": cache,
+    }
+
+
 def import_jobs(jobs):
-    """Import jobs from instructions and save them."""
+    """
+    Import jobs from instructions and save them.
+
+    The attachments of all the jobs are downloaded concurrently. Jobs with
+    attachments that can't be downloaded are failed.
+    """
+    jobs_and_downloads = []
     for j in jobs:
         local_job = LocalJob(data=j)
-        local_job.save()
+        downloads = []
+        local_job.save(downloads=downloads)
         local_job.logline("Job imported at %s" % datetime.now())
+        jobs_and_downloads.append((local_job, downloads))
+
+    download_attachments(
+        [d for _, downloads in jobs_and_downloads for d in downloads],
+        **get_download_settings()
+    )
+
+    for local_job, downloads in jobs_and_downloads:
+        failed = [d for d in downloads if d.error]
+        if not failed:
+            continue
+        local_job.mark_started()
+        for d in failed:
+            local_job.logline(
+                ">>> Failed to download parameter %d (%s): %s"
+                % (d.index + 1, d.url, d.error)
+            )
+        local_job.mark_finished()
+        local_job.set_status("FAILED")
+        local_job.finish_log()
+
+
+def get_string_configuration(config_data):
+    """
+    Return the string values of the configuration.
+
+    These are the values managed by the admin site, which replaces them all
+    when its configuration is applied.
+    """
+    # We only care about string values
+    return {key: value for key, value in config_data.items() if isinstance(value, str)}
 
 
 def update_configuration_from_server(configurations):
-    """Update (local) configuration from admin site server."""
+    """
+    Update (local) configuration from admin site server.
+
+    The configuration file is only written if anything has changed, or if
+    its snapshot is stale. Returns True if it was.
+    """
     config = OS2borgerPCConfig()
-    local_config = {}
-    for key, value in config.get_data().items():
-        # We only care about string values
-        if isinstance(value, str):
-            local_config[key] = value
+    old_config = config.get_data()
+    local_config = get_string_configuration(old_config)
 
     for key, value in configurations.items():
         config.set_value(key, value)
@@ -407,7 +809,10 @@ def update_configuration_from_server(configurations):
     for key in local_config.keys():
         config.remove_key(key)
 
+    if config.get_data() == old_config and read_snapshot(config.filename) is not None:
+        return False
     config.save()
+    return True
 
 
 def check_outstanding_packages():
@@ -432,24 +837,45 @@ def check_outstanding_packages():
         return None
 
 
-def report_job_results(joblist):
-    """Report job results back to the admin site server."""
-    (remote_url, uid) = get_url_and_uid()
-    remote = OS2borgerPCAdmin(remote_url)
+def compress_log_output(job):
+    """Replace the log_output of the report data of a job by log_output_gzip."""
+    data = job.pop("log_output").encode("utf-8")
+    job["log_output_gzip"] = xmlrpc.client.Binary(gzip.compress(data))
+
 
-    # Sanitize log output so we're sure it's valid XML before XMLRPC request
+def prepare_report(joblist):
+    """
+    Prepare the report data of jobs for sending, in place, and return it.
+
+    The logs in the report data are valid XML already, see report_data.
+    """
     for job in joblist:
-        # Remove terminal control characters except newlines
-        job["log_output"] = "".join(
-            ch
-            for ch in job["log_output"]
-            if unicodedata.category(ch)[0] != "C" or ch == "\n" or ch == "\t"
-        )
+        if (
+            COMPRESSED_LOG_CAPABILITY in server_capabilities
+            and len(job["log_output"]) >= COMPRESSED_LOG_MIN_SIZE
+        ):
+            compress_log_output(job)
+    return joblist
+
+
+def report_job_results(joblist, update_required=None):
+    """
+    Report job results back to the admin site server.
+
+    update_required is the result of check_outstanding_packages, which is
+    called if it isn't given. If the admin site supports it, longer logs are
+    sent gzip compressed, base64 encoded by XML-RPC.
+    """
+    remote_url, uid = get_url_and_uid()
+    remote = get_admin(remote_url)
+    prepare_report(joblist)
 
     try:
         # This returns 0 on various interpretations of success
+        if update_required is None:
+            update_required = check_outstanding_packages()
         return remote.send_status_info(
-            uid, None, joblist, update_required=check_outstanding_packages()
+            uid, None, joblist, update_required=update_required
         )
     except Exception:
         print("Failed to check in with the admin-site")
@@ -457,101 +883,495 @@ def report_job_results(joblist):
         return 1
 
 
-def flat_map(iterable, function):
-    """Flatten an iterable."""
-    for i in iterable:
-        v = function(i)
-        if v:
-            yield v
+def get_job_dirs(status_list, unsent_only=False):
+    """
+    Return the directories of jobs with a status in status_list.
 
+    If unsent_only is True, only jobs which haven't been sent are included.
+    """
+    # The index returns job IDs sorted, to make sure jobs get executed in a
+    # predictable order
+    job_ids = get_job_index().ids_with_status(status_list, unsent_only)
+    return [os.path.join(JOBS_DIR, str(job_id)) for job_id in job_ids]
 
-def get_job_dirs(status_list):
-    """Return the directories of jobs with a status in status_list."""
-    result = []
-    # Return job directories sorted by job ID, to make sure they get executed
-    # in a predictable order
 
-    def _numbered_dir(item):
-        try:
-            dirpath = os.path.join(JOBS_DIR, item)
-            if os.path.isdir(dirpath):
-                return int(item)
-        except ValueError:
-            pass
-        return None
+def run_pending_jobs(report=True):
+    """
+    Run the submitted jobs.
 
-    job_ids = sorted(flat_map(os.listdir(JOBS_DIR), _numbered_dir))
-    for job_id in job_ids:
-        dirpath = os.path.join(JOBS_DIR, str(job_id))
-        filename = os.path.join(dirpath, "status")
-        if os.path.exists(filename):
-            with open(filename, "r") as fh:
-                if fh.read() in status_list:
-                    result.append(dirpath)
-    return result
+    Jobs sharing an ordering key run one at a time, in id order. Jobs with
+    different ordering keys may run concurrently, up to job_workers at a
+    time. Jobs without an ordering key share the default key, so by default
+    all jobs run one at a time.
 
+    If report is False, the results are left for send_unsent_jobs.
+    """
+    groups = {}
+    for d in get_job_dirs(status_list=["SUBMITTED"]):
+        job = LocalJob(path=d)
+        groups.setdefault(job.ordering_key or DEFAULT_ORDERING_KEY, []).append(job)
 
-def run_pending_jobs():
-    """Run the submitted jobs."""
-    dirs = get_job_dirs(status_list=["SUBMITTED"])
     results = []
+    results_lock = threading.Lock()
 
-    for d in dirs:
-        job = LocalJob(path=d)
-        job.run()
-        results.append(job.report_data)
+    def run_group(jobs):
+        for job in jobs:
+            job.run()
+            if report:
+                # Record results in the order the jobs finish
+                with results_lock:
+                    results.append(job.report_data)
 
-    report_job_results(results)
+    if groups:
+        workers = get_int_config("job_workers", DEFAULT_JOB_WORKERS)
+        workers = max(1, min(workers, len(groups)))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(run_group, jobs) for jobs in groups.values()]
+        # Let every group finish before passing on the first error, if any
+        for future in futures:
+            future.result()
 
+    if report:
+        report_job_results(results)
 
-def send_unsent_jobs():
-    """Send unsent done or failed jobs."""
-    dirs = get_job_dirs(status_list=["DONE", "FAILED"])
-    jobs = []
 
-    for d in dirs:
-        job = LocalJob(path=d)
-        job.load_from_path()
-        if "sent" not in job or not job["sent"]:
-            jobs.append(job)
+def _report_size(data):
+    """Return the approximate size of the report data of a job."""
+    return sum(len(value) for value in data.values() if isinstance(value, str))
 
-    if report_job_results([job.report_data for job in jobs]) == 0:
-        for job in jobs:
+
+def get_report_pages(jobs, max_jobs, max_bytes):
+    """
+    Yield the report data of jobs in pages of (job, report_data) pairs.
+
+    A page holds at most max_jobs jobs and, unless a single job is larger,
+    at most max_bytes of report data. The jobs are read as the pages are
+    consumed, so only one page is held in memory at a time.
+    """
+    page = []
+    page_bytes = 0
+    for job in jobs:
+        data = job.report_data
+        size = _report_size(data)
+        if page and (len(page) >= max_jobs or page_bytes + size > max_bytes):
+            yield page
+            page = []
+            page_bytes = 0
+        page.append((job, data))
+        page_bytes += size
+    if page:
+        yield page
+
+
+def get_unsent_pages():
+    """Return the report pages of unsent done or failed jobs."""
+    dirs = get_job_dirs(status_list=["DONE", "FAILED"], unsent_only=True)
+    max_jobs = max(1, get_int_config("job_report_page_size", DEFAULT_REPORT_PAGE_SIZE))
+    max_bytes = get_int_config("job_report_page_bytes", DEFAULT_REPORT_PAGE_BYTES)
+    return get_report_pages((LocalJob(path=d) for d in dirs), max_jobs, max_bytes)
+
+
+def send_unsent_jobs(pages=None, update_required=None):
+    """
+    Send unsent done or failed jobs.
+
+    The jobs are sent in pages limited by the job_report_page_size and
+    job_report_page_bytes settings, and each page is marked as sent as soon
+    as the admin site has received it. Sending stops at the first page that
+    fails, the rest are sent on the next check-in. pages may be given to
+    continue sending pages from get_unsent_pages.
+    """
+    if pages is None:
+        pages = get_unsent_pages()
+    for page in pages:
+        if update_required is None:
+            update_required = check_outstanding_packages()
+        joblist = [data for _, data in page]
+        if report_job_results(joblist, update_required=update_required) != 0:
+            break
+        for job, _ in page:
+            job.mark_sent()
+
+
+def get_outbox():
+    """Return the outbox of calls waiting to be sent to the admin site."""
+    return Outbox(OUTBOX_FILE)
+
+
+def acknowledge_outbox_calls(calls, results):
+    """
+    Remove outbox calls the admin site has handled, logging any faults.
+
+    Like send_status_info, the calls return 0 on success. Calls returning
+    anything else are kept to be sent again, except True, which some calls
+    return on success. Calls which raised a fault are removed, as sending
+    them again won't help.
+    """
+    answered = []
+    rejected = []
+    for call, result in zip(calls, results):
+        if isinstance(result, xmlrpc.client.Fault):
+            print("Admin site rejected %r: %s" % (call, result), file=sys.stderr)
+            rejected.append(call)
+        elif result is not True and result != 0:
+            print("Admin site failed %r: %r" % (call, result), file=sys.stderr)
+            continue
+        answered.append(call)
+    get_outbox().acknowledge(answered, rejected)
+
+
+def send_checkin_results(remote, uid):
+    """
+    Send the outbox and job results, in as few round trips as possible.
+
+    The pending outbox calls and the first page of unsent jobs are sent in a
+    single multicall, any further pages of a backlog are sent afterwards.
+    """
+    outbox_calls = get_outbox().pending_calls(
+        get_int_config("outbox_flush_size", outbox.DEFAULT_FLUSH_SIZE)
+    )
+    calls = [(call.method, call.args) for call in outbox_calls]
+    pages = get_unsent_pages()
+    page = next(pages, None)
+    update_required = None
+    if page:
+        update_required = check_outstanding_packages()
+        joblist = prepare_report([data for _, data in page])
+        calls.append(("send_status_info", (uid, None, joblist, update_required)))
+    if not calls:
+        return
+
+    results = remote.multicall(calls)
+    acknowledge_outbox_calls(outbox_calls, results)
+    if page:
+        if results[-1] != 0:
+            print("Failed to send job results: %s" % (results[-1],), file=sys.stderr)
+            return
+        for job, _ in page:
             job.mark_sent()
+        send_unsent_jobs(pages, update_required)
 
 
 def fail_unfinished_jobs():
     """Fail jobs that are stuck in running state."""
     dirs = get_job_dirs(status_list=["RUNNING"])
     now = datetime.now()
+    job_timeout = get_job_timeout()
 
     for d in dirs:
         job = LocalJob(path=d)
-        job.load_from_path()
+        if job.repair_index("RUNNING"):
+            continue
         if (
-            "started" in job
-            and (
-                now - datetime.strptime(job["started"], "%Y-%m-%d %H:%M:%S.%f")
-            ).seconds
-            > get_job_timeout()
+            job.started
+            and (now - datetime.strptime(job.started, "%Y-%m-%d %H:%M:%S.%f")).seconds
+            > job_timeout
         ):
             job.mark_finished()
             job.set_status("FAILED")
-            job.logline(">>> Failed due to timeout at %s" % (job["finished"]))
+            job.logline(">>> Failed due to timeout at %s" % (job.finished))
+            job.finish_log()
+
+
+def archive_old_jobs():
+    """
+    Move old jobs out of JOBS_DIR and into the monthly archives.
 
+    Only jobs which are finished and have been sent to the admin site are
+    archived. Archives older than job_archive_months are deleted.
+    """
+    index = get_job_index()
+    max_age = get_int_config("job_retention_days", DEFAULT_JOB_RETENTION_DAYS)
+    keep = get_int_config("job_retention_count", DEFAULT_JOB_RETENTION_COUNT)
+    sent_before = str(datetime.now() - timedelta(days=max_age))
+
+    jobs_by_archive = {}
+    for job_id in index.ids_to_archive(sent_before, keep):
+        fields = index.get(job_id)
+        timestamp = fields["finished"]
+        if not timestamp or not re.match(r"\d{4}-\d{2}", timestamp):
+            timestamp = fields["sent"]
+        name = jobarchive.get_archive_name(timestamp)
+        jobs_by_archive.setdefault(name, []).append(job_id)
+
+    for name, job_ids in sorted(jobs_by_archive.items()):
+        job_dirs = [os.path.join(JOBS_DIR, str(job_id)) for job_id in job_ids]
+        jobarchive.append_jobs(jobarchive.get_archive_path(JOBS_DIR, name), job_dirs)
+        index.mark_archived(job_ids, name)
+        for job_dir in job_dirs:
+            shutil.rmtree(job_dir, ignore_errors=True)
+
+    months = get_int_config("job_archive_months", DEFAULT_JOB_ARCHIVE_MONTHS)
+    now = datetime.now()
+    total_months = now.year * 12 + now.month - 1 - months
+    oldest_kept = "%04d-%02d" % (total_months // 12, total_months % 12 + 1)
+    for name in jobarchive.list_archives(JOBS_DIR):
+        if name < oldest_kept:
+            os.remove(jobarchive.get_archive_path(JOBS_DIR, name))
+            index.remove_archive(name)
+
+
+def read_archived_job_file(job_id, name="output.log"):
+    """Return a file of an archived job as text, or None if it isn't found."""
+    archive = get_job_index().get_archive(job_id)
+    if archive is None:
+        return None
+    archive_path = jobarchive.get_archive_path(JOBS_DIR, archive)
+    content = jobarchive.read_job_file(archive_path, job_id, name)
+    if content is None:
+        # The file may have been stored compressed, like output.log
+        content = jobarchive.read_job_file(archive_path, job_id, name + ".gz")
+        if content is None:
+            return None
+        content = gzip.decompress(content)
+    return content.decode("utf-8", "replace")
+
+
+def _read_instruction_digests():
+    try:
+        with open(INSTRUCTION_DIGESTS_FILE, "r") as fh:
+            return json.load(fh)
+    except (FileNotFoundError, ValueError):
+        return None
 
-def send_config_values(config_dict):
-    """Send config value to admin site server."""
-    (remote_url, uid) = get_url_and_uid()
-    remote = OS2borgerPCAdmin(remote_url)
 
-    remote.push_config_keys(uid, config_dict)
+def get_instruction_digests():
+    """
+    Return the digests of the instructions last applied, or None.
+
+    None means all instructions should be fetched, because the admin site
+    doesn't support conditional instructions or it is time for a resync.
+
+    The digest of the configuration is that of the local values, so the
+    admin site sends its configuration again if they have been changed
+    locally since it was applied, e.g. with set_os2borgerpc_config.
+    """
+    state = _read_instruction_digests()
+    if state is None:
+        return None
+    resync_interval = get_int_config(
+        "config_resync_interval", outbox.DEFAULT_CONFIG_RESYNC_INTERVAL
+    )
+    if time.time() - state["fetched"] >= resync_interval:
+        return None
+    digests = state["digests"]
+    if "configuration" in digests:
+        digests["configuration"] = json_digest(
+            get_string_configuration(OS2borgerPCConfig().get_data())
+        )
+    return digests
+
+
+def save_instruction_digests(instructions, digests):
+    """
+    Save the digests of the instructions applied.
+
+    digests are those sent when fetching the instructions, which stand for
+    the parts the admin site left out.
+    """
+    if CONDITIONAL_INSTRUCTIONS_CAPABILITY not in instructions.get("capabilities", []):
+        forget_instruction_digests()
+        return
+    if digests is None:
+        state = {"fetched": time.time(), "digests": {}}
+    else:
+        state = _read_instruction_digests()
+    for name in DIGESTED_INSTRUCTIONS:
+        if name in instructions:
+            state["digests"][name] = json_digest(instructions[name])
+    os.makedirs(os.path.dirname(INSTRUCTION_DIGESTS_FILE), exist_ok=True)
+    with open(INSTRUCTION_DIGESTS_FILE + ".new", "w") as fh:
+        json.dump(state, fh)
+    os.replace(INSTRUCTION_DIGESTS_FILE + ".new", INSTRUCTION_DIGESTS_FILE)
+
+
+def forget_instruction_digests():
+    """Make the next check-in fetch all instructions."""
+    try:
+        os.remove(INSTRUCTION_DIGESTS_FILE)
+    except FileNotFoundError:
+        pass
+
+
+def configure_multicall(remote, url):
+    """
+    Tell remote whether the admin site at url supports system.multicall.
+
+    The answer is kept in MULTICALL_SUPPORT_FILE, so the admin site is only
+    asked once every MULTICALL_CHECK_INTERVAL seconds, not at every check-in.
+    """
+    try:
+        with open(MULTICALL_SUPPORT_FILE, "r") as fh:
+            state = json.load(fh)
+        if (
+            state["url"] == url
+            and time.time() - state["checked"] < MULTICALL_CHECK_INTERVAL
+        ):
+            remote.multicall_supported = state["supported"]
+            return
+    except (FileNotFoundError, ValueError, KeyError):
+        pass
+    # Ask again, even if the admin client already knows
+    remote.multicall_supported = None
+    remote.multicall_supported = bool(remote.supports_multicall())
+    state = {
+        "url": url,
+        "supported": remote.multicall_supported,
+        "checked": time.time(),
+    }
+    os.makedirs(os.path.dirname(MULTICALL_SUPPORT_FILE), exist_ok=True)
+    with open(MULTICALL_SUPPORT_FILE + ".new", "w") as fh:
+        json.dump(state, fh)
+    os.replace(MULTICALL_SUPPORT_FILE + ".new", MULTICALL_SUPPORT_FILE)
+
+
+def fetch_instructions(remote, uid, digests=None):
+    """
+    Send the pending outbox calls and return the instructions.
+
+    With digests, the admin site leaves out the parts of the instructions
+    that haven't changed.
+    """
+    outbox_calls = get_outbox().pending_calls(
+        get_int_config("outbox_flush_size", outbox.DEFAULT_FLUSH_SIZE)
+    )
+    calls = [(call.method, call.args) for call in outbox_calls]
+    args = (uid, digests) if digests else (uid,)
+    results = remote.multicall(calls + [("get_instructions", args)])
+    acknowledge_outbox_calls(outbox_calls, results)
+    instructions = results[-1]
+    if isinstance(instructions, xmlrpc.client.Fault):
+        print("Error while getting instructions:" + str(instructions), file=sys.stderr)
+        if digests:
+            # The admin site may no longer support digests
+            forget_instruction_digests()
+        raise instructions
+    return instructions
+
+
+def start_instruction_watcher(on_instructions):
+    """
+    Start long-polling the admin site for new instructions.
+
+    on_instructions is called when there are new instructions, for as long
+    as the admin site advertises support for long polls. Returns the
+    watcher, or None if long polls are turned off in the configuration.
+    """
+    timeout = get_int_config(
+        "instruction_long_poll_timeout", longpoll.DEFAULT_POLL_TIMEOUT
+    )
+    remote_url, uid = get_url_and_uid()
+    if timeout <= 0 or not remote_url:
+        return None
+    watcher = InstructionWatcher(
+        remote_url,
+        uid,
+        on_instructions,
+        is_supported=lambda: longpoll.LONG_POLL_CAPABILITY in server_capabilities,
+        timeout=timeout,
+    )
+    watcher.start()
+    return watcher
+
+
+def run_checkin(config_values):
+    """
+    Check in with the admin site and run the jobs, holding the lock.
+
+    config_values are queued for the admin site, if they have changed.
+    """
+    # Everything for the admin site goes through the outbox, which
+    # is sent in two round trips: One also getting the instructions,
+    # and one with the results of the jobs and security scripts.
+    # Each has a deadline, and after repeated network errors the
+    # circuit breaker skips them for a while, with the outbox and
+    # unsent jobs kept for later. Imported jobs are run anyway. Config
+    # values are only queued when they have changed.
+    remote_url, uid = get_url_and_uid()
+    get_outbox().put_config(
+        uid,
+        config_values,
+        changed_only=True,
+        resync_interval=get_int_config(
+            "config_resync_interval", outbox.DEFAULT_CONFIG_RESYNC_INTERVAL
+        ),
+    )
+    remote = get_admin(remote_url)
+    remote.transport.timeout = get_int_config(
+        "admin_call_timeout", admin_client.DEFAULT_CALL_TIMEOUT
+    )
+    checkin_timeout = get_int_config("admin_checkin_timeout", DEFAULT_CHECKIN_TIMEOUT)
+    breaker = CircuitBreaker(CIRCUIT_BREAKER_FILE)
+
+    instructions = None
+    digests = get_instruction_digests()
+    if breaker.allow():
+        try:
+            with remote.deadline(checkin_timeout):
+                configure_multicall(remote, remote_url)
+                instructions = fetch_instructions(remote, uid, digests)
+        except NETWORK_ERRORS:
+            print("Network error, only running local jobs ...")
+            traceback.print_exc()
+            breaker.record_failure()
+        except xmlrpc.client.Fault:
+            # The admin site is reachable, but failed
+            print("Admin site error, only running local jobs ...")
+            traceback.print_exc()
+        else:
+            breaker.record_success()
+    else:
+        print(
+            "Admin site unreachable, not contacting it until %s"
+            % datetime.fromtimestamp(breaker.open_until).strftime("%H:%M:%S")
+        )
+
+    if instructions is not None:
+        server_capabilities.clear()
+        server_capabilities.update(instructions.get("capabilities", []))
+        if COMPRESSED_REQUESTS_CAPABILITY in server_capabilities:
+            remote.transport.encode_threshold = get_int_config(
+                "admin_gzip_min_size", admin_client.DEFAULT_GZIP_MIN_SIZE
+            )
+        else:
+            remote.transport.encode_threshold = None
+        if "jobs" in instructions:
+            import_jobs(instructions["jobs"])
+        if "configuration" in instructions:
+            update_configuration_from_server(instructions["configuration"])
+    run_pending_jobs(report=False)
+    fail_unfinished_jobs()
+
+    if instructions is not None:
+        # Security scripts left out are unchanged
+        now, security_events = prepare_security_events(
+            instructions.get("security_scripts", None if digests else [])
+        )
+        save_instruction_digests(instructions, digests)
+        if security_events:
+            get_outbox().put("push_security_events", [uid, security_events])
+        finish_security_events(now, security_events, True)
+        try:
+            with remote.deadline(checkin_timeout):
+                send_checkin_results(remote, uid)
+        except NETWORK_ERRORS:
+            print("Network error while sending results ...")
+            traceback.print_exc()
+            breaker.record_failure()
+        except xmlrpc.client.Fault:
+            print("Admin site error while sending results ...")
+            traceback.print_exc()
+        else:
+            breaker.record_success()
+    archive_old_jobs()
 
 
 def update_and_run():
     """Run the main function for the jobmanager."""
     os.makedirs(JOBS_DIR, mode=0o700, exist_ok=True)
     config = OS2borgerPCConfig()
+    import distro
+
     # Get OS info for configuration
     os_name = distro.name()
     os_release = distro.version()
@@ -576,6 +1396,14 @@ def update_and_run():
         ).strftime("%Y-%m-%d %H:%M")
     else:
         last_automatic_update_time = ""
+    config_values = {
+        "_os2borgerpc.client_version": OS2BORGERPC_CLIENT_VERSION,
+        "_os_release": os_release,
+        "_os_name": os_name,
+        "_ip_addresses": ip_addresses,
+        "_kernel_version": kernel_version,
+        "_last_automatic_update_time": last_automatic_update_time,
+    }
     if has_config("job_timeout"):
         try:
             job_timeout = int(config.get_value("job_timeout"))
@@ -583,32 +1411,13 @@ def update_and_run():
             job_timeout = DEFAULT_JOB_TIMEOUT
     else:
         job_timeout = DEFAULT_JOB_TIMEOUT
-        send_config_values({"job_timeout": job_timeout})
+        config_values["job_timeout"] = job_timeout
     try:
         with filelock(LOCK_FILE, max_age=job_timeout):
             try:
-                send_config_values(
-                    {
-                        "_os2borgerpc.client_version": OS2BORGERPC_CLIENT_VERSION,
-                        "_os_release": os_release,
-                        "_os_name": os_name,
-                        "_ip_addresses": ip_addresses,
-                        "_kernel_version": kernel_version,
-                        "_last_automatic_update_time": last_automatic_update_time,
-                    }
-                )
-                instructions = get_instructions()
-                if "jobs" in instructions:
-                    import_jobs(instructions["jobs"])
-                if "configuration" in instructions:
-                    update_configuration_from_server(instructions["configuration"])
-                run_pending_jobs()
-                fail_unfinished_jobs()
-                send_unsent_jobs()
-                security_scripts = instructions.get("security_scripts", [])
-                check_security_events(security_scripts)
-            except (OSError, socket.error):
-                print("Network error, exiting ...")
+                run_checkin(config_values)
+            except OSError:
+                print("Error during check-in, exiting ...")
                 traceback.print_exc()
     except OSError:
         print("Couldn't get lock")
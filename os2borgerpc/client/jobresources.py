@@ -0,0 +1,94 @@
+"""Module for limiting and measuring the resources used by jobs."""
+
+import os.path
+import shutil
+import sys
+
+# Resource limit settings, as named in the job data from the admin site. In
+# the configuration they are prefixed by "job_", e.g. job_nice.
+# nice: nice level, -20 to 19
+# ionice_class: I/O scheduling class, 1 (realtime), 2 (best-effort) or 3 (idle)
+# rlimit_as: maximum size of the address space of the job, in bytes
+# rlimit_cpu: maximum CPU time of the job, in seconds
+# systemd_scope: run the job in its own systemd scope (cgroup), if available
+# memory_max: memory limit of the scope, as understood by systemd, e.g. 1G
+# cpu_quota: CPU quota of the scope, in percent of one CPU
+LIMIT_SETTINGS = (
+    "nice",
+    "ionice_class",
+    "rlimit_as",
+    "rlimit_cpu",
+    "systemd_scope",
+    "memory_max",
+    "cpu_quota",
+)
+
+
+def _is_set(value):
+    return value is not None and value != ""
+
+
+def _is_true(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
+def _int_limit(limits, setting):
+    """Return the integer value of a limit, or None if unset or invalid."""
+    value = limits.get(setting)
+    if not _is_set(value):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        sys.stderr.write("Ignoring invalid job limit %s: %r\n" % (setting, value))
+        return None
+
+
+def has_systemd():
+    """Return True if systemd is running and systemd-run is installed."""
+    return os.path.isdir("/run/systemd/system") and bool(shutil.which("systemd-run"))
+
+
+def limit_command(cmd, limits):
+    """
+    Return cmd wrapped in the commands applying the resource limits.
+
+    limits is a dict with (some of) the LIMIT_SETTINGS. The limits are
+    applied by wrapper commands which exec the next command, so the job
+    keeps running as the same process. Wrappers which aren't installed, and
+    limits which aren't valid integers, are skipped.
+    """
+    prefix = []
+    if _is_true(limits.get("systemd_scope")) and has_systemd():
+        prefix += ["systemd-run", "--scope", "--quiet", "--collect"]
+        if _is_set(limits.get("memory_max")):
+            prefix += ["-p", "MemoryMax=%s" % limits["memory_max"]]
+        cpu_quota = _int_limit(limits, "cpu_quota")
+        if cpu_quota is not None:
+            prefix += ["-p", "CPUQuota=%d%%" % cpu_quota]
+    nice = _int_limit(limits, "nice")
+    if nice is not None and shutil.which("nice"):
+        prefix += ["nice", "-n", str(nice)]
+    ionice_class = _int_limit(limits, "ionice_class")
+    if ionice_class is not None and shutil.which("ionice"):
+        prefix += ["ionice", "-c", str(ionice_class)]
+    rlimits = []
+    rlimit_as = _int_limit(limits, "rlimit_as")
+    if rlimit_as is not None:
+        rlimits.append("--as=%d" % rlimit_as)
+    rlimit_cpu = _int_limit(limits, "rlimit_cpu")
+    if rlimit_cpu is not None:
+        rlimits.append("--cpu=%d" % rlimit_cpu)
+    if rlimits and shutil.which("prlimit"):
+        prefix += ["prlimit"] + rlimits + ["--"]
+    return prefix + list(cmd)
+
+
+def get_usage(rusage):
+    """Return the peak RSS in kB and CPU time in seconds from a struct_rusage."""
+    return {
+        "peak_rss_kb": rusage.ru_maxrss,
+        "cpu_time": round(rusage.ru_utime + rusage.ru_stime, 3),
+    }
@@ -0,0 +1,94 @@
+"""Module for the long-poll channel announcing new instructions."""
+
+import random
+import threading
+import time
+import traceback
+import xmlrpc.client
+
+from os2borgerpc.client.admin_client import OS2borgerPCAdmin
+
+# The admin site supports wait_for_instructions
+LONG_POLL_CAPABILITY = "instruction_long_poll"
+# Seconds the admin site may hold a poll before answering. Kept below the
+# idle timeouts of common proxies.
+DEFAULT_POLL_TIMEOUT = 50
+# Extra seconds to wait for the answer to a poll
+POLL_TIMEOUT_MARGIN = 30
+# Least seconds between two polls, should the admin site answer at once
+MIN_POLL_INTERVAL = 1
+# Seconds to wait before polling again after an error, doubled after each
+# error up to MAX_RETRY_DELAY
+RETRY_DELAY = 5
+MAX_RETRY_DELAY = 300
+# Seconds between checks of whether the admin site supports long polls
+SUPPORT_CHECK_INTERVAL = 60
+
+
+class InstructionWatcher(threading.Thread):
+    """
+    Thread long-polling the admin site for new instructions.
+
+    wait_for_instructions(uid, token, timeout) returns a token for the
+    current instructions of the PC, once it differs from token or after
+    timeout seconds. Whenever the token changes, on_instructions is called,
+    typically to start a check-in right away. The regular check-ins go on
+    as before, so nothing is lost if the channel is down.
+
+    The watcher has its own connection, so a waiting poll doesn't hold up
+    other calls to the admin site. It only polls while is_supported()
+    returns true, and backs off after errors.
+    """
+
+    def __init__(
+        self,
+        url,
+        uid,
+        on_instructions,
+        is_supported=lambda: True,
+        timeout=DEFAULT_POLL_TIMEOUT,
+    ):
+        """Poll the admin site at url for the PC uid."""
+        super().__init__(name="instruction-watcher", daemon=True)
+        self.admin = OS2borgerPCAdmin(url)
+        self.admin.transport.timeout = timeout + POLL_TIMEOUT_MARGIN
+        self.uid = uid
+        self.on_instructions = on_instructions
+        self.is_supported = is_supported
+        self.timeout = timeout
+        self.token = None
+        self.polls = 0
+        self._stopped = threading.Event()
+
+    def stop(self):
+        """Stop polling, after a poll in progress has been answered."""
+        self._stopped.set()
+
+    def poll(self):
+        """Wait for the instructions to change, return True if they did."""
+        self.polls += 1
+        token = self.admin.wait_for_instructions(self.uid, self.token, self.timeout)
+        changed = self.token is not None and token != self.token
+        self.token = token
+        if changed:
+            self.on_instructions()
+        return changed
+
+    def run(self):
+        """Poll until stopped."""
+        retry_delay = RETRY_DELAY
+        while not self._stopped.is_set():
+            if not self.is_supported():
+                self.token = None
+                self._stopped.wait(SUPPORT_CHECK_INTERVAL)
+                continue
+            started = time.monotonic()
+            try:
+                self.poll()
+            except (OSError, xmlrpc.client.Error):
+                traceback.print_exc()
+                self._stopped.wait(random.uniform(retry_delay / 2, retry_delay))
+                retry_delay = min(retry_delay * 2, MAX_RETRY_DELAY)
+                continue
+            retry_delay = RETRY_DELAY
+            self._stopped.wait(started + MIN_POLL_INTERVAL - time.monotonic())
@@ -0,0 +1,244 @@
+"""Module for the outbox of calls waiting to be sent to the admin site."""
+
+import contextlib
+import fcntl
+import json
+import os
+import os.path
+import time
+import uuid
+
+from os2borgerpc.client.utils import json_digest
+
+DEFAULT_OUTBOX_PATH = "/var/lib/os2borgerpc/outbox.jsonl"
+# Most entries sent to the admin site in one flush
+DEFAULT_FLUSH_SIZE = 100
+# Seconds between pushes of all config values, changed or not, in case the
+# admin site has lost track of them
+DEFAULT_CONFIG_RESYNC_INTERVAL = 24 * 60 * 60
+
+CONFIG_METHOD = "push_config_keys"
+
+
+class OutboxCall:
+    """A call to the admin site made from one or more outbox entries."""
+
+    def __init__(self, entry_ids, method, args):
+        """Make a call of method with args, acknowledging entry_ids."""
+        self.entry_ids = entry_ids
+        self.method = method
+        self.args = args
+
+    def __repr__(self):
+        """Return a readable representation, for logs."""
+        return "OutboxCall(%r, %r)" % (self.method, self.entry_ids)
+
+
+class Outbox:
+    """
+    Durable outbox of calls to the admin site.
+
+    Calls are appended to a file of JSON lines, one per entry, and stay
+    there until the admin site has received them. An entry with a key
+    supersedes older entries with the same key, and config values pushed
+    separately are merged into a single push_config_keys call per PC, so a
+    long outage doesn't make for a long replay. Entries are sent in the
+    order they were added.
+
+    A digest of each config value the admin site has received is kept next
+    to the outbox, so config values can be pushed only when they change.
+    """
+
+    def __init__(self, path=DEFAULT_OUTBOX_PATH):
+        """Use the outbox stored in path."""
+        self.path = path
+        self.lock_path = path + ".lock"
+        self.pushed_path = path + ".pushed"
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Hold the lock of the outbox, shared by all processes using it."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.lock_path, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def put(self, method, args, key=None):
+        """Add a call of method with args, superseding older calls with key."""
+        with self._locked():
+            self._append([self._entry(method, args, key)])
+
+    def put_config(
+        self,
+        uid,
+        config_dict,
+        changed_only=False,
+        resync_interval=DEFAULT_CONFIG_RESYNC_INTERVAL,
+    ):
+        """
+        Add config values to push, superseding older values of the keys.
+
+        Values which are already waiting to be pushed aren't added again, so
+        the outbox doesn't grow while the admin site is unreachable. With
+        changed_only, values the admin site has already received are left
+        out too, except once every resync_interval seconds.
+        """
+        with self._locked():
+            queued = {
+                entry["key"]: entry["args"][1]
+                for entry in self._read()
+                if entry["method"] == CONFIG_METHOD
+            }
+            pushed = self._read_pushed()
+            if changed_only and time.time() - pushed["resynced"] >= resync_interval:
+                changed_only = False
+                pushed["resynced"] = time.time()
+                self._write_pushed(pushed)
+            entries = []
+            for key, value in config_dict.items():
+                entry_key = "config:%s:%s" % (uid, key)
+                if entry_key in queued:
+                    # A newer value than the one pushed may be waiting
+                    if queued[entry_key] == {key: value}:
+                        continue
+                elif changed_only and pushed["digests"].get(entry_key) == json_digest(
+                    value
+                ):
+                    continue
+                entries.append(
+                    self._entry(CONFIG_METHOD, [uid, {key: value}], entry_key)
+                )
+            self._append(entries)
+
+    @staticmethod
+    def _entry(method, args, key):
+        return {"id": uuid.uuid4().hex, "method": method, "args": args, "key": key}
+
+    def _append(self, entries):
+        if not entries:
+            return
+        with open(self.path, "ab+") as fh:
+            if fh.tell() > 0:
+                fh.seek(-1, os.SEEK_END)
+                if fh.read(1) != b"\n":
+                    # Don't continue a line left half written by a crash
+                    fh.write(b"\n")
+            for entry in entries:
+                fh.write(json.dumps(entry).encode("utf-8") + b"\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+
+    def _read_pushed(self):
+        try:
+            with open(self.pushed_path, "r") as fh:
+                return json.load(fh)
+        except (FileNotFoundError, ValueError):
+            return {"resynced": 0, "digests": {}}
+
+    def _write_pushed(self, pushed):
+        with open(self.pushed_path + ".new", "w") as fh:
+            json.dump(pushed, fh)
+        os.replace(self.pushed_path + ".new", self.pushed_path)
+
+    def _read(self):
+        try:
+            with open(self.path, "r") as fh:
+                lines = fh.readlines()
+        except FileNotFoundError:
+            return []
+        entries = []
+        for line in lines:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # A line left half written by a crash
+                continue
+        return entries
+
+    def entries(self):
+        """Return the entries which aren't superseded, oldest first."""
+        with self._locked():
+            entries = self._read()
+        latest = {entry["key"]: entry["id"] for entry in entries if entry["key"]}
+        return [
+            entry
+            for entry in entries
+            if not entry["key"] or latest[entry["key"]] == entry["id"]
+        ]
+
+    def pending_calls(self, max_entries=DEFAULT_FLUSH_SIZE):
+        """
+        Return the calls to make for the oldest max_entries entries.
+
+        Superseded entries are acknowledged along with the entries replacing
+        them, so they are removed when the calls have been made.
+        """
+        with self._locked():
+            entries = self._read()
+        latest = {}
+        for entry in entries:
+            if entry["key"]:
+                latest.setdefault(entry["key"], []).append(entry["id"])
+
+        calls = []
+        config_calls = {}
+        for entry in entries:
+            key = entry["key"]
+            if key and latest[key][-1] != entry["id"]:
+                continue
+            if len(calls) >= max_entries:
+                break
+            entry_ids = latest[key] if key else [entry["id"]]
+            if entry["method"] == CONFIG_METHOD:
+                uid, config_dict = entry["args"]
+                if uid in config_calls:
+                    call = config_calls[uid]
+                    call.entry_ids.extend(entry_ids)
+                    call.args[1].update(config_dict)
+                    continue
+                call = OutboxCall(list(entry_ids), CONFIG_METHOD, [uid, config_dict])
+                config_calls[uid] = call
+            else:
+                call = OutboxCall(entry_ids, entry["method"], entry["args"])
+            calls.append(call)
+        return calls
+
+    def acknowledge(self, calls, rejected=()):
+        """
+        Remove the entries of calls which the admin site has answered.
+
+        The config values of calls which aren't among the rejected calls are
+        recorded as received.
+        """
+        done = {entry_id for call in calls for entry_id in call.entry_ids}
+        if not done:
+            return
+        with self._locked():
+            remaining = [entry for entry in self._read() if entry["id"] not in done]
+            with open(self.path + ".new", "w") as fh:
+                for entry in remaining:
+                    fh.write(json.dumps(entry) + "\n")
+                fh.flush()
+                os.fsync(fh.fileno())
+            os.replace(self.path + ".new", self.path)
+
+            received = [
+                call
+                for call in calls
+                if call.method == CONFIG_METHOD and call not in rejected
+            ]
+            if received:
+                pushed = self._read_pushed()
+                for call in received:
+                    uid, config_dict = call.args
+                    for key, value in config_dict.items():
+                        entry_key = "config:%s:%s" % (uid, key)
+                        pushed["digests"][entry_key] = json_digest(value)
+                self._write_pushed(pushed)
+
+    def __len__(self):
+        """Return the number of entries which aren't superseded."""
+        return len(self.entries())
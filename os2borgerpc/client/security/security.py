@@ -9,7 +9,7 @@ import subprocess
 import sys
 import traceback
 
-from os2borgerpc.client.admin_client import OS2borgerPCAdmin
+from os2borgerpc.client.admin_client import get_admin
 from os2borgerpc.client.utils import get_url_and_uid
 
 # Main folder for the security module.
@@ -91,8 +91,8 @@ def send_security_events(security_events):
 
     Return True/False for success/error.
     """
-    (remote_url, uid) = get_url_and_uid()
-    remote = OS2borgerPCAdmin(remote_url)
+    remote_url, uid = get_url_and_uid()
+    remote = get_admin(remote_url)
     try:
         result = remote.push_security_events(uid, security_events)
         return result == 0
@@ -128,29 +128,48 @@ def read_last_security_events_checked_time():
     return None
 
 
-def check_security_events(security_scripts):
-    """Entrypoint for security events checking."""
+def prepare_security_events(security_scripts):
+    """
+    Run the security scripts and return the time and the new security events.
+
+    security_scripts None means the scripts already imported are unchanged.
+    The events are to be sent by the caller, which must then call
+    finish_security_events.
+    """
     os.makedirs(SECURITY_DIR, mode=0o700, exist_ok=True)
 
     now = datetime.now()
 
+    if security_scripts is None:
+        security_scripts_imported = any(SECURITY_DIR.glob("s_*"))
+    else:
+        cleanup_security_scripts()
+        import_new_security_scripts(security_scripts)
+        security_scripts_imported = bool(security_scripts)
+
     # If no security scripts exist simply update the last checked time
     # So the security event collection only includes new security events.
-    if not security_scripts:
-        update_last_security_events_checked_time(now)
-        return
+    if not security_scripts_imported:
+        return now, []
 
-    cleanup_security_scripts()
-    import_new_security_scripts(security_scripts)
     run_security_scripts()
-    new_security_events = collect_security_events(now)
+    return now, collect_security_events(now)
+
 
+def finish_security_events(now, security_events, sent):
+    """Record that the security events collected at now have been handled."""
     # Only update last checked time in case sending security events is successful
     # or none is found.
-    if new_security_events:
-        result = send_security_events(new_security_events)
-        if result:
+    if security_events:
+        if sent:
             os.remove(SECURITY_EVENT_FILE)
             update_last_security_events_checked_time(now)
     else:
         update_last_security_events_checked_time(now)
+
+
+def check_security_events(security_scripts):
+    """Entrypoint for security events checking."""
+    now, security_events = prepare_security_events(security_scripts)
+    sent = bool(security_events) and send_security_events(security_events)
+    finish_security_events(now, security_events, sent)
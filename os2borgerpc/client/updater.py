@@ -4,12 +4,13 @@ import traceback
 import sys
 import subprocess
 
-import requests
-
 from os2borgerpc.client.config import get_config
 
 def get_latest_version_from_github(repo_url):
     """Get the latest version tag from a GitHub repository."""
+    # requests is slow to import and seldom needed, so import it here
+    import requests
+
     try:
         response = requests.get(f"https://api.github.com/repos/{repo_url}/tags")
         response.raise_for_status()
@@ -25,6 +26,8 @@ def get_latest_version_from_github(repo_url):
 
 def get_newest_client_version():
     """Get the newest client version from GitHub or PyPI based on configuration."""
+    import requests
+
     client_package = get_config("os2borgerpc_client_package")
     
     if client_package.startswith("https://github.com/"):
@@ -9,6 +9,8 @@ import contextlib
 import time
 import signal
 import errno
+import hashlib
+import json
 
 from .config import OS2borgerPCConfig
 
@@ -77,3 +79,12 @@ def get_url_and_uid():
     xml_rpc_url = config_data.get("xml_rpc_url", "/admin-xml/")
     rpc_url = urllib.parse.urljoin(admin_url, xml_rpc_url)
     return (rpc_url, uid)
+
+
+def json_digest(value):
+    """
+    Return the SHA-256 hex digest of value encoded as JSON with sorted keys.
+
+    The admin site computes the digests of instructions the same way.
+    """
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode()).hexdigest()
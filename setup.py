@@ -25,6 +25,7 @@ setup(
         "bin/register_new_os2borgerpc_client.sh",
         "bin/admin_connect.sh",
         "bin/randomize_jobmanager.sh",
+        "bin/install_jobmanager_service.sh",
     ],
     classifiers=[
         "Programming Language :: Python :: 3",
@@ -32,5 +33,5 @@ setup(
         "Operating System :: POSIX :: Linux",
     ],
     zip_safe=False,
-    python_requires=">=3.6",
+    python_requires=">=3.8",
 )
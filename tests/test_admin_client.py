@@ -0,0 +1,186 @@
+import socketserver
+import threading
+import time
+import xmlrpc.client
+from xmlrpc.server import SimpleXMLRPCRequestHandler
+from xmlrpc.server import SimpleXMLRPCServer
+
+import pytest
+
+from os2borgerpc.client.admin_client import DeadlineExceeded
+from os2borgerpc.client.admin_client import get_admin
+from os2borgerpc.client.admin_client import OS2borgerPCAdmin
+
+
+class ThreadingXMLRPCServer(socketserver.ThreadingMixIn, SimpleXMLRPCServer):
+    # Don't wait for kept alive connections on shutdown
+    daemon_threads = True
+    block_on_close = False
+
+
+class CountingHandler(SimpleXMLRPCRequestHandler):
+    rpc_paths = ("/admin-xml/",)
+    requests = []
+
+    def do_POST(self):
+        self.requests.append(self.path)
+        super().do_POST()
+
+
+class KeepAliveHandler(CountingHandler):
+    protocol_version = "HTTP/1.1"
+
+
+def get_instructions(pc_uid):
+    return {"jobs": [], "uid": pc_uid}
+
+
+class NoGzipHandler(KeepAliveHandler):
+    def decode_request_content(self, data):
+        if self.headers.get("content-encoding", "identity") != "identity":
+            self.send_response(415)
+            self.send_header("Content-length", "0")
+            self.end_headers()
+            return None
+        return data
+
+
+def echo(value):
+    return value
+
+
+def sleep(seconds):
+    time.sleep(seconds)
+    return 0
+
+
+def push_config_keys(pc_uid, config_dict):
+    if not config_dict:
+        raise ValueError("no config")
+    return 0
+
+
+def make_server(multicall, handler=CountingHandler):
+    CountingHandler.requests = []
+    server = ThreadingXMLRPCServer(
+        ("127.0.0.1", 0),
+        requestHandler=handler,
+        allow_none=True,
+        logRequests=False,
+    )
+    server.register_function(get_instructions)
+    server.register_function(push_config_keys)
+    server.register_function(sleep)
+    server.register_function(echo)
+    if multicall:
+        server.register_introspection_functions()
+        server.register_multicall_functions()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+@pytest.fixture(params=[True, False], ids=["multicall", "no_multicall"])
+def server(request):
+    server = make_server(request.param)
+    yield request.param, "http://127.0.0.1:%d/admin-xml/" % server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+class TestMulticall:
+    def test_multicall(self, server):
+        multicall, url = server
+        admin = OS2borgerPCAdmin(url)
+        calls = [
+            ("push_config_keys", ("uid", {"key": "value"})),
+            ("push_config_keys", ("uid", {})),
+            ("get_instructions", ("uid",)),
+        ]
+
+        # Calls aren't batched until the server is known to support it
+        assert admin.multicall(calls)[2] == {"jobs": [], "uid": "uid"}
+        assert len(CountingHandler.requests) == 3
+        assert admin.supports_multicall() is multicall
+
+        CountingHandler.requests = []
+        ok, fault, instructions = admin.multicall(calls)
+        assert ok == 0
+        assert isinstance(fault, xmlrpc.client.Fault)
+        assert instructions == {"jobs": [], "uid": "uid"}
+        # Either one round trip, or each call
+        assert len(CountingHandler.requests) == (1 if multicall else 3)
+
+
+class TestKeepAliveTransport:
+    @pytest.mark.parametrize(
+        "handler,connections", [(KeepAliveHandler, 1), (CountingHandler, 3)]
+    )
+    def test_connection_reuse(self, handler, connections):
+        server = make_server(False, handler)
+        url = "http://127.0.0.1:%d/admin-xml/" % server.server_address[1]
+        try:
+            for _ in range(3):
+                assert get_admin(url).get_instructions("uid")["uid"] == "uid"
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        stats = get_admin(url).transport.stats
+        assert stats["connections"] == connections
+        assert stats["reused"] == 3 - connections
+        assert stats["handshake_time"] > 0
+        assert len(CountingHandler.requests) == 3
+
+    def test_timeouts(self):
+        server = make_server(False, KeepAliveHandler)
+        admin = OS2borgerPCAdmin(
+            "http://127.0.0.1:%d/admin-xml/" % server.server_address[1]
+        )
+        try:
+            admin.transport.timeout = 0.2
+            with pytest.raises(TimeoutError):
+                admin.multicall([("sleep", (1,))])
+
+            admin.transport.timeout = 10
+            with admin.deadline(0.5):
+                assert admin.multicall([("sleep", (0.1,))]) == [0]
+                start = time.monotonic()
+                with pytest.raises(TimeoutError):
+                    admin.multicall([("sleep", (2,))])
+                # The call was cut short at the deadline
+                assert time.monotonic() - start < 1
+                with pytest.raises(DeadlineExceeded):
+                    admin.multicall([("sleep", (0,))])
+            assert admin.multicall([("sleep", (0,))]) == [0]
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    @pytest.mark.parametrize("handler", [KeepAliveHandler, NoGzipHandler])
+    def test_compression(self, handler):
+        server = make_server(False, handler)
+        admin = OS2borgerPCAdmin(
+            "http://127.0.0.1:%d/admin-xml/" % server.server_address[1]
+        )
+        log = "Setting up libfoo1 (1.2.3-4) ...\n" * 1000
+        try:
+            admin.transport.encode_threshold = 1024
+            assert admin.multicall([("echo", ("short",))]) == ["short"]
+            assert admin.multicall([("echo", (log,))]) == [log]
+            # Later requests are sent the same way
+            assert admin.multicall([("echo", (log,))]) == [log]
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        stats = admin.transport.stats
+        # Responses are compressed by the server either way
+        assert stats["received_bytes"] < len(log)
+        if handler is NoGzipHandler:
+            assert admin.transport.encode_threshold is None
+            # Both long requests ended up being sent uncompressed
+            assert stats["sent_bytes"] > 2 * len(log)
+        else:
+            assert stats["sent_bytes"] < len(log) // 10
+            assert stats["compress_time"] > 0
@@ -0,0 +1,194 @@
+import hashlib
+import http.server
+import threading
+
+import pytest
+
+from os2borgerpc.client import attachments
+
+
+class AttachmentHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    files = {"/media/a.txt": b"first", "/media/b.txt": b"second"}
+    requests = []
+
+    def do_GET(self):
+        self.requests.append((self.path, self.headers.get("If-None-Match")))
+        content = self.files.get(self.path)
+        if content is None:
+            self.send_error(404)
+            return
+        etag = '"%d"' % hash(content)
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(content)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    AttachmentHandler.requests = []
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), AttachmentHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:%d" % httpd.server_address[1]
+    httpd.shutdown()
+    httpd.server_close()
+
+
+class TestDownloadAttachments:
+    def test_download_attachments(self, server, tmpdir):
+        downloads = [
+            attachments.AttachmentDownload(
+                server + "/media/a.txt", str(tmpdir.join("0_a.txt")), 0
+            ),
+            attachments.AttachmentDownload(
+                server + "/media/missing.txt", str(tmpdir.join("1_missing.txt")), 1
+            ),
+            attachments.AttachmentDownload(
+                server + "/media/b.txt", str(tmpdir.join("2_b.txt")), 2
+            ),
+        ]
+
+        failed = attachments.download_attachments(downloads, workers=2, timeout=10)
+
+        assert failed == [downloads[1]]
+        assert "404" in str(downloads[1].error)
+        assert tmpdir.join("0_a.txt").read() == "first"
+        assert tmpdir.join("2_b.txt").read() == "second"
+        assert not tmpdir.join("1_missing.txt").check()
+        assert not tmpdir.join("1_missing.txt.part").check()
+
+    def test_same_url_is_downloaded_once(self, server, tmpdir):
+        downloads = [
+            attachments.AttachmentDownload(
+                server + "/media/a.txt", str(tmpdir.join("%d_a.txt" % i)), 0
+            )
+            for i in range(3)
+        ]
+
+        assert attachments.download_attachments(downloads, workers=3) == []
+        assert len(AttachmentHandler.requests) == 1
+        assert [tmpdir.join("%d_a.txt" % i).read() for i in range(3)] == ["first"] * 3
+
+
+class TestAttachmentCache:
+    def test_cached_attachment_costs_no_requests(self, server, tmpdir):
+        cache = attachments.AttachmentCache(str(tmpdir.join("cache")))
+        job_1 = tmpdir.mkdir("1")
+        job_2 = tmpdir.mkdir("2")
+
+        attachments.download_attachments(
+            [
+                attachments.AttachmentDownload(
+                    server + "/media/a.txt", str(job_1.join("0_a.txt")), 0
+                )
+            ],
+            cache=cache,
+        )
+        # A new cache object reads the saved index
+        cache = attachments.AttachmentCache(str(tmpdir.join("cache")))
+        attachments.download_attachments(
+            [
+                attachments.AttachmentDownload(
+                    server + "/media/a.txt", str(job_2.join("0_a.txt")), 0
+                )
+            ],
+            cache=cache,
+        )
+
+        assert len(AttachmentHandler.requests) == 1
+        assert job_2.join("0_a.txt").read() == "first"
+        assert job_2.join("0_a.txt").stat().mode & 0o777 == 0o644
+
+    def test_jobs_get_private_copies(self, server, tmpdir):
+        cache = attachments.AttachmentCache(str(tmpdir.join("cache")))
+        url = server + "/media/a.txt"
+        digest = hashlib.sha256(b"first").hexdigest()
+        for job_id in ["1", "2"]:
+            attachments.download_attachments(
+                [
+                    attachments.AttachmentDownload(
+                        url, str(tmpdir.join(job_id)), 0, sha256=digest
+                    )
+                ],
+                cache=cache,
+            )
+            # Changed in place, keeping the size
+            with open(str(tmpdir.join(job_id)), "r+") as fh:
+                fh.write("FIRST")
+
+        assert len(AttachmentHandler.requests) == 1
+        assert tmpdir.join("cache", "objects", digest).read() == "first"
+
+    def test_digest_mismatch_is_not_cached(self, server, tmpdir):
+        cache = attachments.AttachmentCache(str(tmpdir.join("cache")))
+        download = attachments.AttachmentDownload(
+            server + "/media/a.txt", str(tmpdir.join("a.txt")), 0, sha256="0" * 64
+        )
+
+        assert attachments.download_attachments([download], cache=cache) == [download]
+        assert "sha256" in str(download.error)
+        assert not tmpdir.join("a.txt").check()
+        assert tmpdir.join("cache", "objects").listdir() == []
+
+    def test_expired_attachment_is_revalidated(self, server, tmpdir):
+        cache = attachments.AttachmentCache(str(tmpdir.join("cache")), max_age=0)
+        for job_id in ["1", "2"]:
+            attachments.download_attachments(
+                [
+                    attachments.AttachmentDownload(
+                        server + "/media/b.txt", str(tmpdir.join(job_id)), 0
+                    )
+                ],
+                cache=cache,
+            )
+
+        etag = AttachmentHandler.requests[0][1]
+        assert AttachmentHandler.requests == [
+            ("/media/b.txt", etag),
+            ("/media/b.txt", '"%d"' % hash(b"second")),
+        ]
+        assert tmpdir.join("2").read() == "second"
+
+    def test_server_provided_digest(self, tmpdir):
+        cache = attachments.AttachmentCache(str(tmpdir.join("cache")))
+        digest = hashlib.sha256(b"cached").hexdigest()
+        tmpdir.join("cache", "objects", digest).write("cached")
+
+        failed = attachments.download_attachments(
+            [
+                attachments.AttachmentDownload(
+                    "http://unreachable.invalid/a.txt",
+                    str(tmpdir.join("a.txt")),
+                    0,
+                    sha256=digest,
+                )
+            ],
+            cache=cache,
+        )
+
+        assert failed == []
+        assert tmpdir.join("a.txt").read() == "cached"
+
+    def test_evict_least_recently_used(self, tmpdir):
+        cache = attachments.AttachmentCache(str(tmpdir.join("cache")), max_size=10)
+        objects = tmpdir.join("cache", "objects")
+        for age, name in enumerate(["new", "old", "oldest"]):
+            objects.join(name).write("12345")
+            objects.join(name).setmtime(1000000 - age)
+            cache.index["http://x/" + name] = {"sha256": name, "checked": 0}
+
+        cache.evict()
+
+        assert sorted(f.basename for f in objects.listdir()) == ["new", "old"]
+        assert sorted(cache.index) == ["http://x/new", "http://x/old"]
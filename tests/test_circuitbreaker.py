@@ -0,0 +1,46 @@
+from unittest import mock
+
+from freezegun import freeze_time
+
+from os2borgerpc.client.circuitbreaker import CircuitBreaker
+
+
+class TestCircuitBreaker:
+    @freeze_time("2022-01-01 12:00:00")
+    @mock.patch("random.uniform", lambda low, high: high)
+    def test_opens_and_backs_off(self, tmpdir):
+        path = str(tmpdir.join("state").join("breaker.json"))
+
+        allowed = []
+        delays = []
+        for _ in range(5):
+            # The state is persisted between runs
+            breaker = CircuitBreaker(path, threshold=2, base_delay=60, max_delay=200)
+            allowed.append(breaker.allow())
+            breaker.record_failure()
+            delays.append(breaker.open_until and breaker.open_until - 1641038400)
+
+        assert allowed == [True, True, False, False, False]
+        assert delays == [0, 60, 120, 200, 200]
+
+        breaker.record_success()
+        assert CircuitBreaker(path).allow()
+        assert CircuitBreaker(path).failures == 0
+
+    @mock.patch("random.uniform", lambda low, high: low)
+    def test_jitter_and_retry(self, tmpdir):
+        path = str(tmpdir.join("breaker.json"))
+        with freeze_time("2022-01-01 12:00:00") as frozen:
+            breaker = CircuitBreaker(path, threshold=1, base_delay=60)
+            breaker.record_failure()
+            assert not breaker.allow()
+            frozen.tick(29)
+            assert not breaker.allow()
+            frozen.tick(1)
+            # A single attempt is let through once the delay has passed
+            assert breaker.allow()
+
+    def test_corrupt_state_is_ignored(self, tmpdir):
+        path = tmpdir.join("breaker.json")
+        path.write("{")
+        assert CircuitBreaker(str(path)).allow()
@@ -0,0 +1,75 @@
+import json
+import os
+
+from os2borgerpc.client import config
+from os2borgerpc.client.config import OS2borgerPCConfig
+
+
+class TestConfigCache:
+    def test_parsed_once_until_changed(self, tmpdir):
+        conf = tmpdir.join("os2borgerpc.conf")
+        conf.write("hostname: pc\njob_timeout: '900'\n")
+        filenames = [str(conf)]
+        parse_count = config.parse_count
+
+        for _ in range(10):
+            assert OS2borgerPCConfig(filenames).get_value("hostname") == "pc"
+            assert config.has_config("job_timeout", filenames)
+        assert config.parse_count == parse_count + 1
+
+        # Changes of the same size are noticed by the mtime
+        conf.write("hostname: p2\njob_timeout: '900'\n")
+        os.utime(str(conf), ns=(0, 0))
+        assert config.get_config("hostname", filenames) == "p2"
+        assert config.parse_count == parse_count + 2
+
+    def test_save_updates_cache(self, tmpdir):
+        conf = tmpdir.join("os2borgerpc.conf")
+        conf.write("hostname: pc\n")
+        filenames = [str(conf)]
+        parse_count = config.parse_count
+
+        first = OS2borgerPCConfig(filenames)
+        first.set_value("site", "magenta")
+        # Objects don't share unsaved changes
+        assert not config.has_config("site", filenames)
+        first.save()
+
+        assert config.get_config("site", filenames) == "magenta"
+        assert config.parse_count == parse_count + 1
+
+
+class TestConfigSnapshot:
+    def test_reads_use_fresh_snapshot(self, tmpdir):
+        conf = tmpdir.join("os2borgerpc.conf")
+        filenames = [str(conf)]
+        saved = OS2borgerPCConfig(filenames)
+        saved.set_value("hostname", "pc")
+        saved.set_value("security.enabled", "True")
+        saved.save()
+
+        assert json.loads(tmpdir.join("os2borgerpc.conf.json").read())["data"] == {
+            "hostname": "pc",
+            "security.enabled": "True",
+        }
+        # No YAML is parsed, not even for missing keys
+        config._cache.clear()
+        parse_count = config.parse_count
+        assert config.get_config("hostname", filenames) == "pc"
+        assert config.get_config("security.enabled", filenames) == "True"
+        assert not config.has_config("site", filenames)
+        assert config.parse_count == parse_count
+        # Nested configuration is read from the config file
+        assert config.get_config("security", filenames) == {"enabled": "True"}
+        assert config.parse_count == parse_count + 1
+
+    def test_stale_snapshot_is_ignored(self, tmpdir):
+        conf = tmpdir.join("os2borgerpc.conf")
+        filenames = [str(conf)]
+        config.set_config("hostname", "pc", filenames)
+
+        # Edited by hand
+        conf.write("hostname: edited\n")
+
+        assert config.read_snapshot(str(conf)) is None
+        assert config.get_config("hostname", filenames) == "edited"
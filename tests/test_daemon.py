@@ -0,0 +1,61 @@
+import threading
+from unittest import mock
+
+from os2borgerpc.client.config import OS2borgerPCConfig
+from os2borgerpc.client.daemon import Daemon
+
+
+class TestDaemon:
+    def test_checks_in_at_intervals(self, tmpdir):
+        conf = tmpdir.join("os2borgerpc.conf")
+        conf.write("checkin_interval: '0'\ncheckin_jitter: '0'\n")
+
+        def checkin():
+            if daemon.checkins == 1:
+                raise OSError("Connection refused")
+            if daemon.checkins == 3:
+                daemon.stop()
+
+        daemon = Daemon(checkin, [str(conf)])
+        daemon.run()
+
+        # An error in one check-in doesn't stop the daemon
+        assert daemon.checkins == 4
+
+    def test_settings_reloaded_when_config_changes(self, tmpdir):
+        conf = tmpdir.join("os2borgerpc.conf")
+        conf.write("checkin_interval: '600'\n")
+        daemon = Daemon(lambda: None, [str(conf)])
+
+        with mock.patch(
+            "os2borgerpc.client.daemon.OS2borgerPCConfig", wraps=OS2borgerPCConfig
+        ) as config_mock:
+            daemon.reload_settings()
+            daemon.reload_settings()
+            assert config_mock.call_count == 1
+            assert (daemon.interval, daemon.jitter) == (600, 60)
+
+            conf.write("checkin_interval: '120'\ncheckin_jitter: 'bad'\n")
+            daemon.reload_settings()
+            assert config_mock.call_count == 2
+            assert (daemon.interval, daemon.jitter) == (120, 60)
+
+    def test_wake_and_stop(self, tmpdir):
+        conf = tmpdir.join("os2borgerpc.conf")
+        conf.write("checkin_interval: '3600'\ncheckin_jitter: '0'\n")
+        checked_in = threading.Semaphore(0)
+        daemon = Daemon(checked_in.release, [str(conf)])
+        thread = threading.Thread(target=daemon.run)
+        thread.start()
+        try:
+            assert checked_in.acquire(timeout=5)
+            # The next check-in is an hour away, unless woken
+            assert not checked_in.acquire(timeout=0.2)
+            daemon.wake()
+            assert checked_in.acquire(timeout=5)
+        finally:
+            daemon.stop()
+            thread.join(timeout=5)
+
+        assert not thread.is_alive()
+        assert daemon.checkins == 2
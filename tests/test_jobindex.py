@@ -0,0 +1,48 @@
+from unittest import mock
+
+from os2borgerpc.client import jobmanager
+from os2borgerpc.client.jobindex import JobIndex
+
+
+class TestJobIndex:
+    def test_migrate_existing_job_dirs(self, tmpdir):
+        jobs = tmpdir.mkdir("jobs")
+        jobs.join("7").join("status").write("DONE", mode="w+", ensure=True)
+        jobs.join("7").join("sent").write("2022-01-01", mode="w+", ensure=True)
+        jobs.join("12").join("status").write("SUBMITTED", mode="w+", ensure=True)
+        jobs.join("running").write("")
+
+        index = JobIndex(jobs)
+
+        assert index.ids_with_status(["DONE", "SUBMITTED"]) == [7, 12]
+        assert index.get(7) == {
+            "status": "DONE",
+            "started": None,
+            "finished": None,
+            "sent": "2022-01-01",
+        }
+
+    def test_corrupt_index_is_rebuilt(self, tmpdir):
+        jobs = tmpdir.mkdir("jobs")
+        jobs.join("1").join("status").write("FAILED", mode="w+", ensure=True)
+        jobs.join("jobs.sqlite").write("this is not a database")
+
+        index = JobIndex(jobs)
+
+        assert index.ids_with_status(["FAILED"]) == [1]
+
+    def test_local_job_updates_index(self, tmpdir):
+        jobs = tmpdir.mkdir("jobs")
+
+        with mock.patch("os2borgerpc.client.jobmanager.JOBS_DIR", jobs):
+            job = jobmanager.LocalJob(id=3)
+            job.set_status("SUBMITTED")
+            assert jobmanager.get_job_dirs(["SUBMITTED"]) == [str(jobs.join("3"))]
+
+            job.set_status("DONE")
+            job.mark_sent()
+            index = jobmanager.get_job_index()
+            assert index.get(3)["sent"] == job.sent
+
+        assert index.ids_with_status(["SUBMITTED"]) == []
+        assert index.get(3)["status"] == "DONE"
@@ -0,0 +1,135 @@
+import io
+import subprocess
+import time
+
+import pytest
+
+from os2borgerpc.client import joblog
+
+
+class TestBoundedLog:
+    def test_short_output_is_kept(self):
+        fh = io.BytesIO()
+        log = joblog.BoundedLog(fh, head_size=10, tail_size=10)
+        log.write(b"hello ")
+        log.write(b"world")
+        log.finish()
+
+        assert fh.getvalue() == b"hello world"
+
+    def test_long_output_keeps_head_and_tail(self):
+        fh = io.BytesIO()
+        log = joblog.BoundedLog(fh, head_size=4, tail_size=4)
+        for chunk in [b"abc", b"defghij", b"klmnopqrstuvwxyz"]:
+            log.write(chunk)
+            # Nothing beyond the head reaches the disk while the job runs
+            assert len(fh.getvalue()) <= 4
+        log.finish()
+
+        assert fh.getvalue() == (
+            b"abcd\n>>> [... 18 bytes of output omitted ...]\nwxyz"
+        )
+
+    def test_utf8_characters_are_not_split(self):
+        fh = io.BytesIO()
+        log = joblog.BoundedLog(fh, head_size=2, tail_size=2)
+        log.write("aæbcdøe".encode("utf-8"))
+        log.finish()
+
+        head, _, tail = fh.getvalue().partition(b"\n>>> [")
+        assert head.decode("utf-8") == "a"
+        assert tail.split(b"]\n")[1].decode("utf-8") == "e"
+
+
+class TestRunWithLog:
+    def test_output_and_exit_code(self):
+        log = io.BytesIO()
+        ret_val, rusage = joblog.run_with_log(
+            ["sh", "-c", "echo out; echo err >&2; exit 3"], log, timeout=10
+        )
+
+        assert ret_val == 3
+        assert rusage.ru_maxrss > 0
+        assert sorted(log.getvalue().splitlines()) == [b"err", b"out"]
+
+    def test_background_process_does_not_block(self):
+        log = io.BytesIO()
+        ret_val, _ = joblog.run_with_log(
+            ["sh", "-c", "sleep 30 & echo started"], log, timeout=10
+        )
+
+        assert ret_val == 0
+        assert log.getvalue() == b"started\n"
+
+    def test_background_process_outlives_job(self, tmpdir):
+        alive = tmpdir.join("alive")
+        ret_val, _ = joblog.run_with_log(
+            ["sh", "-c", "(sleep 1; echo tick; touch %s) & echo started" % alive],
+            io.BytesIO(),
+            timeout=10,
+        )
+
+        assert ret_val == 0
+        # Writing to the output after the job has finished doesn't kill it
+        for _ in range(50):
+            if alive.exists():
+                break
+            time.sleep(0.1)
+        assert alive.exists()
+
+    def test_timeout(self):
+        with pytest.raises(subprocess.TimeoutExpired):
+            joblog.run_with_log(["sleep", "30"], io.BytesIO(), timeout=0.5)
+
+    def test_timeout_after_output_is_closed(self):
+        with pytest.raises(subprocess.TimeoutExpired):
+            joblog.run_with_log(
+                ["sh", "-c", "exec >&- 2>&-; sleep 30"], io.BytesIO(), timeout=0.5
+            )
+
+
+class TestRedactor:
+    class Sink(io.BytesIO):
+        def finish(self):
+            pass
+
+    def redact(self, chunks, secrets):
+        sink = self.Sink()
+        redactor = joblog.Redactor(sink, secrets)
+        for chunk in chunks:
+            redactor.write(chunk)
+        redactor.finish()
+        return sink.getvalue()
+
+    def test_no_secrets(self):
+        assert self.redact([b"abc", b"def"], []) == b"abcdef"
+
+    def test_all_secrets_are_redacted(self):
+        assert (
+            self.redact([b"user hunter2 pw s3cret, hunter2!"], [b"hunter2", b"s3cret"])
+            == b"user ***** pw *****, *****!"
+        )
+
+    def test_secret_split_across_chunks(self):
+        chunks = [b"login: hun", b"t", b"er2\npartial hunt", b"er3"]
+        assert self.redact(chunks, [b"hunter2"]) == (b"login: *****\npartial hunter3")
+
+    def test_overlapping_prefixes(self):
+        # "aab" has to be found after the failed match on "aaa"
+        assert self.redact([b"xaa", b"aab", b"y"], [b"aab", b"aaa"]) == (b"x*****aby")
+        assert self.redact([b"xaaab", b"y"], [b"aab"]) == b"xa*****y"
+
+    def test_held_back_bytes_are_flushed(self):
+        assert self.redact([b"ends with hunt"], [b"hunter2"]) == b"ends with hunt"
+
+
+class TestSanitizeLog:
+    def test_ascii(self):
+        text = "\x1b[1mbold\x1b[0m\r\n\ttab\x00\x7f"
+        assert joblog.sanitize_log(text) == "[1mbold[0m\n\ttab"
+
+    def test_unicode(self):
+        # C1 controls, format characters and unassigned code points are
+        # removed, like the ASCII controls
+        text = "æøå\x85 \u200bzero width\ufeff \U000e0001\u0378\r\n\tdone \U0001f600"
+        assert joblog.sanitize_log(text) == "æøå zero width \n\tdone \U0001f600"
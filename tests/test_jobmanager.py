@@ -1,4 +1,6 @@
+import gzip
 import stat
+import xmlrpc.client
 from datetime import (
     datetime,
     timedelta,
@@ -6,11 +8,18 @@ from datetime import (
 from unittest import mock
 from freezegun import freeze_time
 
+import chardet
+import pytest
+
 from os2borgerpc.client import (
     jobmanager,
     config,
+    utils,
 )
 
+# Several tests replace report_job_results with a mock, keep the real one
+report_job_results = jobmanager.report_job_results
+
 
 class TestJobManager:
     def test_get_job_dirs(self, tmpdir):
@@ -30,6 +39,9 @@ class TestJobManager:
         assert job_dirs == [str(job_1), str(job_4)]
 
     @freeze_time("2022-01-01 12:00:00")
+    @mock.patch(
+        "os2borgerpc.client.jobmanager.check_outstanding_packages", lambda: (1, 0)
+    )
     def test_send_unsent_jobs(self, tmpdir):
         now = datetime.now()
         report_job_results_mock = mock.MagicMock()
@@ -63,7 +75,8 @@ class TestJobManager:
                     "finished": str(now),
                     "log_output": "test_log",
                 }
-            ]
+            ],
+            update_required=(1, 0),
         )
         assert unsent_job.join("sent").read() == "2022-01-01 12:00:00"
 
@@ -159,12 +172,12 @@ class TestJobManager:
     @freeze_time("2022-01-01 12:00:00")
     @mock.patch("os2borgerpc.client.jobmanager.get_url_and_uid", lambda: ("url", "uid"))
     def test_update_configuration_and_import_jobs(self, tmpdir):
-        # Mock OS2borgerPCAdmin and return instructions on 'get_instructions'.
+        # Mock get_admin and return instructions on 'get_instructions'.
         jobs = tmpdir.mkdir("jobs")
         os2borgerpc_dir = tmpdir.mkdir("os2borgerpc")
 
         os2borgerpcadmin_mock = mock.MagicMock()
-        jobmanager.OS2borgerPCAdmin = os2borgerpcadmin_mock
+        jobmanager.get_admin = os2borgerpcadmin_mock
         os2borgerpc_conf = os2borgerpc_dir.join("os2borgerpc.conf").ensure()
 
         os2borgerpcconfig_mock = mock.MagicMock()
@@ -199,7 +212,10 @@ class TestJobManager:
         }
         os2borgerpcadmin_mock.return_value.get_instructions.return_value = instructions
 
-        with mock.patch("os2borgerpc.client.jobmanager.JOBS_DIR", jobs):
+        with mock.patch("os2borgerpc.client.jobmanager.JOBS_DIR", jobs), mock.patch(
+            "os2borgerpc.client.jobmanager.ATTACHMENT_CACHE_DIR",
+            str(tmpdir.join("cache")),
+        ):
             jobmanager.update_configuration_from_server(instructions["configuration"])
             jobmanager.import_jobs(instructions["jobs"])
 
@@ -210,3 +226,749 @@ class TestJobManager:
         assert job.join("executable").read() == "#!/usr/bin/env\necho $1"
         assert job.join("executable").stat().mode & stat.S_IXUSR
         assert job.join("output.log").read() == "Job imported at 2022-01-01 12:00:00\n"
+
+    @freeze_time("2022-03-15 12:00:00")
+    def test_archive_old_jobs(self, tmpdir):
+        jobs = tmpdir.mkdir("jobs")
+
+        def make_job(job_id, finished, sent):
+            job = jobs.join(str(job_id))
+            job.join("status").write("DONE", mode="w+", ensure=True)
+            job.join("started").write(finished, mode="w+", ensure=True)
+            job.join("finished").write(finished, mode="w+", ensure=True)
+            if sent:
+                job.join("sent").write(sent, mode="w+", ensure=True)
+            job.join("output.log").write("log %s" % job_id, mode="w+", ensure=True)
+            job.join("attachments").join("file").write("x", ensure=True)
+            return job
+
+        old_job = make_job(1, "2022-01-02 10:00:00", "2022-01-02 10:05:00")
+        older_job = make_job(2, "2021-12-30 10:00:00", "2021-12-31 10:05:00")
+        unsent_job = make_job(3, "2021-12-30 10:00:00", None)
+        recent_job = make_job(4, "2022-03-14 10:00:00", "2022-03-14 10:05:00")
+
+        with mock.patch("os2borgerpc.client.jobmanager.JOBS_DIR", jobs):
+            jobmanager.archive_old_jobs()
+
+            assert not old_job.check()
+            assert not older_job.check()
+            assert unsent_job.check()
+            assert recent_job.check()
+            assert jobs.join("archive").join("2022-01.tar.gz").check()
+            assert jobs.join("archive").join("2021-12.tar.gz").check()
+            assert jobmanager.read_archived_job_file(1) == "log 1"
+            assert jobmanager.read_archived_job_file(2) == "log 2"
+            assert jobmanager.read_archived_job_file(2, "attachments/file") is None
+            assert jobmanager.read_archived_job_file(4) is None
+
+            # A second archiving run appends to the existing monthly archive
+            job = jobmanager.LocalJob(
+                data={
+                    "id": 5,
+                    "status": "DONE",
+                    "finished": "2022-01-20 10:00:00",
+                    "sent": "2022-01-20 10:05:00",
+                }
+            )
+            job.save()
+            job.log("log 5")
+            jobmanager.archive_old_jobs()
+            assert jobmanager.read_archived_job_file(1) == "log 1"
+            assert jobmanager.read_archived_job_file(5) == "log 5"
+
+            # Rebuilding the index recovers the archived jobs
+            jobmanager.get_job_index().rebuild()
+            assert jobmanager.get_job_index().get_archive(5) == "2022-01"
+            assert jobmanager.get_job_index().get_archive(2) == "2021-12"
+
+    @freeze_time(
+        datetime(year=2022, month=1, day=1, hour=12, minute=0, second=0, microsecond=1)
+    )
+    def test_run_pending_jobs_truncates_log(self, tmpdir):
+        report_job_results_mock = mock.MagicMock()
+        jobmanager.report_job_results = report_job_results_mock
+
+        jobs = tmpdir.mkdir("jobs")
+        pending_job = jobs.join("1")
+        pending_job.join("status").write("SUBMITTED", mode="w+", ensure=True)
+        pending_job.join("parameters.json").write("[]", mode="w+", ensure=True)
+        pending_job_executable = pending_job.join("executable")
+        pending_job_executable.write(
+            "#!/usr/bin/env sh\nseq 1 100000", mode="w+", ensure=True
+        )
+        pending_job_executable.chmod(pending_job_executable.stat().mode | stat.S_IXUSR)
+
+        with mock.patch("os2borgerpc.client.jobmanager.JOBS_DIR", jobs), mock.patch(
+            "os2borgerpc.client.jobmanager.DEFAULT_JOB_LOG_HEAD_SIZE", 200
+        ), mock.patch("os2borgerpc.client.jobmanager.DEFAULT_JOB_LOG_TAIL_SIZE", 14):
+            jobmanager.run_pending_jobs()
+
+        log = pending_job.join("output.log").read()
+        assert pending_job.join("status").read() == "DONE"
+        assert log.startswith(">>> Starting process")
+        assert "\n1\n2\n3\n" in log
+        assert "bytes of output omitted ...]\n" in log
+        assert log.endswith(
+            "\n99999\n100000\n>>> Succeeded at 2022-01-01 12:00:00.000001\n"
+        )
+        assert len(log) < 400
+
+    @freeze_time(
+        datetime(year=2022, month=1, day=1, hour=12, minute=0, second=0, microsecond=1)
+    )
+    def test_run_pending_jobs_hides_passwords(self, tmpdir):
+        report_job_results_mock = mock.MagicMock()
+        jobmanager.report_job_results = report_job_results_mock
+
+        jobs = tmpdir.mkdir("jobs")
+        pending_job = jobs.join("1")
+        pending_job.join("status").write("SUBMITTED", mode="w+", ensure=True)
+        pending_job.join("parameters.json").write(
+            '[{"type": "PASSWORD", "value": "hunter2"},'
+            ' {"type": "STRING", "value": "user"}]',
+            mode="w+",
+            ensure=True,
+        )
+        pending_job_executable = pending_job.join("executable")
+        pending_job_executable.write(
+            '#!/usr/bin/env sh\necho "$2:$1"', mode="w+", ensure=True
+        )
+        pending_job_executable.chmod(pending_job_executable.stat().mode | stat.S_IXUSR)
+
+        with mock.patch("os2borgerpc.client.jobmanager.JOBS_DIR", jobs):
+            jobmanager.run_pending_jobs()
+
+        assert pending_job.join("output.log").read() == (
+            f">>> Starting process '{str(pending_job_executable)}' with arguments"
+            " [*****, user] at 2022-01-01 12:00:00.000001\n"
+            "user:*****\n"
+            ">>> Succeeded at 2022-01-01 12:00:00.000001\n"
+        )
+
+    @freeze_time("2022-01-01 12:00:00")
+    def test_import_jobs_fails_jobs_with_missing_attachments(self, tmpdir):
+        jobs = tmpdir.mkdir("jobs")
+        conf = tmpdir.join("os2borgerpc.conf")
+        conf.write("admin_url: http://admin.example/\n")
+
+        def fake_download(downloads, **kwargs):
+            downloads[1].error = OSError("connection refused")
+            return [downloads[1]]
+
+        jobs_data = [
+            {
+                "id": 1,
+                "status": "SUBMITTED",
+                "parameters": [{"type": "FILE", "value": "/media/a.txt"}],
+                "executable_code": "#!/usr/bin/env sh\ncat $1",
+            },
+            {
+                "id": 2,
+                "status": "SUBMITTED",
+                "parameters": [{"type": "FILE", "value": "/media/b.txt"}],
+                "executable_code": "#!/usr/bin/env sh\ncat $1",
+            },
+        ]
+        with mock.patch("os2borgerpc.client.jobmanager.JOBS_DIR", jobs), mock.patch(
+            "os2borgerpc.client.jobmanager.OS2borgerPCConfig",
+            lambda: config.OS2borgerPCConfig([str(conf)]),
+        ), mock.patch(
+            "os2borgerpc.client.jobmanager.ATTACHMENT_CACHE_DIR",
+            str(tmpdir.join("cache")),
+        ), mock.patch(
+            "os2borgerpc.client.jobmanager.download_attachments",
+            side_effect=fake_download,
+        ) as download_mock:
+            jobmanager.import_jobs(jobs_data)
+
+        # All attachments are fetched in a single batch
+        download_mock.assert_called_once()
+        urls = [d.url for d in download_mock.call_args[0][0]]
+        assert urls == [
+            "http://admin.example/media/a.txt",
+            "http://admin.example/media/b.txt",
+        ]
+
+        assert jobs.join("1").join("status").read() == "SUBMITTED"
+        assert jobs.join("2").join("status").read() == "FAILED"
+        assert jobs.join("2").join("output.log").read() == (
+            "Job imported at 2022-01-01 12:00:00\n"
+            ">>> Failed to download parameter 1 (http://admin.example/media/b.txt):"
+            " connection refused\n"
+        )
+
+    def test_read_property_from_file_encodings(self, tmpdir):
+        jobs = tmpdir.mkdir("jobs")
+        utf8_log = jobs.join("utf8.log")
+        utf8_log.write_binary("Blåbærgrød\n".encode("utf-8") * 1000)
+        latin1_log = jobs.join("latin1.log")
+        latin1_log.write_binary(
+            b"plain ascii\n" * 10000 + "Blåbærgrød og æbleskiver\n".encode("latin-1")
+        )
+        broken_log = jobs.join("1").join("output.log")
+        broken_log.write_binary(b"\x00\xff\xfe\x81\x9d" * 20, ensure=True)
+
+        with mock.patch("os2borgerpc.client.jobmanager.JOBS_DIR", jobs), mock.patch(
+            "chardet.detect", wraps=chardet.detect
+        ) as detect_mock:
+            job = jobmanager.LocalJob(id=1)
+            utf8 = job.read_file(str(utf8_log))
+            assert detect_mock.call_count == 0
+
+            latin1 = job.read_file(str(latin1_log))
+            latin1 = job.read_file(str(latin1_log))
+            assert detect_mock.call_count == 1
+            # Only a sample around the first non utf-8 byte is inspected
+            assert len(detect_mock.call_args[0][0]) < 40000
+
+            log_output = job.log_output
+
+        assert utf8 == "Blåbærgrød\n" * 1000
+        assert latin1.endswith("Blåbærgrød og æbleskiver\n")
+        assert log_output == (
+            "The log had an unsupported file encoding (neither utf-8 nor latin-1)"
+        )
+
+    @freeze_time(
+        datetime(year=2022, month=1, day=1, hour=12, minute=0, second=0, microsecond=1)
+    )
+    @mock.patch(
+        "os2borgerpc.client.jobmanager.check_outstanding_packages", lambda: None
+    )
+    def test_checkin_file_reads(self, tmpdir):
+        now = datetime.now()
+        report_job_results_mock = mock.MagicMock()
+        report_job_results_mock.return_value = 0
+        jobmanager.report_job_results = report_job_results_mock
+
+        jobs = tmpdir.mkdir("jobs")
+        for job_id, status, sent in [
+            ("1", "DONE", True),
+            ("2", "DONE", False),
+            ("3", "RUNNING", False),
+        ]:
+            job = jobs.join(job_id)
+            job.join("status").write(status, mode="w+", ensure=True)
+            job.join("started").write(str(now), mode="w+", ensure=True)
+            job.join("output.log").write("test_log", mode="w+", ensure=True)
+            if status == "DONE":
+                job.join("finished").write(str(now), mode="w+", ensure=True)
+            if sent:
+                job.join("sent").write(str(now), mode="w+", ensure=True)
+
+        with mock.patch("os2borgerpc.client.jobmanager.JOBS_DIR", jobs):
+            # Build the index before counting
+            jobmanager.get_job_index()
+            jobmanager.file_reads.clear()
+
+            jobmanager.run_pending_jobs()
+            jobmanager.fail_unfinished_jobs()
+            jobmanager.send_unsent_jobs()
+
+        # Only the log of the job being reported is read, and only once. The
+        # status of the running job is read to check the index.
+        assert jobmanager.file_reads == {
+            "started": 2,
+            "status": 2,
+            "finished": 1,
+            "output.log": 1,
+        }
+
+    def test_local_job_memoizes_properties(self, tmpdir):
+        jobs = tmpdir.mkdir("jobs")
+        jobs.join("1").join("status").write("DONE", mode="w+", ensure=True)
+
+        with mock.patch("os2borgerpc.client.jobmanager.JOBS_DIR", jobs):
+            job = jobmanager.LocalJob(id=1)
+            jobmanager.file_reads.clear()
+
+            assert job.status == "DONE"
+            assert job.status == "DONE"
+            assert job.sent is None
+            assert jobmanager.file_reads == {"status": 1}
+
+            jobs.join("1").join("status").write("FAILED!")
+            assert job.status == "FAILED!"
+            assert jobmanager.file_reads == {"status": 2}
+
+            # Writing a property doesn't require reading it back
+            job.set_status("SUBMITTED")
+            assert job.status == "SUBMITTED"
+            assert jobmanager.file_reads == {"status": 2}
+
+    def _make_pending_job(self, jobs, job_id, script, ordering_key=None):
+        job = jobs.join(str(job_id))
+        job.join("status").write("SUBMITTED", mode="w+", ensure=True)
+        job.join("parameters.json").write("[]", mode="w+", ensure=True)
+        if ordering_key is not None:
+            job.join("ordering_key").write(ordering_key, mode="w+", ensure=True)
+        executable = job.join("executable")
+        executable.write("#!/usr/bin/env sh\n" + script, mode="w+", ensure=True)
+        executable.chmod(executable.stat().mode | stat.S_IXUSR)
+
+    def test_run_pending_jobs_concurrently(self, tmpdir):
+        report_job_results_mock = mock.MagicMock()
+        jobmanager.report_job_results = report_job_results_mock
+
+        jobs = tmpdir.mkdir("jobs")
+        self._make_pending_job(jobs, 1, "sleep 1", ordering_key="packages")
+        self._make_pending_job(jobs, 2, "true", ordering_key="packages")
+        self._make_pending_job(jobs, 3, "true", ordering_key="config")
+
+        with mock.patch("os2borgerpc.client.jobmanager.JOBS_DIR", jobs), mock.patch(
+            "os2borgerpc.client.jobmanager.DEFAULT_JOB_WORKERS", 2
+        ):
+            jobmanager.run_pending_jobs()
+
+        # Job 3 doesn't wait for the slow job 1, but job 2 shares its key
+        results = report_job_results_mock.call_args[0][0]
+        assert [r["id"] for r in results] == ["3", "1", "2"]
+        assert all(r["status"] == "DONE" for r in results)
+
+    def test_run_pending_jobs_in_order_by_default(self, tmpdir):
+        report_job_results_mock = mock.MagicMock()
+        jobmanager.report_job_results = report_job_results_mock
+
+        jobs = tmpdir.mkdir("jobs")
+        self._make_pending_job(jobs, 1, "sleep 0.5")
+        self._make_pending_job(jobs, 2, "true")
+
+        with mock.patch("os2borgerpc.client.jobmanager.JOBS_DIR", jobs), mock.patch(
+            "os2borgerpc.client.jobmanager.DEFAULT_JOB_WORKERS", 2
+        ):
+            jobmanager.run_pending_jobs()
+
+        results = report_job_results_mock.call_args[0][0]
+        assert [r["id"] for r in results] == ["1", "2"]
+
+    def test_run_pending_jobs_without_report(self, tmpdir):
+        report_job_results_mock = mock.MagicMock()
+        jobmanager.report_job_results = report_job_results_mock
+
+        jobs = tmpdir.mkdir("jobs")
+        self._make_pending_job(jobs, 1, "echo done")
+
+        with mock.patch("os2borgerpc.client.jobmanager.JOBS_DIR", jobs), mock.patch(
+            "os2borgerpc.client.jobmanager.LocalJob.report_data",
+            new_callable=mock.PropertyMock,
+        ) as report_data_mock:
+            jobmanager.run_pending_jobs(report=False)
+
+        assert jobs.join("1").join("status").read() == "DONE"
+        # The log is left for send_unsent_jobs to read
+        report_data_mock.assert_not_called()
+        report_job_results_mock.assert_not_called()
+
+    @freeze_time("2022-01-01 12:00:00")
+    def test_index_is_repaired_from_status_files(self, tmpdir):
+        jobs = tmpdir.mkdir("jobs")
+        self._make_pending_job(jobs, 1, "true")
+        self._make_pending_job(jobs, 2, "true")
+
+        with mock.patch("os2borgerpc.client.jobmanager.JOBS_DIR", jobs):
+            jobmanager.get_job_index()
+            # Killed after writing the status files, before updating the index
+            jobs.join("1").join("status").write("RUNNING")
+            jobs.join("1").join("started").write("2022-01-01 10:00:00.000000")
+            job_2 = jobmanager.LocalJob(path=str(jobs.join("2")))
+            job_2.set_status("RUNNING")
+            jobs.join("2").join("status").write("DONE")
+
+            jobmanager.run_pending_jobs(report=False)
+            jobmanager.fail_unfinished_jobs()
+
+            # The stuck job is found and failed, the finished one left alone
+            assert jobmanager.get_job_dirs(["FAILED"]) == [str(jobs.join("1"))]
+            assert jobmanager.get_job_dirs(["DONE"]) == [str(jobs.join("2"))]
+        assert jobs.join("2").join("status").read() == "DONE"
+
+    def test_run_pending_jobs_resource_limits(self, tmpdir):
+        report_job_results_mock = mock.MagicMock()
+        jobmanager.report_job_results = report_job_results_mock
+
+        jobs = tmpdir.mkdir("jobs")
+        self._make_pending_job(jobs, 1, "nice")
+        jobs.join("1").join("resource_limits.json").write('{"nice": 7}')
+
+        with mock.patch("os2borgerpc.client.jobmanager.JOBS_DIR", jobs):
+            jobmanager.run_pending_jobs()
+
+        assert "\n7\n" in jobs.join("1").join("output.log").read()
+        (result,) = report_job_results_mock.call_args[0][0]
+        assert set(result["resource_usage"]) == {"peak_rss_kb", "cpu_time"}
+        assert result["resource_usage"]["peak_rss_kb"] > 0
+
+    @mock.patch(
+        "os2borgerpc.client.jobmanager.check_outstanding_packages", lambda: None
+    )
+    def test_send_unsent_jobs_in_pages(self, tmpdir):
+        jobs = tmpdir.mkdir("jobs")
+        for job_id in range(1, 8):
+            job = jobs.join(str(job_id))
+            job.join("status").write("DONE", mode="w+", ensure=True)
+            log = "x" * (600 if job_id == 3 else 10)
+            job.join("output.log").write(log, mode="w+", ensure=True)
+
+        # The third page fails, so it and later pages are kept for next time
+        report_job_results_mock = mock.MagicMock(side_effect=[0, 0, 1])
+        jobmanager.report_job_results = report_job_results_mock
+
+        with mock.patch(
+            "os2borgerpc.client.jobmanager.JOBS_DIR", jobs
+        ), mock.patch.object(
+            jobmanager, "DEFAULT_REPORT_PAGE_SIZE", 3
+        ), mock.patch.object(
+            jobmanager, "DEFAULT_REPORT_PAGE_BYTES", 500
+        ):
+            jobmanager.send_unsent_jobs()
+            unsent = jobmanager.get_job_dirs(["DONE"], unsent_only=True)
+
+        pages = [
+            [job["id"] for job in call[0][0]]
+            for call in report_job_results_mock.call_args_list
+        ]
+        # Job 3 doesn't fit with others in the byte budget, but is sent alone
+        assert pages == [["1", "2"], ["3"], ["4", "5", "6"]]
+        assert unsent == [str(jobs.join(str(i))) for i in range(4, 8)]
+
+    def test_long_logs_are_stored_compressed(self, tmpdir):
+        report_job_results_mock = mock.MagicMock()
+        jobmanager.report_job_results = report_job_results_mock
+
+        jobs = tmpdir.mkdir("jobs")
+        self._make_pending_job(jobs, 1, "yes line | head -n 2000")
+        self._make_pending_job(jobs, 2, "echo short")
+
+        with mock.patch("os2borgerpc.client.jobmanager.JOBS_DIR", jobs):
+            jobmanager.run_pending_jobs()
+            job = jobmanager.LocalJob(id=1)
+            job.logline(">>> Appended later")
+            log_output = job.log_output
+
+        assert not jobs.join("1").join("output.log").check()
+        assert jobs.join("1").join("output.log.gz").size() < 4096
+        assert "\nline\nline\n>>> Succeeded at " in log_output
+        assert log_output.endswith("\n>>> Appended later\n")
+        assert jobs.join("2").join("output.log").check()
+        assert not jobs.join("2").join("output.log.gz").check()
+
+    @mock.patch("os2borgerpc.client.jobmanager.get_url_and_uid", lambda: ("url", "uid"))
+    @mock.patch(
+        "os2borgerpc.client.jobmanager.check_outstanding_packages", lambda: None
+    )
+    def test_report_compressed_logs(self):
+        os2borgerpcadmin_mock = mock.MagicMock()
+        os2borgerpcadmin_mock.return_value.send_status_info.return_value = 0
+        long_log = "line\n" * 1000
+
+        with mock.patch.object(
+            jobmanager, "get_admin", os2borgerpcadmin_mock
+        ), mock.patch.object(jobmanager, "server_capabilities", set()) as caps:
+            joblist = [{"id": 1, "log_output": long_log}]
+            report_job_results(joblist)
+            assert joblist == [{"id": 1, "log_output": long_log}]
+
+            caps.add(jobmanager.COMPRESSED_LOG_CAPABILITY)
+            joblist = [{"id": 1, "log_output": long_log}, {"id": 2, "log_output": ""}]
+            report_job_results(joblist)
+
+        sent = os2borgerpcadmin_mock.return_value.send_status_info.call_args[0][2]
+        assert "log_output" not in sent[0]
+        assert gzip.decompress(sent[0]["log_output_gzip"].data).decode() == long_log
+        assert sent[1] == {"id": 2, "log_output": ""}
+
+    def test_logs_are_sanitized_when_jobs_finish(self, tmpdir):
+        report_job_results_mock = mock.MagicMock()
+        jobmanager.report_job_results = report_job_results_mock
+
+        jobs = tmpdir.mkdir("jobs")
+        self._make_pending_job(jobs, 1, "printf 'progress\\r\\033[32mdone\\033[0m\\n'")
+
+        with mock.patch("os2borgerpc.client.jobmanager.JOBS_DIR", jobs):
+            jobmanager.run_pending_jobs()
+
+        assert "\nprogress[32mdone[0m\n" in jobs.join("1").join("output.log").read()
+
+    def test_finished_logs_are_not_sanitized_again(self, tmpdir):
+        report_job_results_mock = mock.MagicMock(return_value=0)
+        jobmanager.report_job_results = report_job_results_mock
+
+        jobs = tmpdir.mkdir("jobs")
+        self._make_pending_job(jobs, 1, "echo done")
+        # Finished by an older client
+        old_job = jobs.join("2")
+        old_job.join("status").write("DONE", mode="w+", ensure=True)
+        old_job.join("output.log").write("bell\a", mode="w+", ensure=True)
+
+        with mock.patch("os2borgerpc.client.jobmanager.JOBS_DIR", jobs):
+            jobmanager.run_pending_jobs(report=False)
+            with mock.patch.object(
+                jobmanager, "sanitize_log", wraps=jobmanager.sanitize_log
+            ) as sanitize_mock:
+                jobmanager.send_unsent_jobs()
+
+        sanitize_mock.assert_called_once_with("bell\a")
+        sent = report_job_results_mock.call_args[0][0]
+        assert [job["log_output"] for job in sent][1] == "bell"
+
+    def test_failed_outbox_calls_are_kept(self, tmpdir):
+        remote = mock.MagicMock()
+
+        with mock.patch(
+            "os2borgerpc.client.jobmanager.OUTBOX_FILE", str(tmpdir.join("outbox"))
+        ), mock.patch("os2borgerpc.client.jobmanager.JOBS_DIR", tmpdir.mkdir("jobs")):
+            jobmanager.get_outbox().put("push_security_events", ["uid", ["event"]])
+            # The admin site couldn't store the events
+            remote.multicall.return_value = [1]
+            jobmanager.send_checkin_results(remote, "uid")
+            assert len(jobmanager.get_outbox()) == 1
+
+            remote.multicall.return_value = [0]
+            jobmanager.send_checkin_results(remote, "uid")
+            assert len(jobmanager.get_outbox()) == 0
+
+        assert remote.multicall.call_count == 2
+
+    @mock.patch(
+        "os2borgerpc.client.jobmanager.check_outstanding_packages", lambda: (0, 0)
+    )
+    def test_send_checkin_results(self, tmpdir):
+        jobs = tmpdir.mkdir("jobs")
+        for job_id in range(1, 4):
+            job = jobs.join(str(job_id))
+            job.join("status").write("DONE", mode="w+", ensure=True)
+            job.join("output.log").write("log %d" % job_id, mode="w+", ensure=True)
+        remote = mock.MagicMock()
+        remote.multicall.return_value = [0, 0]
+        report_job_results_mock = mock.MagicMock(return_value=0)
+        jobmanager.report_job_results = report_job_results_mock
+
+        with mock.patch(
+            "os2borgerpc.client.jobmanager.JOBS_DIR", jobs
+        ), mock.patch.object(jobmanager, "DEFAULT_REPORT_PAGE_SIZE", 2), mock.patch(
+            "os2borgerpc.client.jobmanager.OUTBOX_FILE", str(tmpdir.join("outbox"))
+        ):
+            jobmanager.get_outbox().put("push_security_events", ["uid", ["event"]])
+            jobmanager.send_checkin_results(remote, "uid")
+            unsent = jobmanager.get_job_dirs(["DONE"], unsent_only=True)
+            outbox_left = len(jobmanager.get_outbox())
+
+        # The outbox and the first page go in one round trip
+        (calls,), _ = remote.multicall.call_args
+        assert [name for name, _ in calls] == [
+            "push_security_events",
+            "send_status_info",
+        ]
+        assert calls[0][1] == ["uid", ["event"]]
+        assert [job["id"] for job in calls[1][1][2]] == ["1", "2"]
+        # The rest of the backlog follows
+        assert report_job_results_mock.call_args == mock.call(
+            [
+                {
+                    "id": "3",
+                    "status": "DONE",
+                    "started": None,
+                    "finished": None,
+                    "log_output": "log 3",
+                }
+            ],
+            update_required=(0, 0),
+        )
+        assert unsent == []
+        assert outbox_left == 0
+
+    @mock.patch("os2borgerpc.client.jobmanager.get_url_and_uid", lambda: ("url", "uid"))
+    @mock.patch("os2borgerpc.client.jobmanager.has_config", lambda key: False)
+    def test_update_and_run_offline(self, tmpdir):
+        jobs = tmpdir.mkdir("jobs")
+        self._make_pending_job(jobs, 1, "echo ran")
+        remote = mock.MagicMock()
+        remote.multicall.side_effect = ConnectionRefusedError()
+        config_mock = mock.MagicMock()
+        config_mock.return_value.get_data.return_value = {}
+
+        with mock.patch("os2borgerpc.client.jobmanager.JOBS_DIR", jobs), mock.patch(
+            "os2borgerpc.client.jobmanager.LOCK_FILE", str(tmpdir.join("running"))
+        ), mock.patch(
+            "os2borgerpc.client.jobmanager.CIRCUIT_BREAKER_FILE",
+            str(tmpdir.join("breaker.json")),
+        ), mock.patch(
+            "os2borgerpc.client.jobmanager.OUTBOX_FILE", str(tmpdir.join("outbox"))
+        ), mock.patch(
+            "os2borgerpc.client.jobmanager.MULTICALL_SUPPORT_FILE",
+            str(tmpdir.join("multicall.json")),
+        ), mock.patch.object(
+            jobmanager, "get_admin", return_value=remote
+        ), mock.patch.object(
+            jobmanager, "OS2borgerPCConfig", config_mock
+        ):
+            jobmanager.update_and_run()
+            queued = len(jobmanager.get_outbox())
+            for _ in range(4):
+                jobmanager.update_and_run()
+            outbox_left = len(jobmanager.get_outbox())
+
+        # Imported jobs still run, and are sent once the admin site is back
+        assert jobs.join("1").join("status").read() == "DONE"
+        assert "\nran\n" in jobs.join("1").join("output.log").read()
+        assert not jobs.join("1").join("sent").check()
+        # After three failures the circuit breaker stops contacting the site
+        assert remote.multicall.call_count == 3
+        # The config values are queued only once
+        assert queued and outbox_left == queued
+
+    @mock.patch("os2borgerpc.client.jobmanager.get_url_and_uid", lambda: ("url", "uid"))
+    def test_update_and_run_admin_site_error(self, tmpdir, capsys):
+        jobs = tmpdir.mkdir("jobs")
+        self._make_pending_job(jobs, 1, "echo ran")
+        remote = mock.MagicMock()
+        remote.multicall.return_value = [xmlrpc.client.Fault(1, "Server error")]
+        config_mock = mock.MagicMock()
+        config_mock.return_value.get_data.return_value = {}
+
+        with mock.patch("os2borgerpc.client.jobmanager.JOBS_DIR", jobs), mock.patch(
+            "os2borgerpc.client.jobmanager.LOCK_FILE", str(tmpdir.join("running"))
+        ), mock.patch(
+            "os2borgerpc.client.jobmanager.CIRCUIT_BREAKER_FILE",
+            str(tmpdir.join("breaker.json")),
+        ), mock.patch(
+            "os2borgerpc.client.jobmanager.OUTBOX_FILE", str(tmpdir.join("outbox"))
+        ), mock.patch(
+            "os2borgerpc.client.jobmanager.MULTICALL_SUPPORT_FILE",
+            str(tmpdir.join("multicall.json")),
+        ), mock.patch.object(
+            jobmanager, "get_admin", return_value=remote
+        ), mock.patch.object(
+            jobmanager, "OS2borgerPCConfig", config_mock
+        ), mock.patch.object(
+            jobmanager, "archive_old_jobs", side_effect=OSError(28, "No space left")
+        ) as archive_mock:
+            jobmanager.update_and_run()
+
+        # Local work goes on when the admin site fails
+        assert jobs.join("1").join("status").read() == "DONE"
+        archive_mock.assert_called_once()
+        out = capsys.readouterr().out
+        assert "Admin site error, only running local jobs" in out
+        # Local errors aren't mistaken for the lock being taken
+        assert "Error during check-in" in out
+        assert "Couldn't get lock" not in out
+
+    def test_multicall_support_is_remembered(self, tmpdir):
+        remote = mock.MagicMock()
+        remote.supports_multicall.return_value = True
+
+        with mock.patch(
+            "os2borgerpc.client.jobmanager.MULTICALL_SUPPORT_FILE",
+            str(tmpdir.join("multicall.json")),
+        ):
+            with freeze_time("2022-01-01 12:00:00") as frozen:
+                for _ in range(3):
+                    remote.multicall_supported = None
+                    jobmanager.configure_multicall(remote, "http://admin/")
+                    assert remote.multicall_supported is True
+                assert remote.supports_multicall.call_count == 1
+
+                # Asked again for another admin site, and once in a while
+                jobmanager.configure_multicall(remote, "http://other/")
+                frozen.tick(jobmanager.MULTICALL_CHECK_INTERVAL)
+                jobmanager.configure_multicall(remote, "http://other/")
+                assert remote.supports_multicall.call_count == 3
+
+    def test_unchanged_configuration_is_not_written(self, tmpdir):
+        conf = tmpdir.join("os2borgerpc.conf")
+        conf.write("admin_url: http://admin.example/\nhostname: pc\n")
+        configuration = {"admin_url": "http://admin.example/", "hostname": "pc"}
+
+        with mock.patch.object(
+            jobmanager,
+            "OS2borgerPCConfig",
+            lambda: config.OS2borgerPCConfig([str(conf)]),
+        ):
+            # Written once to create the snapshot
+            assert jobmanager.update_configuration_from_server(configuration)
+            mtime = conf.mtime()
+            assert not jobmanager.update_configuration_from_server(configuration)
+            assert conf.mtime() == mtime
+            configuration["hostname"] = "pc2"
+            assert jobmanager.update_configuration_from_server(configuration)
+
+        assert "hostname: pc2" in conf.read()
+
+    def test_configuration_digest_follows_local_changes(self, tmpdir):
+        conf = tmpdir.join("os2borgerpc.conf")
+        configuration = {"admin_url": "http://admin.example/", "hostname": "pc"}
+        instructions = {
+            "capabilities": ["instruction_digests"],
+            "configuration": configuration,
+        }
+
+        with mock.patch.object(
+            jobmanager,
+            "OS2borgerPCConfig",
+            lambda: config.OS2borgerPCConfig([str(conf)]),
+        ), mock.patch(
+            "os2borgerpc.client.jobmanager.INSTRUCTION_DIGESTS_FILE",
+            str(tmpdir.join("digests.json")),
+        ):
+            jobmanager.update_configuration_from_server(configuration)
+            jobmanager.save_instruction_digests(instructions, None)
+            digests = jobmanager.get_instruction_digests()
+            assert digests["configuration"] == utils.json_digest(configuration)
+
+            # Changed by a job, so the admin site should send it again
+            config.set_config("hostname", "changed", [str(conf)])
+            digests = jobmanager.get_instruction_digests()
+            assert digests["configuration"] != utils.json_digest(configuration)
+
+    @freeze_time("2022-01-01 12:00:00")
+    def test_fetch_instructions_with_digests(self, tmpdir):
+        remote = mock.MagicMock()
+        instructions = {
+            "capabilities": ["instruction_digests"],
+            "configuration": {"hostname": "pc"},
+            "security_scripts": [],
+            "jobs": [],
+        }
+        conf = tmpdir.join("os2borgerpc.conf")
+        conf.write("hostname: pc\n")
+
+        with mock.patch(
+            "os2borgerpc.client.jobmanager.OUTBOX_FILE", str(tmpdir.join("outbox"))
+        ), mock.patch(
+            "os2borgerpc.client.jobmanager.INSTRUCTION_DIGESTS_FILE",
+            str(tmpdir.join("digests.json")),
+        ), mock.patch.object(
+            jobmanager,
+            "OS2borgerPCConfig",
+            lambda: config.OS2borgerPCConfig([str(conf)]),
+        ):
+            assert jobmanager.get_instruction_digests() is None
+            jobmanager.save_instruction_digests(instructions, None)
+            digests = jobmanager.get_instruction_digests()
+
+            # The admin site leaves out what matches the digests
+            remote.multicall.return_value = [
+                {"capabilities": ["instruction_digests"], "jobs": []}
+            ]
+            conditional = jobmanager.fetch_instructions(remote, "uid", digests)
+            jobmanager.save_instruction_digests(conditional, digests)
+            assert jobmanager.get_instruction_digests() == digests
+
+            # A server that doesn't know digests makes them be forgotten
+            remote.multicall.return_value = [xmlrpc.client.Fault(1, "Bad args")]
+            with pytest.raises(xmlrpc.client.Fault):
+                jobmanager.fetch_instructions(remote, "uid", digests)
+            assert jobmanager.get_instruction_digests() is None
+
+            # All instructions are fetched again once in a while
+            jobmanager.save_instruction_digests(instructions, None)
+            with freeze_time("2022-01-02 12:00:00"):
+                assert jobmanager.get_instruction_digests() is None
+
+        assert digests == {
+            "configuration": utils.json_digest({"hostname": "pc"}),
+            "security_scripts": utils.json_digest([]),
+        }
+        (calls,), _ = remote.multicall.call_args
+        assert calls == [("get_instructions", ("uid", digests))]
@@ -0,0 +1,80 @@
+from types import SimpleNamespace
+from unittest import mock
+
+from os2borgerpc.client import jobresources
+
+
+class TestLimitCommand:
+    @mock.patch("os2borgerpc.client.jobresources.has_systemd", lambda: True)
+    @mock.patch("shutil.which", lambda name: "/usr/bin/" + name)
+    def test_all_limits(self):
+        limits = {
+            "systemd_scope": "true",
+            "memory_max": "1G",
+            "cpu_quota": "50",
+            "nice": "10",
+            "ionice_class": 3,
+            "rlimit_as": 2**31,
+            "rlimit_cpu": 600,
+        }
+
+        assert jobresources.limit_command(["/job/executable", "arg"], limits) == [
+            "systemd-run",
+            "--scope",
+            "--quiet",
+            "--collect",
+            "-p",
+            "MemoryMax=1G",
+            "-p",
+            "CPUQuota=50%",
+            "nice",
+            "-n",
+            "10",
+            "ionice",
+            "-c",
+            "3",
+            "prlimit",
+            "--as=2147483648",
+            "--cpu=600",
+            "--",
+            "/job/executable",
+            "arg",
+        ]
+
+    @mock.patch("os2borgerpc.client.jobresources.has_systemd", lambda: False)
+    @mock.patch("shutil.which", lambda name: None if name == "ionice" else name)
+    def test_unavailable_wrappers_are_skipped(self):
+        limits = {"systemd_scope": True, "ionice_class": 3, "nice": ""}
+
+        assert jobresources.limit_command(["job"], limits) == ["job"]
+
+    @mock.patch("os2borgerpc.client.jobresources.has_systemd", lambda: True)
+    @mock.patch("shutil.which", lambda name: "/usr/bin/" + name)
+    def test_invalid_limits_are_skipped(self, capsys):
+        limits = {
+            "systemd_scope": "true",
+            "cpu_quota": "50%",
+            "nice": "low",
+            "rlimit_as": "1G",
+            "rlimit_cpu": 600,
+        }
+
+        assert jobresources.limit_command(["job"], limits) == [
+            "systemd-run",
+            "--scope",
+            "--quiet",
+            "--collect",
+            "prlimit",
+            "--cpu=600",
+            "--",
+            "job",
+        ]
+        assert "Ignoring invalid job limit nice: 'low'" in capsys.readouterr().err
+
+    def test_get_usage(self):
+        rusage = SimpleNamespace(ru_maxrss=2048, ru_utime=1.25, ru_stime=0.5)
+
+        assert jobresources.get_usage(rusage) == {
+            "peak_rss_kb": 2048,
+            "cpu_time": 1.75,
+        }
@@ -0,0 +1,108 @@
+import socketserver
+import threading
+import time
+from unittest import mock
+from xmlrpc.server import SimpleXMLRPCRequestHandler
+from xmlrpc.server import SimpleXMLRPCServer
+
+import pytest
+
+from os2borgerpc.client.longpoll import InstructionWatcher
+
+
+class ThreadingXMLRPCServer(socketserver.ThreadingMixIn, SimpleXMLRPCServer):
+    # Don't wait for kept alive connections on shutdown
+    daemon_threads = True
+    block_on_close = False
+
+
+class KeepAliveHandler(SimpleXMLRPCRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+
+class InstructionChannel:
+    """Stand-in for the long polls of the admin site."""
+
+    def __init__(self):
+        self.token = "1"
+        self.changed = threading.Condition()
+
+    def new_job(self):
+        with self.changed:
+            self.token = str(int(self.token) + 1)
+            self.changed.notify_all()
+
+    def wait_for_instructions(self, pc_uid, token, timeout):
+        with self.changed:
+            self.changed.wait_for(lambda: self.token != token, timeout)
+            return self.token
+
+
+@pytest.fixture
+def channel():
+    channel = InstructionChannel()
+    server = ThreadingXMLRPCServer(
+        ("127.0.0.1", 0),
+        requestHandler=KeepAliveHandler,
+        allow_none=True,
+        logRequests=False,
+    )
+    server.register_function(channel.wait_for_instructions)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    channel.url = "http://127.0.0.1:%d/RPC2" % server.server_address[1]
+    yield channel
+    server.shutdown()
+    server.server_close()
+
+
+class TestInstructionWatcher:
+    def test_wakes_on_new_instructions(self, channel):
+        woken = threading.Event()
+        watcher = InstructionWatcher(channel.url, "uid", woken.set, timeout=5)
+        watcher.start()
+        try:
+            # The first poll only learns the current token
+            assert not woken.wait(0.3)
+            start = time.monotonic()
+            channel.new_job()
+            assert woken.wait(2)
+            assert time.monotonic() - start < 1
+        finally:
+            watcher.stop()
+            channel.new_job()
+            watcher.join(timeout=5)
+
+        assert not watcher.is_alive()
+        assert watcher.token == "2"
+
+    def test_poll_timeout(self, channel):
+        on_instructions = mock.MagicMock()
+        watcher = InstructionWatcher(channel.url, "uid", on_instructions, timeout=0)
+
+        assert not watcher.poll()
+        assert not watcher.poll()
+        on_instructions.assert_not_called()
+
+    @mock.patch("os2borgerpc.client.longpoll.RETRY_DELAY", 0.05)
+    @mock.patch("os2borgerpc.client.longpoll.SUPPORT_CHECK_INTERVAL", 0.05)
+    def test_falls_back_to_polling(self, channel):
+        supported = threading.Event()
+        watcher = InstructionWatcher(
+            channel.url, "uid", mock.MagicMock(), is_supported=supported.is_set
+        )
+        watcher.admin = mock.MagicMock()
+        watcher.admin.wait_for_instructions.side_effect = ConnectionRefusedError()
+        watcher.start()
+        try:
+            # Nothing is polled until the admin site supports it
+            time.sleep(0.2)
+            assert watcher.polls == 0
+            supported.set()
+            # Errors are retried with a backoff
+            time.sleep(0.5)
+        finally:
+            watcher.stop()
+            watcher.join(timeout=5)
+
+        assert 2 <= watcher.polls <= 5
@@ -0,0 +1,96 @@
+from freezegun import freeze_time
+
+from os2borgerpc.client.outbox import Outbox
+
+
+class TestOutbox:
+    def test_calls_are_coalesced(self, tmpdir):
+        outbox = Outbox(str(tmpdir.join("state").join("outbox.jsonl")))
+        outbox.put_config("uid", {"hostname": "pc1", "job_timeout": "900"})
+        outbox.put("push_security_events", ["uid", ["event 1"]])
+        outbox.put_config("uid", {"hostname": "pc2"})
+        # Unchanged values aren't queued again
+        outbox.put_config("uid", {"hostname": "pc2", "job_timeout": "900"})
+        outbox.put("push_security_events", ["uid", ["event 2"]])
+
+        calls = outbox.pending_calls()
+
+        assert len(outbox) == 4
+        # The config values are pushed in one call, in the place of the first
+        assert [(call.method, call.args) for call in calls] == [
+            ("push_config_keys", ["uid", {"hostname": "pc2", "job_timeout": "900"}]),
+            ("push_security_events", ["uid", ["event 1"]]),
+            ("push_security_events", ["uid", ["event 2"]]),
+        ]
+        # Superseded entries are removed along with the latest
+        assert len(calls[0].entry_ids) == 3
+
+        outbox.acknowledge(calls[:2])
+        assert [entry["args"] for entry in outbox.entries()] == [["uid", ["event 2"]]]
+        outbox.acknowledge(outbox.pending_calls())
+        assert len(outbox) == 0
+        assert tmpdir.join("state").join("outbox.jsonl").read() == ""
+
+    def test_flush_size(self, tmpdir):
+        outbox = Outbox(str(tmpdir.join("outbox.jsonl")))
+        for i in range(5):
+            outbox.put("push_security_events", ["uid", [str(i)]])
+
+        calls = outbox.pending_calls(max_entries=2)
+
+        assert [call.args[1] for call in calls] == [["0"], ["1"]]
+
+    def test_corrupt_lines_are_skipped(self, tmpdir):
+        path = tmpdir.join("outbox.jsonl")
+        outbox = Outbox(str(path))
+        outbox.put("push_security_events", ["uid", ["event"]])
+        # A write cut short by a crash
+        path.write('{"id": "abc", "meth', mode="a")
+        outbox.put_config("uid", {"hostname": "pc"})
+
+        assert [call.method for call in outbox.pending_calls()] == [
+            "push_security_events",
+            "push_config_keys",
+        ]
+        assert len(Outbox(str(tmpdir.join("missing.jsonl")))) == 0
+
+    def test_only_changed_config_is_pushed(self, tmpdir):
+        outbox = Outbox(str(tmpdir.join("outbox.jsonl")))
+        values = {"_os_name": "Ubuntu", "_kernel_version": "5.15"}
+
+        def push(config_dict, rejected=False):
+            outbox.put_config(
+                "uid", config_dict, changed_only=True, resync_interval=3600
+            )
+            calls = outbox.pending_calls()
+            outbox.acknowledge(calls, calls if rejected else ())
+            return [call.args[1] for call in calls]
+
+        with freeze_time("2022-01-01 12:00:00") as frozen:
+            assert push(values) == [values]
+            assert push(values) == []
+            values["_kernel_version"] = "6.1"
+            assert push(values) == [{"_kernel_version": "6.1"}]
+            # Rejected values are sent again
+            values["_os_name"] = "Debian"
+            assert push(values, rejected=True) == [{"_os_name": "Debian"}]
+            assert push(values) == [{"_os_name": "Debian"}]
+            assert push(values) == []
+
+            # Everything is pushed again once in a while
+            frozen.tick(3600)
+            assert push(values) == [values]
+
+    def test_changed_back_while_queued(self, tmpdir):
+        outbox = Outbox(str(tmpdir.join("outbox.jsonl")))
+
+        def put(value):
+            outbox.put_config("uid", {"_ip": value}, changed_only=True)
+
+        put("A")
+        outbox.acknowledge(outbox.pending_calls())
+        # Offline, the value changes and changes back
+        put("B")
+        put("A")
+
+        assert [call.args[1] for call in outbox.pending_calls()] == [{"_ip": "A"}]
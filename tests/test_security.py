@@ -51,9 +51,9 @@ class TestSendSecurityEvents:
         "os2borgerpc.client.security.security.get_url_and_uid", lambda: ("url", "uid")
     )
     def test_send_security_events_success(self, tmpdir):
-        # Mock OS2borgerPCAdmin and return a success value on 'push_security_events'.
+        # Mock get_admin and return a success value on 'push_security_events'.
         os2borgerpcadmin_mock = mock.MagicMock()
-        security.OS2borgerPCAdmin = os2borgerpcadmin_mock
+        security.get_admin = os2borgerpcadmin_mock
         os2borgerpcadmin_mock.return_value.push_security_events.return_value = 0
 
         security_events = [
@@ -84,9 +84,9 @@ class TestSendSecurityEvents:
         "os2borgerpc.client.security.security.get_url_and_uid", lambda: ("url", "uid")
     )
     def test_send_security_events_failed(self, tmpdir):
-        # Mock OS2borgerPCAdmin and return a failed value on 'push_security_events'.
+        # Mock get_admin and return a failed value on 'push_security_events'.
         os2borgerpcadmin_mock = mock.MagicMock()
-        security.OS2borgerPCAdmin = os2borgerpcadmin_mock
+        security.get_admin = os2borgerpcadmin_mock
         # Server should return 1 or an integer other than 0.
         os2borgerpcadmin_mock.return_value.push_security_events.return_value = 1
 
@@ -292,3 +292,25 @@ class TestUpdateLastSecurityEventsCheckedTime:
             security.update_last_security_events_checked_time(now)
 
         assert lastcheck.read() == "20220101120101"
+
+
+class TestPrepareSecurityEvents:
+    def test_unchanged_scripts_are_kept(self, tmpdir):
+        security_dir = Path(tmpdir.mkdir("security"))
+        run_mock = mock.MagicMock()
+        with mock.patch.multiple(
+            "os2borgerpc.client.security.security",
+            SECURITY_DIR=security_dir,
+            run_security_scripts=run_mock,
+            collect_security_events=lambda now: ["event"],
+        ):
+            scripts = [{"name": "check", "executable_code": "#!/bin/sh\n"}]
+            assert security.prepare_security_events(scripts)[1] == ["event"]
+            # None means the scripts imported before are unchanged
+            assert security.prepare_security_events(None)[1] == ["event"]
+            assert (security_dir / "s_check").exists()
+            # An empty list removes them
+            assert security.prepare_security_events([])[1] == []
+            assert security.prepare_security_events(None)[1] == []
+
+        assert run_mock.call_count == 2
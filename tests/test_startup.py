@@ -0,0 +1,73 @@
+import os.path
+import subprocess
+import sys
+
+import pytest
+
+from os2borgerpc.client.config import set_config
+
+BIN_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "bin")
+
+# Modules which are slow to import and must stay off the startup path
+SLOW_MODULES = {"pkg_resources", "chardet", "distro", "semver", "requests"}
+
+
+def import_times(script, *args):
+    """
+    Return the modules imported when starting script, with import times.
+
+    The times are the cumulative seconds of the top-level imports, as
+    reported by python -X importtime, leaving out the site module.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", os.path.join(BIN_DIR, script), *args],
+        capture_output=True,
+        text=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not name.startswith("  ") and name.strip() != "site":
+            times[name.strip()] = int(cumulative) / 1e6
+        times.setdefault(name.strip(), 0)
+    return times
+
+
+@pytest.mark.parametrize(
+    "script,args,budget",
+    [
+        ("jobmanager", ["--help"], 0.25),
+        ("get_os2borgerpc_config", [], 0.1),
+        ("set_os2borgerpc_config", [], 0.1),
+    ],
+)
+def test_import_time_budget(script, args, budget):
+    # The best of a few runs, to even out noise
+    runs = [import_times(script, *args) for _ in range(3)]
+
+    assert not SLOW_MODULES & set(runs[0])
+    assert min(sum(times.values()) for times in runs) < budget
+
+
+def test_config_cli_reads_snapshot(tmpdir):
+    conf = tmpdir.join("os2borgerpc.conf")
+    set_config("hostname", "pc", [str(conf)])
+
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            os.path.join(BIN_DIR, "get_os2borgerpc_config"),
+            "hostname",
+            str(conf),
+        ],
+        capture_output=True,
+        text=True,
+    )
+
+    assert result.stdout == "pc\n"
+    # The value is looked up without loading YAML
+    assert "| yaml" not in result.stderr